@@ -5,11 +5,13 @@ SOURCES += src/als/main.py \
   src/als/crunching.py \
   src/als/config.py \
   src/als/processing.py \
+  src/als/calibration.py \
   src/als/model/data.py \
   src/als/model/base.py \
   src/als/model/params.py \
   src/als/streams/network.py \
   src/als/streams/input.py \
+  src/als/streams/folder.py \
   src/als/streams/output.py \
   src/als/ui/params_utils.py \
   src/als/ui/widgets.py \
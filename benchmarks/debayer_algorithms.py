@@ -0,0 +1,149 @@
+"""
+Measures debayering algorithms speed and their effect on alignment reliability.
+
+Each sample image is debayered with each algorithm. We measure debayering time, then try and find the alignment
+transform of each debayered sample against the first one, as the stacker does : on the green channel of color images,
+on raw bayer data for images left for debayering at output.
+
+For DEBAYER_AT_OUTPUT, debayering time is the one of debayering a float stacking result, which happens once per
+stacking result instead of once per frame.
+
+Usage :
+
+    python benchmarks/debayer_algorithms.py [-s image_samples] [-r 5]
+
+This script uses the regular ALS config setup, but never saves it.
+"""
+import statistics
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import astroalign as al
+
+from als import config
+from als.crunching import bilinear_debayer
+from als.model.base import PhotoProfile, DEBAYER_SUPERPIXEL, DEBAYER_BILINEAR, DEBAYER_EDGE_AWARE, DEBAYER_VNG, \
+    DEBAYER_AT_OUTPUT
+from als.processing import Debayer, Standardize
+from als.streams.input import read_disk_image
+
+_ALGORITHMS = [DEBAYER_SUPERPIXEL, DEBAYER_BILINEAR, DEBAYER_EDGE_AWARE, DEBAYER_VNG, DEBAYER_AT_OUTPUT]
+
+
+class BenchmarkProfile(PhotoProfile):
+    """
+    Photo profile using a specific debayering algorithm
+    """
+    def __init__(self, algorithm: str):
+        super().__init__()
+        self._debayer_algorithm = algorithm
+
+
+def measure_debayering(samples, algorithm: str, repeat_count: int):
+    """
+    Measures debayering time of all samples
+
+    :param samples: the raw sample images
+    :type samples: list
+
+    :param algorithm: the debayering algorithm
+    :type algorithm: str
+
+    :param repeat_count: how many times each sample is debayered
+    :type repeat_count: int
+
+    :return: a tuple of 2 elements : median debayering time in ms and debayered standardized samples
+    :rtype: tuple
+    """
+    debayer = Debayer(BenchmarkProfile(algorithm))
+    standardize = Standardize()
+    durations = []
+    results = []
+
+    for sample in samples:
+        for _ in range(repeat_count):
+            image = sample.clone()
+
+            start = time.perf_counter()
+            if algorithm == DEBAYER_AT_OUTPUT:
+                bilinear_debayer(image.data.astype('float32'), image.bayer_pattern)
+            else:
+                image = debayer.process_image(image)
+            durations.append((time.perf_counter() - start) * 1000)
+
+        results.append(standardize.process_image(debayer.process_image(sample.clone())))
+
+    return statistics.median(durations), results
+
+
+def measure_alignment(images, minimum_match_count: int):
+    """
+    Finds alignment transform of all images against the first one
+
+    :param images: the debayered standardized images
+    :type images: list
+
+    :param minimum_match_count: minimum matches count for a transform to be accepted
+    :type minimum_match_count: int
+
+    :return: a tuple of 3 elements : aligned image count, mean matches count and median search time in ms
+    :rtype: tuple
+    """
+    def alignment_data(image):
+        return image.data[1] if image.is_color() else image.data
+
+    reference = alignment_data(images[0])
+    aligned_count = 0
+    match_counts = []
+    durations = []
+
+    for image in images[1:]:
+        start = time.perf_counter()
+        try:
+            _, (source_matches, _) = al.find_transform(alignment_data(image), reference)
+        # pylint: disable=W0703
+        except Exception:
+            source_matches = []
+        durations.append((time.perf_counter() - start) * 1000)
+
+        match_counts.append(len(source_matches))
+        if len(source_matches) >= minimum_match_count:
+            aligned_count += 1
+
+    return aligned_count, statistics.mean(match_counts), statistics.median(durations)
+
+
+def main():
+    """
+    Runs benchmark and prints results
+    """
+    parser = ArgumentParser()
+    parser.add_argument("-s", "--samples", default=str(Path(__file__).parent.parent / "image_samples"),
+                        help="folder holding bayer sample images")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="how many times each sample is debayered")
+    args = parser.parse_args()
+
+    config.setup()
+
+    samples = [read_disk_image(path) for path in sorted(Path(args.samples).iterdir()) if path.is_file()]
+    samples = [sample for sample in samples if sample is not None and sample.needs_debayering()]
+
+    if len(samples) < 2:
+        print(f"At least 2 bayer images are needed in {args.samples}")
+        return
+
+    print(f"{len(samples)} samples of shape {samples[0].data.shape}, {samples[0].data.dtype}, "
+          f"bayer pattern {samples[0].bayer_pattern}")
+    print(f"{'algorithm':>12} | {'debayer ms':>10} | {'aligned':>8} | {'matches':>7} | {'align ms':>8}")
+
+    for algorithm in _ALGORITHMS:
+        debayer_duration, images = measure_debayering(samples, algorithm, args.repeat)
+        aligned_count, mean_matches, align_duration = measure_alignment(images, config.get_minimum_match_count())
+
+        print(f"{algorithm:>12} | {debayer_duration:>10.2f} | {aligned_count:>3} / {len(images) - 1:<2} | "
+              f"{mean_matches:>7.1f} | {align_duration:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
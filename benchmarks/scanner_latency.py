@@ -0,0 +1,115 @@
+"""
+Measures folder scanner detection latency against scan folder size.
+
+For each requested folder size, a temporary scan folder is filled with dummy files, then a scanner is started using
+each available backend. New files are then dropped into the folder and we measure the time elapsed between file
+creation and the scanner broadcasting its path, which includes waiting for file completion.
+
+Usage :
+
+    python benchmarks/scanner_latency.py [-s 0 1000 5000] [-n 5] [-b native polling]
+
+This script uses the regular ALS config setup, but never saves it.
+"""
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+from PyQt5.QtCore import Qt
+
+from als import config
+from als.model.base import VisualProfile
+from als.streams.folder import FolderScanner, SCANNER_BACKEND_NATIVE, SCANNER_BACKEND_POLLING
+
+_DETECTION_TIMEOUT = 30
+
+
+def measure_latencies(folder: Path, backend: str, sample_count: int):
+    """
+    Measure detection latencies for a specific backend
+
+    :param folder: the scan folder
+    :type folder: Path
+
+    :param backend: the scanner backend to use
+    :type backend: str
+
+    :param sample_count: how many files to drop
+    :type sample_count: int
+
+    :return: measured latencies in ms. Timed out detections are not counted
+    :rtype: list
+    """
+    detected = threading.Event()
+    detections = dict()
+
+    def on_new_path(path):
+        detections[Path(path).name] = time.time()
+        detected.set()
+
+    scanner = FolderScanner(VisualProfile(), backend)
+    # no Qt event loop runs here, so we need our callback to be run from the scanner thread
+    scanner.new_image_path_signal[str].connect(on_new_path, Qt.DirectConnection)
+    scanner.start()
+
+    latencies = list()
+
+    try:
+        for index in range(sample_count):
+            name = f"new_{backend}_{index}.fits"
+            detected.clear()
+            created_at = time.time()
+            (folder / name).write_bytes(b"\0" * 2880)
+
+            if detected.wait(_DETECTION_TIMEOUT) and name in detections:
+                latencies.append((detections[name] - created_at) * 1000)
+            else:
+                print(f"  detection timed out for {name}")
+    finally:
+        scanner.stop()
+
+    return latencies
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = ArgumentParser()
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=[0, 1000, 5000, 10000],
+                        help="scan folder sizes (number of already present files)")
+    parser.add_argument("-n", "--samples", type=int, default=5, help="number of detections measured per run")
+    parser.add_argument("-b", "--backends", nargs="+", default=[SCANNER_BACKEND_NATIVE, SCANNER_BACKEND_POLLING],
+                        help="scanner backends to benchmark")
+    args = parser.parse_args()
+
+    config.setup()
+
+    print(f"{'files':>8} {'backend':>10} {'min (ms)':>10} {'median (ms)':>12} {'max (ms)':>10}")
+
+    for size in args.sizes:
+        folder = Path(tempfile.mkdtemp(prefix="als_scan_bench_"))
+
+        try:
+            for index in range(size):
+                (folder / f"existing_{index}.fits").write_bytes(b"")
+
+            config.set_scan_folder_path(str(folder))
+
+            for backend in args.backends:
+                latencies = measure_latencies(folder, backend, args.samples)
+                if latencies:
+                    print(f"{size:>8} {backend:>10} {min(latencies):>10.1f} "
+                          f"{statistics.median(latencies):>12.1f} {max(latencies):>10.1f}")
+                else:
+                    print(f"{size:>8} {backend:>10} {'n/a':>10} {'n/a':>12} {'n/a':>10}")
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
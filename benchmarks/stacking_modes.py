@@ -0,0 +1,127 @@
+"""
+Measures memory use and speed of stacking modes.
+
+Synthetic frames, noise over a random field, are accumulated by the accumulator of each stacking mode. We measure
+time spent adding a frame, time spent computing the stacking result and memory held per megapixel. Median is measured
+with its frame window kept in RAM, then kept on disk. Sliding mean keeps its frame window in RAM.
+
+Memory per megapixel is held memory divided by the number of pixels of a frame, whatever its color planes count.
+
+Usage :
+
+    python benchmarks/stacking_modes.py [-p 4] [-n 20] [-w 16] [--color] [--gaps]
+"""
+import statistics
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from als.accumulation import StackAccumulator, KappaSigmaAccumulator, MedianAccumulator, FrameWindow
+
+
+def generate_frames(shape: tuple, count: int, gaps: bool):
+    """
+    Generates noisy frames of a random field
+
+    :param shape: frame shape
+    :type shape: tuple
+
+    :param count: number of frames
+    :type count: int
+
+    :param gaps: do frames miss a border, as aligned frames do ?
+    :type gaps: bool
+
+    :return: list of tuples of 2 elements : frame data and its coverage
+    :rtype: list
+    """
+    random = np.random.RandomState(0)
+    field = (random.rand(*shape) * 1000).astype(np.float32)
+    frames = []
+
+    for index in range(count):
+        data = field + random.normal(0, 30, shape).astype(np.float32)
+        coverage = None
+
+        if gaps and index > 0:
+            coverage = np.ones(shape[-2:], dtype=np.uint8)
+            coverage[:, :index % 16 + 1] = 0
+
+        frames.append((data, coverage))
+
+    return frames
+
+
+def measure(accumulator: StackAccumulator, frames):
+    """
+    Accumulates all frames, then computes stacking result
+
+    :param accumulator: the accumulator
+    :type accumulator: StackAccumulator
+
+    :param frames: the frames to accumulate, as returned by generate_frames()
+    :type frames: list
+
+    :return: a tuple of 3 elements : median add time in ms, result computing time in ms and held memory in bytes
+    :rtype: tuple
+    """
+    durations = []
+
+    for data, coverage in frames:
+        start = time.perf_counter()
+        accumulator.add(data, coverage)
+        durations.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    accumulator.get_result()
+    result_duration = (time.perf_counter() - start) * 1000
+
+    held_memory = accumulator.nbytes
+    accumulator.reset()
+
+    return statistics.median(durations), result_duration, held_memory
+
+
+def main():
+    """
+    Runs benchmark and prints results
+    """
+    parser = ArgumentParser()
+    parser.add_argument("-p", "--pixels", type=float, default=4, help="frame size, in megapixels")
+    parser.add_argument("-n", "--frames", type=int, default=20, help="number of accumulated frames")
+    parser.add_argument("-w", "--window", type=int, default=16, help="median and sliding mean frame window size")
+    parser.add_argument("--color", action="store_true", help="use 3 color planes frames")
+    parser.add_argument("--gaps", action="store_true", help="frames miss a border, as aligned frames do")
+    args = parser.parse_args()
+
+    height = int((args.pixels * 1e6 * 3 / 4) ** .5)
+    width = int(args.pixels * 1e6 / height)
+    shape = (3, height, width) if args.color else (height, width)
+    megapixels = height * width / 1e6
+
+    frames = generate_frames(shape, args.frames, args.gaps)
+    window_memory_mb = args.window * frames[0][0].nbytes // 2 ** 20
+    folder = tempfile.gettempdir()
+
+    accumulators = [
+        ("mean", StackAccumulator()),
+        ("kappa-sigma", KappaSigmaAccumulator(3.)),
+        ("median RAM", MedianAccumulator(FrameWindow(args.window, window_memory_mb + 1, folder))),
+        ("median disk", MedianAccumulator(FrameWindow(args.window, 1, folder))),
+        ("sliding mean", StackAccumulator(FrameWindow(args.window, window_memory_mb + 1, folder), sliding=True)),
+    ]
+
+    print(f"{args.frames} frames of shape {shape}, {megapixels:.2f} MP")
+    print(f"{'mode':>12} | {'add ms':>8} | {'result ms':>9} | {'MB / MP':>7}")
+
+    for name, accumulator in accumulators:
+        add_duration, result_duration, held_memory = measure(accumulator, frames)
+
+        print(f"{name:>12} | {add_duration:>8.2f} | {result_duration:>9.1f} | "
+              f"{held_memory / 2 ** 20 / megapixels:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
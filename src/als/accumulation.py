@@ -0,0 +1,498 @@
+"""
+Provides stack accumulators : they hold what is needed to compute a stacking result from all stacked images, without
+keeping the images themselves. At most, a bounded window of the latest images is kept.
+
+Stacking result is only computed when it is asked for, so images stacked back to back cost a single in place
+addition each.
+"""
+import tempfile
+from logging import getLogger
+from pathlib import Path
+
+import numpy as np
+
+from als.code_utilities import log, AlsLogAdapter
+
+_LOGGER = AlsLogAdapter(getLogger(__name__), {})
+
+# below this count of accepted values, a pixel standard deviation is too rough an estimate to reject anything
+_MINIMUM_CLIPPING_COUNT = 5
+
+# kappa-sigma clipping works on strips of this many rows, so its temporary arrays stay small
+_CLIPPING_STRIP_ROWS = 16
+
+# median is computed on strips holding at most this many bytes of window data
+_MEDIAN_STRIP_BYTES = 32 * 2 ** 20
+
+
+class FrameWindow:
+    """
+    Ring buffer of the latest added image data, as float32.
+
+    Frames are kept in RAM if they fit in the memory budget. Otherwise, they are kept in a cube file on disk, in
+    given folder, mapped in memory : the system only keeps in RAM the parts of it recently read or written.
+
+    Pixels not covered by a frame are stored as NaN.
+    """
+
+    @log
+    def __init__(self, length: int, memory_budget_mb: int, folder: str):
+        self._length = max(1, length)
+        self._memory_budget_mb = memory_budget_mb
+        self._folder = folder
+        self._frames: np.ndarray = None
+        self._cube_file = None
+        self._count = 0
+        self._next_slot = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def is_full(self):
+        """
+        Does next push overwrite the oldest frame ?
+
+        :return: True if window holds as many frames as it can
+        :rtype: bool
+        """
+        return self._count == self._length
+
+    @property
+    def is_memory_mapped(self):
+        """
+        Are frames kept in a file mapped in memory ?
+
+        :return: True if frames are kept on disk, False if they are kept in RAM
+        :rtype: bool
+        """
+        return self._cube_file is not None
+
+    @property
+    def nbytes(self):
+        """
+        Size of the frame storage, allocated at first push
+
+        :return: storage size, in bytes
+        :rtype: int
+        """
+        return 0 if self._frames is None else self._frames.nbytes
+
+    @log
+    def clear(self):
+        """
+        Forgets all frames and releases their storage
+        """
+        self._frames = None
+        self._count = 0
+        self._next_slot = 0
+
+        if self._cube_file is not None:
+            self._cube_file.close()
+            self._cube_file = None
+
+    def push(self, data: np.ndarray, coverage: np.ndarray = None):
+        """
+        Adds a frame to the window. If window is full, the oldest frame is overwritten
+
+        :param data: image data, a single plane or color axis first. Shape must match held frames, if any
+        :type data: numpy.ndarray
+
+        :param coverage: 1 where data is valid, 0 elsewhere. Plane shaped. None if data is valid everywhere
+        :type coverage: numpy.ndarray
+        """
+        if self._frames is None:
+            self._allocate(data.shape)
+
+        slot = self._frames[self._next_slot]
+        np.copyto(slot, data)
+
+        if coverage is not None:
+            slot[..., ~coverage.astype(bool, copy=False)] = np.nan
+
+        self._next_slot = (self._next_slot + 1) % self._length
+        self._count = min(self._count + 1, self._length)
+
+    def get_oldest(self):
+        """
+        Gets the oldest held frame, the one overwritten by next push if window is full
+
+        :return: the frame, valid until next push
+        :rtype: numpy.ndarray
+        """
+        return self._frames[(self._next_slot - self._count) % self._length]
+
+    def pop_latest(self):
+        """
+        Removes the latest pushed frame from the window
+
+        :return: the removed frame, valid until next push
+        :rtype: numpy.ndarray
+        """
+        self._next_slot = (self._next_slot - 1) % self._length
+        self._count -= 1
+
+        return self._frames[self._next_slot]
+
+    def get_median(self):
+        """
+        Computes the per pixel median of held frames. Pixels no frame covered are 0
+
+        :return: the median, as float32
+        :rtype: numpy.ndarray
+        """
+        slots = (self._next_slot - self._count + np.arange(self._count)) % self._length
+        median = np.empty(self._frames.shape[1:], dtype=np.float32)
+
+        height = median.shape[-2]
+        row_bytes = self._count * self._frames[0, ..., :1, :].nbytes
+        strip_rows = max(1, _MEDIAN_STRIP_BYTES // row_bytes)
+
+        for top in range(0, height, strip_rows):
+            rows = slice(top, min(top + strip_rows, height))
+            strip = np.take(self._frames[..., rows, :], slots, axis=0)
+            # sorting along frames axis is much faster than np.median on that axis, and sorts NaNs last
+            strip.sort(axis=0)
+            median_strip = median[..., rows, :]
+
+            np.add(strip[(len(strip) - 1) // 2], strip[len(strip) // 2], out=median_strip)
+            median_strip *= .5
+
+            # pixels some frames did not cover : median of their valid values only
+            gaps = np.isnan(strip[-1])
+            if gaps.any():
+                gap_values = strip[:, gaps]
+                valid_counts = np.count_nonzero(~np.isnan(gap_values), axis=0)
+                columns = np.arange(gap_values.shape[1])
+                median_strip[gaps] = .5 * (gap_values[np.maximum(valid_counts - 1, 0) // 2, columns] +
+                                           gap_values[valid_counts // 2, columns])
+
+        # pixels no frame covered
+        np.copyto(median, 0, where=np.isnan(median))
+
+        return median
+
+    def _allocate(self, frame_shape: tuple):
+        """
+        Allocates frame storage, in RAM if it fits in memory budget, on disk otherwise
+
+        :param frame_shape: shape of a frame
+        :type frame_shape: tuple
+        """
+        shape = (self._length, ) + frame_shape
+        storage_size = np.prod(shape) * np.dtype(np.float32).itemsize
+
+        if storage_size <= self._memory_budget_mb * 2 ** 20:
+            self._frames = np.empty(shape, dtype=np.float32)
+            return
+
+        # the system removes this file once closed, even if we crash
+        self._cube_file = tempfile.TemporaryFile(prefix=".als_window_", suffix=".cube",
+                                                 dir=str(Path(self._folder).resolve()))
+        self._frames = np.memmap(self._cube_file, dtype=np.float32, mode='w+', shape=shape)
+        _LOGGER.info(f"Frame window of {self._length} frames does not fit in {self._memory_budget_mb} MB. "
+                     f"It is kept on disk, in {self._folder}")
+
+
+class StackAccumulator:
+    """
+    Running sum of stacked image data, with a count of stacked images covering each pixel.
+
+    Aligned images do not cover the whole stack : their borders come from outside of their field. Such pixels are
+    left out of both sum and count, so each stacked pixel is the mean of the images that actually saw it.
+
+    Sum is kept as float64, so it does not lose precision over thousands of images.
+
+    With a frame window, the latest images are also kept, so they can be subtracted back from the sum :
+
+      - on demand, to remove the latest images from the stack
+      - in sliding mode, as soon as they leave the window, so the stack only holds the latest images
+    """
+
+    @log
+    def __init__(self, window: FrameWindow = None, sliding: bool = False):
+        self._sum: np.ndarray = None
+        self._count: np.ndarray = None
+        self._size: int = 0
+        self._window = window
+        self._sliding = sliding and window is not None
+
+    @property
+    def size(self):
+        """
+        Number of accumulated images
+
+        :return: how many images were accumulated since last reset
+        :rtype: int
+        """
+        return self._size
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by accumulation, allocated at first add
+
+        :return: held memory, in bytes
+        :rtype: int
+        """
+        window_size = 0 if self._window is None or self._window.is_memory_mapped else self._window.nbytes
+        return window_size + sum(array.nbytes for array in [self._sum, self._count] if array is not None)
+
+    @log
+    def reset(self):
+        """
+        Forgets all accumulated images
+        """
+        self._sum = None
+        self._count = None
+        self._size = 0
+
+        if self._window is not None:
+            self._window.clear()
+
+    def add(self, data: np.ndarray, coverage: np.ndarray = None):
+        """
+        Adds image data to the accumulation
+
+        :param data: image data, a single plane or color axis first. Shape must match accumulated data, if any
+        :type data: numpy.ndarray
+
+        :param coverage: 1 where data is valid, 0 elsewhere. Plane shaped. None if data is valid everywhere
+        :type coverage: numpy.ndarray
+        """
+        if self._sum is None:
+            self._sum = np.zeros(data.shape, dtype=np.float64)
+            self._count = np.zeros(data.shape[-2:], dtype=np.uint32)
+
+        if self._window is not None:
+            if self._sliding and self._window.is_full:
+                self._subtract(self._window.get_oldest())
+            self._window.push(data, coverage)
+
+        if coverage is None:
+            np.add(self._sum, data, out=self._sum)
+            self._count += 1
+        else:
+            np.add(self._sum, data, out=self._sum, where=coverage.astype(bool, copy=False))
+            np.add(self._count, coverage, out=self._count)
+
+        self._size += 1
+
+    def remove_latest(self, count: int):
+        """
+        Removes the latest accumulated images, as long as they are held by frame window
+
+        :param count: how many images to remove
+        :type count: int
+
+        :return: how many images were removed
+        :rtype: int
+        """
+        if self._window is None:
+            return 0
+
+        removed_count = min(count, len(self._window))
+
+        for _ in range(removed_count):
+            self._subtract(self._window.pop_latest())
+
+        return removed_count
+
+    def _subtract(self, frame: np.ndarray):
+        """
+        Subtracts a frame from the accumulation
+
+        :param frame: a frame held by frame window, NaN where it had no valid data
+        :type frame: numpy.ndarray
+        """
+        covered = ~np.isnan(frame.reshape(-1, *self._count.shape)[0])
+
+        if covered.all():
+            np.subtract(self._sum, frame, out=self._sum)
+            self._count -= 1
+        else:
+            np.subtract(self._sum, frame, out=self._sum, where=covered)
+            np.subtract(self._count, covered, out=self._count)
+
+        self._size -= 1
+
+    def get_mean(self):
+        """
+        Computes the mean of accumulated images. Pixels no image covered are 0
+
+        :return: the mean, as float32
+        :rtype: numpy.ndarray
+        """
+        # sum is 0 where count is 0
+        count = np.maximum(self._count, 1)
+        mean = np.empty(self._sum.shape, dtype=np.float32)
+
+        for sum_plane, mean_plane in zip(self._sum.reshape(-1, *count.shape), mean.reshape(-1, *count.shape)):
+            np.divide(sum_plane, count, out=mean_plane)
+
+        return mean
+
+    def get_result(self):
+        """
+        Computes the stacking result of accumulated images : their mean
+
+        :return: the stacking result, as float32
+        :rtype: numpy.ndarray
+        """
+        return self.get_mean()
+
+    def get_sum(self):
+        """
+        Computes the sum of accumulated images. Pixels not covered by all images are scaled up, as if all images
+        covered them
+
+        :return: the sum, as float32
+        :rtype: numpy.ndarray
+        """
+        accumulated_sum = self.get_mean()
+        accumulated_sum *= self._size
+
+        return accumulated_sum
+
+
+class KappaSigmaAccumulator(StackAccumulator):
+    """
+    Running kappa-sigma clipped mean of stacked image data.
+
+    Each pixel keeps the running mean and sum of squared deviations (Welford's algorithm) of its accepted values,
+    along with their count. A new value is rejected if it lies more than kappa standard deviations away from the
+    running mean, so satellite and plane trails, hot pixels and cosmic ray hits don't make it to the stack.
+
+    Each image is seen once and never kept : memory stays the same whatever the stack size. As rejection is decided
+    against the values accepted so far, nothing is rejected until a pixel has accepted a few values.
+    """
+
+    @log
+    def __init__(self, kappa: float):
+        super().__init__()
+        self._kappa = kappa
+        self._mean: np.ndarray = None
+        self._squared_deviations: np.ndarray = None
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in [self._mean, self._squared_deviations, self._count] if array is not None)
+
+    @log
+    def reset(self):
+        super().reset()
+        self._mean = None
+        self._squared_deviations = None
+
+    def add(self, data: np.ndarray, coverage: np.ndarray = None):
+        if self._mean is None:
+            self._mean = np.zeros(data.shape, dtype=np.float32)
+            self._squared_deviations = np.zeros(data.shape, dtype=np.float32)
+            # float32 counts are exact way beyond any stack size and need no conversion in computations
+            self._count = np.zeros(data.shape, dtype=np.float32)
+
+        rejected_count = 0
+        height = data.shape[-2]
+
+        for top in range(0, height, _CLIPPING_STRIP_ROWS):
+            rows = slice(top, min(top + _CLIPPING_STRIP_ROWS, height))
+            rejected_count += self._add_strip(
+                data[..., rows, :],
+                None if coverage is None else coverage[rows],
+                rows)
+
+        _LOGGER.debug(f"Kappa-sigma clipping rejected {rejected_count} values out of {data.size}")
+        self._size += 1
+
+    def _add_strip(self, data: np.ndarray, coverage: np.ndarray, rows: slice):
+        """
+        Adds a strip of image data to the accumulation
+
+        :param data: image data strip
+        :type data: numpy.ndarray
+
+        :param coverage: coverage strip, None if data is valid everywhere
+        :type coverage: numpy.ndarray
+
+        :param rows: rows of the strip in accumulated data
+        :type rows: slice
+
+        :return: how many values were rejected
+        :rtype: int
+        """
+        mean = self._mean[..., rows, :]
+        squared_deviations = self._squared_deviations[..., rows, :]
+        count = self._count[..., rows, :]
+
+        deviation = data - mean
+
+        # deviation^2 <= kappa^2 * variance, with variance = squared_deviations / (count - 1)
+        scaled_squared_deviation = np.square(deviation)
+        scaled_squared_deviation *= count - 1
+        accepted = scaled_squared_deviation <= squared_deviations * self._kappa ** 2
+        # a pixel that only accepted equal values would reject anything different for ever
+        accepted |= squared_deviations == 0
+        accepted |= count < _MINIMUM_CLIPPING_COUNT
+
+        if coverage is None:
+            rejected_count = accepted.size - np.count_nonzero(accepted)
+        else:
+            accepted &= coverage.astype(bool, copy=False)
+            rejected_count = np.count_nonzero(coverage) * (accepted.size // coverage.size) - np.count_nonzero(accepted)
+
+        count += accepted
+        deviation *= accepted
+        mean_step = deviation / np.maximum(count, 1)
+        mean += mean_step
+        # Welford's update : deviation from previous mean times deviation from the new one
+        deviation *= deviation - mean_step
+        squared_deviations += deviation
+
+        return rejected_count
+
+    def get_mean(self):
+        """
+        Computes the clipped mean of accumulated images. Pixels no image covered are 0
+
+        :return: the mean, as float32
+        :rtype: numpy.ndarray
+        """
+        return self._mean.copy()
+
+
+class MedianAccumulator(StackAccumulator):
+    """
+    Approximate median of stacked image data : the per pixel median of the latest stacked images.
+
+    A true median needs all stacked images. Only the latest ones are kept, in a frame window of bounded size, and
+    their median is only computed when stacking result is asked for.
+    """
+
+    def add(self, data: np.ndarray, coverage: np.ndarray = None):
+        self._window.push(data, coverage)
+        self._size += 1
+
+    def remove_latest(self, count: int):
+        # stacking result only comes from frame window : it must not be emptied while older images are stacked
+        removable_count = len(self._window) if len(self._window) == self._size else len(self._window) - 1
+        removed_count = max(0, min(count, removable_count))
+
+        for _ in range(removed_count):
+            self._window.pop_latest()
+
+        self._size -= removed_count
+
+        return removed_count
+
+    def get_result(self):
+        """
+        Computes the median of the latest accumulated images. Pixels no image covered are 0
+
+        :return: the median, as float32
+        :rtype: numpy.ndarray
+        """
+        return self._window.get_median()
+
+    def get_mean(self):
+        # the median stands for the mean, so a sum can still be computed
+        return self.get_result()
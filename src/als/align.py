@@ -0,0 +1,539 @@
+"""
+Provides image alignment features, built on astroalign.
+
+astroalign.find_transform() detects stars and builds asterism invariants for both images it is given. During a
+session, one of them is always the same alignment reference, so we keep reference features once computed, and only
+detect stars of each new image.
+
+Alignment can also run coarse to fine : stars are matched on binned images, then the approximate transformation is
+refined using full resolution centroids of a few reference stars, measured around their predicted positions.
+
+When fields do not rotate, a pure translation is first estimated by phase correlation of binned images, then checked
+and refined the same way.
+
+Found transformations are applied with OpenCV, plane by plane, straight into a preallocated output.
+
+This relies on astroalign internals, as found in astroalign 1.0.x.
+"""
+from logging import getLogger
+
+import astroalign as al
+import cv2
+import numpy as np
+from scipy.spatial import KDTree
+from skimage.transform import SimilarityTransform
+
+from als.code_utilities import log, AlsLogAdapter, Timer
+
+_LOGGER = AlsLogAdapter(getLogger(__name__), {})
+
+# max distance between matching invariants. Same value as astroalign's
+_INVARIANT_MATCH_RADIUS = 0.03
+
+# half size of star centroid measurement windows, in pixels. Large enough to hold whole stars and to cover
+# coarse transformation errors
+_CENTROID_RADIUS = 7
+
+# centroid measurement windows hold a star if their peak is at least this many times their noise above background
+_MINIMUM_PEAK_SIGNAL_TO_NOISE = 5.
+
+# phase correlation runs on images binned so their largest dimension is at most this size, in pixels
+_PHASE_CORRELATION_MAX_SIZE = 512
+
+# minimum phase correlation peak response for a translation to be considered
+_MINIMUM_PHASE_CORRELATION_RESPONSE = .05
+
+# max distance, in pixels, between a reference star and its translated source match. Rotated fields exceed it
+_TRANSLATION_TOLERANCE = 1.
+
+# translations this close to whole pixels, with no rotation nor scaling, are applied by slicing, without interpolation
+_INTEGER_SHIFT_TOLERANCE = 1e-3
+
+# warped image borders get source background level, estimated as the median of one pixel out of this step, squared
+_BORDER_SAMPLING_STEP = 8
+
+
+class AlignmentError(Exception):
+    """
+    Raised when no alignment transformation can be found
+    """
+
+
+class ReferenceFeatures:
+    """
+    Star features of an alignment reference : control points, asterisms and their invariants, in a KD tree
+    """
+
+    @log
+    def __init__(self, data: np.ndarray):
+        """
+        Detects stars and computes features of reference data
+
+        :param data: the reference data
+        :type data: numpy.ndarray
+
+        :raises: AlignmentError if not enough stars are found
+        """
+        with Timer() as features_timer:
+            self.control_points = find_control_points(data)
+            invariants, self.asterisms = al._generate_invariants(self.control_points)
+            self.invariant_tree = KDTree(invariants)
+
+        _LOGGER.debug(f"*SD-ALIGNREF* Computed reference features of {len(self.control_points)} stars "
+                      f"on shape {data.shape} in {features_timer.elapsed_in_milli_as_str} ms")
+
+
+def find_control_points(data: np.ndarray):
+    """
+    Detects stars used as control points
+
+    :param data: the image data
+    :type data: numpy.ndarray
+
+    :return: (x, y) positions of the brightest stars, brightest first
+    :rtype: numpy.ndarray
+
+    :raises: AlignmentError if less than 3 stars are found
+    """
+    control_points = al._find_sources(data)[:al.MAX_CONTROL_POINTS]
+
+    if len(control_points) < 3:
+        raise AlignmentError(f"Only {len(control_points)} stars found. Minimum is 3")
+
+    return control_points
+
+
+def find_transform(source: np.ndarray, reference: ReferenceFeatures):
+    """
+    Estimates the transformation mapping source pixels to reference pixels.
+
+    This is astroalign.find_transform(), using precomputed reference features
+
+    :param source: the source image data
+    :type source: numpy.ndarray
+
+    :param reference: the reference features
+    :type reference: ReferenceFeatures
+
+    :return: the transformation and a tuple of matching star positions in source and reference
+    :rtype: tuple
+
+    :raises: AlignmentError if source holds less than 3 stars
+    :raises: astroalign.MaxIterError if no transformation is found
+    """
+    source_control_points = find_control_points(source)
+    source_invariants, source_asterisms = al._generate_invariants(source_control_points)
+    source_invariant_tree = KDTree(source_invariants)
+
+    # for each source invariant, indices of matching reference invariants
+    matches_list = source_invariant_tree.query_ball_tree(reference.invariant_tree, r=_INVARIANT_MATCH_RADIUS)
+
+    # (N, 3, 2) array : N pairs of similar triangles, as 3 (source index, reference index) pairs
+    matches = np.array([list(zip(source_asterism, reference_asterism))
+                        for source_asterism, reference_indices in zip(source_asterisms, matches_list)
+                        for reference_asterism in reference.asterisms[reference_indices]])
+
+    if matches.size == 0:
+        raise AlignmentError("No matching asterism found")
+
+    model = al._MatchTransform(source_control_points, reference.control_points)
+    invariant_count = len(matches)
+    min_matches = min(10, int(invariant_count * al.MIN_MATCHES_FRACTION))
+    transformation, inliers = al._ransac(matches, model, 1, invariant_count, al.PIXEL_TOL, min_matches)
+
+    inlier_pairs = {tuple(pair) for pair in matches[inliers].reshape(-1, 2)}
+    source_indices, reference_indices = np.array(list(inlier_pairs)).T
+
+    return transformation, (source_control_points[source_indices], reference.control_points[reference_indices])
+
+
+def bin_image(data: np.ndarray, factor: int):
+    """
+    Bins image data : each factor x factor block becomes a single pixel holding the block mean.
+
+    Last rows and columns not filling a whole block are dropped
+
+    :param data: the image data
+    :type data: numpy.ndarray
+
+    :param factor: the binning factor
+    :type factor: int
+
+    :return: binned data, as float32
+    :rtype: numpy.ndarray
+    """
+    height, width = data.shape[0] // factor, data.shape[1] // factor
+
+    return cv2.resize(data[:height * factor, :width * factor].astype(np.float32, copy=False),
+                      (width, height),
+                      interpolation=cv2.INTER_AREA)
+
+
+def unbin_transform(transformation: SimilarityTransform, factor: int):
+    """
+    Converts a transformation found on binned images to full resolution images
+
+    :param transformation: transformation between binned images
+    :type transformation: SimilarityTransform
+
+    :param factor: the binning factor
+    :type factor: int
+
+    :return: the same transformation, between full resolution images
+    :rtype: SimilarityTransform
+    """
+    # binned pixel (0, 0) is centered on full resolution point ((factor - 1) / 2, (factor - 1) / 2)
+    to_binned = SimilarityTransform(scale=1 / factor, translation=(-(factor - 1) / (2 * factor),) * 2)
+    to_full = SimilarityTransform(scale=factor, translation=((factor - 1) / 2,) * 2)
+
+    return SimilarityTransform(matrix=to_full.params @ transformation.params @ to_binned.params)
+
+
+def measure_centroids(data: np.ndarray, positions: np.ndarray, radius: int):
+    """
+    Measures star centroids in square windows around approximate positions.
+
+    Each window background is its median value, and its noise is estimated from the median absolute deviation. Windows
+    that do not fit in image or whose peak is not clearly above noise are reported as invalid : centroids of windows
+    holding background only stay close to window centers, and would confirm any predicted position
+
+    :param data: the image data
+    :type data: numpy.ndarray
+
+    :param positions: approximate (x, y) star positions
+    :type positions: numpy.ndarray
+
+    :param radius: half size of the windows
+    :type radius: int
+
+    :return: a tuple of 2 elements : (x, y) centroids and validity mask
+    :rtype: tuple
+    """
+    height, width = data.shape
+    centers = np.rint(positions).astype(int)
+    valid = ((centers[:, 0] >= radius) & (centers[:, 0] < width - radius) &
+             (centers[:, 1] >= radius) & (centers[:, 1] < height - radius))
+    centers[~valid] = radius
+
+    offsets = np.arange(-radius, radius + 1)
+    rows = centers[:, 1, None, None] + offsets[None, :, None]
+    columns = centers[:, 0, None, None] + offsets[None, None, :]
+    windows = data[rows, columns].astype(np.float32)
+
+    windows -= np.median(windows.reshape(len(windows), -1), axis=1)[:, None, None]
+    noises = 1.4826 * np.median(np.abs(windows).reshape(len(windows), -1), axis=1)
+    valid &= windows.max(axis=(1, 2)) > _MINIMUM_PEAK_SIGNAL_TO_NOISE * noises
+
+    np.clip(windows, 0, None, out=windows)
+    fluxes = windows.sum(axis=(1, 2))
+    valid &= fluxes > 0
+    fluxes[~valid] = 1
+
+    centroids = np.column_stack((
+        centers[:, 0] + (windows.sum(axis=1) * offsets).sum(axis=1) / fluxes,
+        centers[:, 1] + (windows.sum(axis=2) * offsets).sum(axis=1) / fluxes))
+
+    return centroids, valid
+
+
+class ReferenceStars:
+    """
+    Full resolution centroids of alignment reference brightest stars
+    """
+
+    @log
+    def __init__(self, data: np.ndarray):
+        """
+        Detects stars of reference data and measures their centroids
+
+        :param data: the reference data
+        :type data: numpy.ndarray
+
+        :raises: AlignmentError if less than 3 stars are found
+        """
+        centroids, valid = measure_centroids(data, find_control_points(data), _CENTROID_RADIUS)
+        self.positions = centroids[valid]
+
+        if len(self.positions) < 3:
+            raise AlignmentError(f"Only {len(self.positions)} reference star centroids measured. Minimum is 3")
+
+
+def refine_transform(coarse_transformation: SimilarityTransform, source: np.ndarray, reference: ReferenceStars,
+                     minimum_matches: int):
+    """
+    Refines an approximate transformation, using full resolution star centroids.
+
+    Reference stars are looked for in source, around positions predicted by coarse transformation. A similarity
+    transform is then fitted to measured positions, with outliers rejected.
+
+    :param coarse_transformation: approximate transformation mapping source pixels to reference pixels
+    :type coarse_transformation: SimilarityTransform
+
+    :param source: the source image data
+    :type source: numpy.ndarray
+
+    :param reference: the reference stars
+    :type reference: ReferenceStars
+
+    :param minimum_matches: minimum number of matching stars
+    :type minimum_matches: int
+
+    :return: the refined transformation and a tuple of matching star positions in source and reference
+    :rtype: tuple
+
+    :raises: AlignmentError if less than minimum_matches stars match
+    """
+    transformation = coarse_transformation
+
+    # second pass measures centroids in windows centered using first pass result
+    for _ in range(2):
+        predicted = transformation.inverse(reference.positions)
+        measured, valid = measure_centroids(source, predicted, _CENTROID_RADIUS)
+        transformation, source_points, reference_points = _fit_transform(measured[valid],
+                                                                         reference.positions[valid],
+                                                                         minimum_matches)
+
+    return transformation, (source_points, reference_points)
+
+
+def _fit_transform(source_points: np.ndarray, reference_points: np.ndarray, minimum_matches: int):
+    """
+    Fits a similarity transform to matching star positions, rejecting outliers
+
+    :param source_points: (x, y) source star positions
+    :type source_points: numpy.ndarray
+
+    :param reference_points: (x, y) matching reference star positions
+    :type reference_points: numpy.ndarray
+
+    :param minimum_matches: minimum number of matching stars
+    :type minimum_matches: int
+
+    :return: a tuple of 3 elements : the transformation, inlier source positions and inlier reference positions
+    :rtype: tuple
+
+    :raises: AlignmentError if less than minimum_matches stars are inliers
+    """
+    inliers = np.ones(len(source_points), dtype=bool)
+
+    for _ in range(3):
+        if np.count_nonzero(inliers) < max(3, minimum_matches):
+            raise AlignmentError(f"Only {np.count_nonzero(inliers)} stars matched on refinement. "
+                                 f"Minimum is {minimum_matches}")
+
+        transformation = SimilarityTransform()
+        transformation.estimate(source_points[inliers], reference_points[inliers])
+        inliers = np.linalg.norm(transformation(source_points) - reference_points, axis=1) < al.PIXEL_TOL
+
+    if np.count_nonzero(inliers) < max(3, minimum_matches):
+        raise AlignmentError(f"Only {np.count_nonzero(inliers)} stars matched on refinement. "
+                             f"Minimum is {minimum_matches}")
+
+    return transformation, source_points[inliers], reference_points[inliers]
+
+
+class TranslationReference:
+    """
+    Binned alignment reference, prepared for phase correlation
+    """
+
+    @log
+    def __init__(self, data: np.ndarray):
+        """
+        Bins and prepares reference data
+
+        :param data: the reference data
+        :type data: numpy.ndarray
+        """
+        self.shape = data.shape
+        self.factor = max(1, -(-max(data.shape) // _PHASE_CORRELATION_MAX_SIZE))
+        self.plane = _get_phase_correlation_plane(data, self.factor)
+        self.window = cv2.createHanningWindow(self.plane.shape[::-1], cv2.CV_32F)
+
+
+def _get_phase_correlation_plane(data: np.ndarray, factor: int):
+    """
+    Bins data and keeps signal above background only, so sky gradients do not weigh on phase correlation
+
+    :param data: the image data
+    :type data: numpy.ndarray
+
+    :param factor: the binning factor
+    :type factor: int
+
+    :return: the prepared plane
+    :rtype: numpy.ndarray
+    """
+    plane = bin_image(data, factor)
+    plane -= np.median(plane)
+    np.clip(plane, 0, None, out=plane)
+
+    return plane
+
+
+def find_translation(source: np.ndarray, reference: TranslationReference, reference_stars: ReferenceStars,
+                     minimum_matches: int):
+    """
+    Estimates the pure translation mapping source pixels to reference pixels.
+
+    Translation is found by phase correlation of binned data, then checked and refined using full resolution star
+    centroids : at least minimum_matches reference stars must be found where translation puts them.
+
+    :param source: the source image data
+    :type source: numpy.ndarray
+
+    :param reference: the prepared reference
+    :type reference: TranslationReference
+
+    :param reference_stars: the reference stars
+    :type reference_stars: ReferenceStars
+
+    :param minimum_matches: minimum number of matching stars
+    :type minimum_matches: int
+
+    :return: the translation and a tuple of matching star positions in source and reference
+    :rtype: tuple
+
+    :raises: AlignmentError if no valid translation is found
+    """
+    if source.shape != reference.shape:
+        raise AlignmentError(f"Source shape {source.shape} differs from reference shape {reference.shape}")
+
+    (shift_x, shift_y), response = cv2.phaseCorrelate(_get_phase_correlation_plane(source, reference.factor),
+                                                      reference.plane,
+                                                      reference.window)
+
+    if response < _MINIMUM_PHASE_CORRELATION_RESPONSE:
+        raise AlignmentError(f"Phase correlation peak is too weak : {response:.3f}")
+
+    translation = np.array([shift_x, shift_y]) * reference.factor
+
+    # second pass measures centroids in windows centered using first pass result
+    for _ in range(2):
+        measured, valid = measure_centroids(source, reference_stars.positions - translation, _CENTROID_RADIUS)
+        offsets = reference_stars.positions[valid] - measured[valid]
+        inliers = np.linalg.norm(offsets - np.median(offsets, axis=0), axis=1) < _TRANSLATION_TOLERANCE
+
+        if np.count_nonzero(inliers) < max(3, minimum_matches):
+            raise AlignmentError(f"Only {np.count_nonzero(inliers)} stars matched translation. "
+                                 f"Minimum is {minimum_matches}")
+
+        translation = offsets[inliers].mean(axis=0)
+
+    return SimilarityTransform(translation=translation), (measured[valid][inliers],
+                                                          reference_stars.positions[valid][inliers])
+
+
+def get_integer_shift(transformation: SimilarityTransform):
+    """
+    Checks if a transformation is a whole pixels translation
+
+    :param transformation: the transformation
+    :type transformation: SimilarityTransform
+
+    :return: (x, y) shift in pixels if transformation is a whole pixels translation, None otherwise
+    :rtype: tuple or None
+    """
+    matrix = transformation.params
+    shift = np.rint(matrix[:2, 2])
+
+    if np.allclose(matrix[:2, :2], np.eye(2), rtol=0, atol=1e-9) and \
+            np.all(np.abs(matrix[:2, 2] - shift) < _INTEGER_SHIFT_TOLERANCE):
+        return int(shift[0]), int(shift[1])
+
+    return None
+
+
+def apply_transform(transformation: SimilarityTransform, data: np.ndarray, output: np.ndarray = None,
+                    coverage: np.ndarray = None):
+    """
+    Warps image data : each source pixel is moved where transformation maps it.
+
+    Data is either a single plane or planar color data, color axis first. All planes are warped with the same
+    transformation, using bicubic interpolation. Whole pixel translations are applied by slicing.
+
+    Output pixels not covered by source get source background level.
+
+    :param transformation: transformation mapping source pixels to output pixels
+    :type transformation: SimilarityTransform
+
+    :param data: the source data
+    :type data: numpy.ndarray
+
+    :param output: C contiguous float32 array of data shape to write result into. Allocated if None
+    :type output: numpy.ndarray
+
+    :param coverage: C contiguous uint8 array of plane shape. If not None, it is set to 1 where output pixels are
+                     interpolated from source pixels only, 0 elsewhere
+    :type coverage: numpy.ndarray
+
+    :return: the warped data, as float32
+    :rtype: numpy.ndarray
+    """
+    if output is None:
+        output = np.empty(data.shape, dtype=np.float32)
+
+    height, width = data.shape[-2:]
+    shift = get_integer_shift(transformation)
+    matrix = transformation.params[:2]
+
+    for source_plane, output_plane in zip(data.reshape(-1, height, width), output.reshape(-1, height, width)):
+
+        border_value = float(np.median(source_plane[::_BORDER_SAMPLING_STEP, ::_BORDER_SAMPLING_STEP]))
+
+        if shift is None:
+            cv2.warpAffine(source_plane.astype(np.float32, copy=False),
+                           matrix,
+                           (width, height),
+                           dst=output_plane,
+                           flags=cv2.INTER_CUBIC,
+                           borderMode=cv2.BORDER_CONSTANT,
+                           borderValue=border_value)
+        else:
+            _shift_plane(source_plane, output_plane, shift, border_value)
+
+    if coverage is not None and shift is None:
+        # bilinear interpolation of a mask excluding source edges is only complete where bicubic interpolation only
+        # reads source pixels
+        inner_mask = np.zeros((height, width), dtype=np.uint8)
+        inner_mask[1:-1, 1:-1] = 255
+        cv2.warpAffine(inner_mask, matrix, (width, height), dst=coverage, flags=cv2.INTER_LINEAR,
+                       borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        np.equal(coverage, 255, out=coverage, casting='unsafe')
+
+    elif coverage is not None:
+        _shift_plane(np.ones((height, width), dtype=np.uint8), coverage, shift, 0)
+
+    return output
+
+
+def _shift_plane(source: np.ndarray, output: np.ndarray, shift: tuple, border_value: float):
+    """
+    Translates a plane by whole pixels
+
+    :param source: the source plane
+    :type source: numpy.ndarray
+
+    :param output: the plane to write result into
+    :type output: numpy.ndarray
+
+    :param shift: (x, y) shift in pixels
+    :type shift: tuple
+
+    :param border_value: value of output pixels not covered by source
+    :type border_value: float
+    """
+    height, width = source.shape
+    shift_x, shift_y = shift
+
+    if abs(shift_x) >= width or abs(shift_y) >= height:
+        output.fill(border_value)
+        return
+
+    output[:max(shift_y, 0)] = border_value
+    output[height + min(shift_y, 0):] = border_value
+    output[:, :max(shift_x, 0)] = border_value
+    output[:, width + min(shift_x, 0):] = border_value
+
+    output[max(shift_y, 0):height + min(shift_y, 0), max(shift_x, 0):width + min(shift_x, 0)] = \
+        source[max(-shift_y, 0):height + min(-shift_y, 0), max(-shift_x, 0):width + min(-shift_x, 0)]
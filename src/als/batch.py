@@ -0,0 +1,297 @@
+"""
+Headless batch stacking of existing subs.
+
+Pushes a list of files through the same processors as a live session, without GUI nor input scanner :
+
+  - pre-process : read, dark or bias removal, flat field correction, hot pixel removal, debayering and
+    standardization, in a pool of worker processes
+  - stacking : alignment and stacking, in file name order, in a stacker thread. Images are aligned in parallel by
+    alignment worker threads, if configured
+  - post-process : debayering when profile debayers at output, autostretch, levels and color balance with default
+    values, then conversion for output
+  - save : final stack is written to disk
+
+Throughput of each stage is printed at the end of the run. Pre-processing and stacking run at the same time : each
+stage is only timed while it works on images, not while it waits for the other one.
+
+Usage :
+
+    als-batch [-o OUTPUT] [-m {mean,sum,kappa-sigma,median,sliding-mean}] [--no-align] [--profile {visual,photo}]
+              [--debayer {superpixel,bilinear,edge-aware,vng,at-output}] [-w WORKERS] [--align-workers ALIGN_WORKERS]
+              INPUT [INPUT ...]
+
+Each INPUT is either an image file or a folder. Folders are searched recursively for files.
+"""
+import os
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from collections import deque
+from logging import getLogger
+from pathlib import Path
+
+from PyQt5.QtCore import QCoreApplication, Qt
+
+from als import config
+from als.calibration import create_pre_processes
+from als.code_utilities import Timer, SignalingQueue, AlsLogAdapter, QUEUE_POLICY_BLOCK
+from als.model.base import VisualProfile, PhotoProfile, RunningProfile, DEBAYER_ALGORITHMS
+from als.model.data import I18n, STACKED_IMAGE_FILE_NAME_BASE
+from als.processing import Debayer, AutoStretch, Levels, ColorBalance, ConvertForOutput, create_process_pool, \
+    submit_to_process_pool, get_process_pool_result
+from als.stack import Stacker
+from als.streams.input import collect_input_paths
+from als.streams.output import ImageSaver
+
+_LOGGER = AlsLogAdapter(getLogger(__name__), {})
+
+# profile classes and config codes, by name
+_PROFILES = {
+    "visual": (VisualProfile, 0),
+    "photo": (PhotoProfile, 1),
+}
+
+
+class StageStats:
+    """
+    Accumulates image count and time spent in a processing stage
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.elapsed_in_milli = 0.
+
+    def add(self, elapsed_in_milli: float, count: int = 1):
+        """
+        Records processing of images
+
+        :param elapsed_in_milli: time spent processing images
+        :type elapsed_in_milli: float
+
+        :param count: number of processed images
+        :type count: int
+        """
+        self.count += count
+        self.elapsed_in_milli += elapsed_in_milli
+
+    def __str__(self):
+        rate = self.count / (self.elapsed_in_milli / 1000) if self.elapsed_in_milli > 0 else 0
+        return f"{self.name:>12} : {self.count:>6} images in {self.elapsed_in_milli / 1000:>8.3f} s " \
+               f"- {rate:>8.2f} images/s"
+
+
+class StackerMonitor:
+    """
+    Follows a stacker running in its own thread : records time it spends stacking and tells when it is idle
+    """
+    def __init__(self, stacker: Stacker, stats: StageStats):
+        self._stats = stats
+        self._idle = threading.Event()
+        self._idle.set()
+        self._busy_start = None
+
+        # stacker signals are emitted from its own thread, without any Qt event loop running
+        stacker.busy_signal.connect(self._on_busy, Qt.DirectConnection)
+        stacker.waiting_signal.connect(self._on_waiting, Qt.DirectConnection)
+
+    def _on_busy(self):
+        self._idle.clear()
+        self._busy_start = time.perf_counter()
+
+    def _on_waiting(self):
+        self._stats.add((time.perf_counter() - self._busy_start) * 1000, 0)
+        self._idle.set()
+
+    def wait_until_idle(self):
+        """
+        Waits until stacker has no image being stacked. Stacker marks itself busy before retrieving an image from its
+        queue, so callers check stacker queue is empty first
+        """
+        self._idle.wait()
+
+
+# pylint: disable=R0913, R0914
+def run_batch(paths, profile: RunningProfile, stacking_mode: str, align: bool, worker_count: int,
+              align_worker_count: int, destination: str):
+    """
+    Stacks a list of files and saves the post-processed result
+
+    :param paths: files to stack, in stacking order
+    :type paths: list
+
+    :param profile: the running profile
+    :type profile: RunningProfile
+
+    :param stacking_mode: the stacking mode
+    :type stacking_mode: str
+
+    :param align: do we align images before stacking ?
+    :type align: bool
+
+    :param worker_count: number of pre-process worker processes
+    :type worker_count: int
+
+    :param align_worker_count: number of alignment worker threads
+    :type align_worker_count: int
+
+    :param destination: path of the file to save final stack to. Extension gives file format
+    :type destination: str
+
+    :return: stats of each stage, in processing order
+    :rtype: list
+    """
+    pre_process_stats = StageStats("pre-process")
+    stack_stats = StageStats("stack")
+    post_process_stats = StageStats("post-process")
+    save_stats = StageStats("save")
+
+    # images waiting to be stacked are bounded too, so decoded images don't fill memory when stacking is slower
+    stack_queue = SignalingQueue()
+    stack_queue.set_policy(QUEUE_POLICY_BLOCK, 2 * align_worker_count)
+
+    stacker = Stacker(stack_queue, profile, align_worker_count)
+    stacker.stacking_mode = stacking_mode
+    stacker.align_before_stack = align
+    stacker_monitor = StackerMonitor(stacker, stack_stats)
+
+    pre_processes = create_pre_processes(profile)
+
+    # we keep a bounded number of files in flight, so decoded images waiting to be stacked don't fill memory
+    pending = deque()
+    to_submit = deque(str(path) for path in paths)
+    pre_processed_count = 0
+    # time spent waiting for stacker to have room for new images, which is not pre-processing time
+    stacker_wait_in_milli = 0.
+
+    stacker.start()
+
+    with Timer() as pre_process_timer, create_process_pool(pre_processes, worker_count) as executor:
+
+        while to_submit or pending:
+
+            while to_submit and len(pending) < 2 * worker_count:
+                pending.append(submit_to_process_pool(executor, to_submit.popleft()))
+
+            image = get_process_pool_result(pending.popleft())
+
+            if image is None:
+                continue
+
+            pre_processed_count += 1
+
+            with Timer() as stacker_wait_timer:
+                while stack_queue.is_full:
+                    time.sleep(.02)
+            stacker_wait_in_milli += stacker_wait_timer.elapsed_in_milli
+
+            stack_queue.put(image)
+            stack_stats.add(0)
+
+    while stack_queue.qsize() > 0:
+        time.sleep(.02)
+    stacker_monitor.wait_until_idle()
+
+    stacker.stop()
+    stacker.wait()
+
+    with Timer() as publish_timer:
+        # pylint: disable=W0212
+        stacker._publish_stacking_result()
+    stack_stats.add(publish_timer.elapsed_in_milli, 0)
+
+    # workers pre-process images in parallel, so pre-processing is measured on wall clock time, until last result is
+    # retrieved, leaving out waits for stacker
+    pre_process_stats.add(pre_process_timer.elapsed_in_milli - stacker_wait_in_milli, pre_processed_count)
+
+    # pylint: disable=W0212
+    result = stacker._last_stacking_result
+
+    if result is None:
+        print("No image could be stacked", file=sys.stderr)
+        return [pre_process_stats, stack_stats]
+
+    with Timer() as post_process_timer:
+        for processor in [Debayer(profile, at_output=True), AutoStretch(), Levels(), ColorBalance(),
+                          ConvertForOutput()]:
+            result = processor.process_image(result)
+    post_process_stats.add(post_process_timer.elapsed_in_milli)
+
+    result.destination = destination
+    with Timer() as save_timer:
+        # pylint: disable=W0212
+        ImageSaver._save_image(result)
+    save_stats.add(save_timer.elapsed_in_milli)
+
+    print(f"Stacked {stacker.size} of {len(paths)} images into {destination}")
+
+    return [pre_process_stats, stack_stats, post_process_stats, save_stats]
+
+
+def main():
+    """
+    Runs batch stacking
+    """
+    parser = ArgumentParser(description="Stacks existing images without GUI")
+    parser.add_argument("inputs", nargs="+", help="image files or folders")
+    parser.add_argument("-o", "--output",
+                        help="final stack file path. Extension gives file format : tiff, png or jpg. "
+                             "Defaults to stack image in configured work folder, with configured format")
+    parser.add_argument("-m", "--mode", choices=["mean", "sum", "kappa-sigma", "median", "sliding-mean"], default="mean",
+                        help="stacking mode")
+    parser.add_argument("--no-align", action="store_true", help="stack images without aligning them")
+    parser.add_argument("--profile", choices=sorted(_PROFILES.keys()), default="photo", help="running profile")
+    parser.add_argument("--debayer", choices=DEBAYER_ALGORITHMS,
+                        help="debayering algorithm. Defaults to the one configured for running profile")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of pre-process worker processes")
+    parser.add_argument("--align-workers", type=int,
+                        help="number of alignment worker threads. Defaults to configured number")
+    args = parser.parse_args()
+
+    # Qt translation needs an application instance, even a non GUI one
+    app = QCoreApplication(sys.argv[:1])
+    config.setup()
+    I18n().setup()
+
+    paths, missing_inputs = collect_input_paths(args.inputs)
+    for missing_input in missing_inputs:
+        print(f"Ignoring missing input : {missing_input}", file=sys.stderr)
+
+    if not paths:
+        print("Nothing to stack", file=sys.stderr)
+        sys.exit(1)
+
+    destination = args.output or str(Path(config.get_work_folder_path()) /
+                                     f"{STACKED_IMAGE_FILE_NAME_BASE}.{config.get_image_save_format()}")
+
+    stacking_mode = {
+        "mean": I18n.STACKING_MODE_MEAN,
+        "sum": I18n.STACKING_MODE_SUM,
+        "kappa-sigma": I18n.STACKING_MODE_KAPPA_SIGMA,
+        "median": I18n.STACKING_MODE_MEDIAN,
+        "sliding-mean": I18n.STACKING_MODE_SLIDING_MEAN,
+    }[args.mode]
+
+    profile_class, profile_code = _PROFILES[args.profile]
+    profile = profile_class()
+    profile.set_debayer_algorithm(args.debayer or config.get_debayer_algorithm(profile_code))
+
+    with Timer() as total_timer:
+        all_stats = run_batch(paths,
+                              profile,
+                              stacking_mode,
+                              not args.no_align,
+                              max(1, args.workers),
+                              max(1, args.align_workers or config.get_align_workers()),
+                              destination)
+
+    for stats in all_stats:
+        print(stats)
+    print(f"{'total':>12} : {len(paths):>6} files  in {total_timer.elapsed_in_milli / 1000:>8.3f} s")
+
+    del app
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,629 @@
+"""
+Provides light frames calibration : master dark, bias and flat field correction and hot pixels removal
+"""
+from logging import getLogger
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QT_TRANSLATE_NOOP
+
+from als import config
+from als.code_utilities import log, Timer, AlsLogAdapter
+from als.messaging import MESSAGE_HUB
+from als.model.base import Image, RunningProfile
+from als.processing import ImageProcessor, ProcessingError, FileReader, Debayer, Standardize, is_cfa
+from als.streams import input as als_input
+
+_LOGGER = AlsLogAdapter(getLogger(__name__), {})
+
+_HOT_PIXEL_RATIO = 2
+
+
+class MasterCache:
+    """
+    Keeps a master calibration frame in memory, already conformed to lights.
+
+    Master is read again only if its path, modification time or size changed since it was cached, or if lights
+    data type, shape or bayer layout changed.
+    """
+
+    @log
+    def __init__(self, conform):
+        """
+        Constructs a MasterCache
+
+        :param conform: function conforming master data to lights. Called with master image and light image,
+               returns conformed data
+        :type conform: callable
+        """
+        self._conform = conform
+        self._key = None
+        self._data = None
+
+    @log
+    def get(self, path: str, light: Image):
+        """
+        Gets master data, conformed to a light
+
+        :param path: master file path
+        :type path: str
+
+        :param light: the light image
+        :type light: Image
+
+        :return: conformed master data or None if master could not be read
+        :rtype: numpy.ndarray or None
+
+        :raises: ProcessingError if master cannot be conformed to light
+        """
+        try:
+            stat = Path(path).stat()
+        except OSError:
+            self.clear()
+            return None
+
+        key = (path, stat.st_mtime_ns, stat.st_size, light.data.dtype.str, light.data.shape, is_cfa(light))
+
+        if key != self._key:
+            self.clear()
+
+            master = als_input.read_disk_image(Path(path))
+            if master is None:
+                return None
+
+            with Timer() as conforming_timer:
+                self._data = self._conform(master, light)
+            self._key = key
+
+            _LOGGER.debug(f"Master {path} read and conformed in {conforming_timer.elapsed_in_milli_as_str} ms")
+
+        return self._data
+
+    @log
+    def clear(self):
+        """
+        Drops cached master
+        """
+        self._key = None
+        self._data = None
+
+
+class RemoveDark(ImageProcessor):
+    """
+    Provides image dark removal.
+
+    Master dark is kept in memory, conformed to lights data type.
+    """
+
+    @log
+    def __init__(self):
+        super().__init__()
+        self._dark_cache = MasterCache(RemoveDark._conform_dark)
+
+    @log
+    def process_image(self, image: Image):
+
+        if not image:
+            return None
+
+        do_subtract = config.get_use_master_dark()
+
+        _LOGGER.debug(f"Dark subtraction enabled : {do_subtract}")
+
+        if do_subtract:
+
+            dark_data = self._dark_cache.get(config.get_master_dark_file_path(), image)
+
+            if dark_data is None:
+                read_error_message = QT_TRANSLATE_NOOP(
+                    "",
+                    "Could not read dark {}. Dark subtraction is SKIPPED"
+                )
+                read_error_values = [config.get_master_dark_file_path(), ]
+                MESSAGE_HUB.dispatch_warning(__name__, read_error_message, read_error_values)
+                return image
+
+            if image.data.shape != dark_data.shape:
+                mismatch_message = QT_TRANSLATE_NOOP(
+                    "",
+                    "Data structure inconsistency. Light: {} vs Dark: {}. Dark subtraction is SKIPPED"
+                )
+                mismatch_values = [image.data.shape, dark_data.shape]
+                MESSAGE_HUB.dispatch_warning(__name__, mismatch_message, mismatch_values)
+                return image
+
+            _LOGGER.debug("Subtracting dark frame...")
+
+            with Timer() as subtraction_timer:
+                subtract_saturating(image, dark_data)
+            _LOGGER.debug(f"Dark frame subtracted in {subtraction_timer.elapsed_in_milli_as_str} ms")
+
+        else:
+            self._dark_cache.clear()
+
+        return image
+
+    @staticmethod
+    @log
+    def _conform_dark(dark: Image, light: Image):
+        """
+        Conforms master dark data to light data type
+
+        :param dark: the master dark
+        :type dark: Image
+
+        :param light: the light
+        :type light: Image
+
+        :return: dark data, with light data type
+        :rtype: numpy.ndarray
+
+        :raises: ProcessingError if a data type is not handled
+        """
+        mismatch_message = QT_TRANSLATE_NOOP(
+            "",
+            "Dark & Light data types mismatch. Light: {} vs Dark: {}. Dark needs to be conformed."
+        )
+
+        return _conform_master(dark, light, mismatch_message)
+
+
+class RemoveBias(ImageProcessor):
+    """
+    Provides image bias removal.
+
+    A master dark already holds the bias signal, so bias is only removed from lights when dark subtraction is off.
+
+    Master bias is kept in memory, conformed to lights data type.
+    """
+
+    @log
+    def __init__(self):
+        super().__init__()
+        self._bias_cache = MasterCache(RemoveBias._conform_bias)
+
+    @log
+    def process_image(self, image: Image):
+
+        if not image:
+            return None
+
+        do_subtract = config.get_use_master_bias() and not config.get_use_master_dark()
+
+        _LOGGER.debug(f"Bias subtraction enabled : {do_subtract}")
+
+        if do_subtract:
+
+            bias_data = self._bias_cache.get(config.get_master_bias_file_path(), image)
+
+            if bias_data is None:
+                read_error_message = QT_TRANSLATE_NOOP(
+                    "",
+                    "Could not read bias {}. Bias subtraction is SKIPPED"
+                )
+                read_error_values = [config.get_master_bias_file_path(), ]
+                MESSAGE_HUB.dispatch_warning(__name__, read_error_message, read_error_values)
+                return image
+
+            if image.data.shape != bias_data.shape:
+                mismatch_message = QT_TRANSLATE_NOOP(
+                    "",
+                    "Data structure inconsistency. Light: {} vs Bias: {}. Bias subtraction is SKIPPED"
+                )
+                mismatch_values = [image.data.shape, bias_data.shape]
+                MESSAGE_HUB.dispatch_warning(__name__, mismatch_message, mismatch_values)
+                return image
+
+            _LOGGER.debug("Subtracting bias frame...")
+
+            with Timer() as subtraction_timer:
+                subtract_saturating(image, bias_data)
+            _LOGGER.debug(f"Bias frame subtracted in {subtraction_timer.elapsed_in_milli_as_str} ms")
+
+        else:
+            self._bias_cache.clear()
+
+        return image
+
+    @staticmethod
+    @log
+    def _conform_bias(bias: Image, light: Image):
+        """
+        Conforms master bias data to light data type
+
+        :param bias: the master bias
+        :type bias: Image
+
+        :param light: the light
+        :type light: Image
+
+        :return: bias data, with light data type
+        :rtype: numpy.ndarray
+
+        :raises: ProcessingError if a data type is not handled
+        """
+        mismatch_message = QT_TRANSLATE_NOOP(
+            "",
+            "Bias & Light data types mismatch. Light: {} vs Bias: {}. Bias needs to be conformed."
+        )
+
+        return _conform_master(bias, light, mismatch_message)
+
+
+class ApplyFlat(ImageProcessor):
+    """
+    Provides image flat field correction.
+
+    Master flat is normalized and inverted once, then kept in memory as float32 : correcting a light only costs a
+    multiplication. Master flat is expected to be already bias corrected.
+
+    For lights that still need debayering, each bayer color plane of the flat is normalized to its own mean, so flat
+    correction does not alter color balance. Color flats are normalized per channel.
+    """
+
+    @log
+    def __init__(self):
+        super().__init__()
+        self._flat_cache = MasterCache(ApplyFlat._compute_reciprocal_flat)
+
+    @log
+    def process_image(self, image: Image):
+
+        if not image:
+            return None
+
+        do_apply = config.get_use_master_flat()
+
+        _LOGGER.debug(f"Flat field correction enabled : {do_apply}")
+
+        if do_apply:
+
+            reciprocal_flat = self._flat_cache.get(config.get_master_flat_file_path(), image)
+
+            if reciprocal_flat is None:
+                read_error_message = QT_TRANSLATE_NOOP(
+                    "",
+                    "Could not read flat {}. Flat field correction is SKIPPED"
+                )
+                read_error_values = [config.get_master_flat_file_path(), ]
+                MESSAGE_HUB.dispatch_warning(__name__, read_error_message, read_error_values)
+                return image
+
+            if image.data.shape != reciprocal_flat.shape:
+                mismatch_message = QT_TRANSLATE_NOOP(
+                    "",
+                    "Data structure inconsistency. Light: {} vs Flat: {}. Flat field correction is SKIPPED"
+                )
+                mismatch_values = [image.data.shape, reciprocal_flat.shape]
+                MESSAGE_HUB.dispatch_warning(__name__, mismatch_message, mismatch_values)
+                return image
+
+            _LOGGER.debug("Applying flat field...")
+
+            with Timer() as flat_timer:
+                corrected_data = np.multiply(image.data, reciprocal_flat, dtype=np.float32)
+
+                if issubclass(image.data.dtype.type, np.integer):
+                    type_info = np.iinfo(image.data.dtype)
+                    np.rint(corrected_data, out=corrected_data)
+                    np.clip(corrected_data, type_info.min, type_info.max, out=corrected_data)
+                    corrected_data = corrected_data.astype(image.data.dtype)
+
+                image.data = corrected_data
+            _LOGGER.debug(f"Flat field applied in {flat_timer.elapsed_in_milli_as_str} ms")
+
+        else:
+            self._flat_cache.clear()
+
+        return image
+
+    @staticmethod
+    @log
+    def _compute_reciprocal_flat(flat: Image, light: Image):
+        """
+        Computes the reciprocal of normalized master flat
+
+        :param flat: the master flat
+        :type flat: Image
+
+        :param light: the light
+        :type light: Image
+
+        :return: reciprocal of normalized flat data, as float32. Pixels with no usable flat signal are set to 1 so
+                 they are left untouched
+        :rtype: numpy.ndarray
+        """
+        normalized_flat = flat.data.astype(np.float32)
+
+        if is_cfa(light) and normalized_flat.ndim == 2:
+            planes = [normalized_flat[row::2, column::2] for row in range(2) for column in range(2)]
+        elif normalized_flat.ndim == 3:
+            color_axis = normalized_flat.shape.index(min(normalized_flat.shape))
+            planes = list(np.moveaxis(normalized_flat, color_axis, 0))
+        else:
+            planes = [normalized_flat]
+
+        for plane in planes:
+            plane_mean = plane.mean()
+            if plane_mean > 0:
+                plane /= plane_mean
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            reciprocal_flat = np.reciprocal(normalized_flat, out=normalized_flat)
+
+        reciprocal_flat[~np.isfinite(reciprocal_flat) | (reciprocal_flat <= 0)] = 1
+
+        return reciprocal_flat
+
+
+def subtract_saturating(image: Image, data: np.ndarray):
+    """
+    Subtracts data from image data, clipping results to 0.
+
+    Subtraction is done in place, unless image data is read-only
+
+    :param image: the image to subtract from
+    :type image: Image
+
+    :param data: the data to subtract, same shape and type as image data
+    :type data: numpy.ndarray
+    """
+    # max(a, b) - b is a - b when a > b and 0 otherwise
+    if image.data.flags.writeable:
+        np.maximum(image.data, data, out=image.data)
+    else:
+        image.data = np.maximum(image.data, data)
+
+    image.data -= data
+
+
+def _conform_master(dark: Image, light: Image, mismatch_message: str):
+    """
+    Conforms master dark or bias data to light data type
+
+    :param dark: the master dark or bias
+    :type dark: Image
+
+    :param light: the light
+    :type light: Image
+
+    :param mismatch_message: message dispatched if data types differ
+    :type mismatch_message: str
+
+    :return: dark data, with light data type
+    :rtype: numpy.ndarray
+
+    :raises: ProcessingError if a data type is not handled
+    """
+    if light.data.dtype.name == dark.data.dtype.name:
+        return dark.data
+
+    MESSAGE_HUB.dispatch_info(__name__, mismatch_message, [light.data.dtype.name, dark.data.dtype.name])
+
+    try:
+        image_min_allowed, image_max_allowed = _get_allowed_min_and_max(light.data)
+    except TypeError:
+        raise ProcessingError(f"unhandled image data type : {light.data.dtype.type}")
+
+    try:
+        dark_min_allowed, dark_max_allowed = _get_allowed_min_and_max(dark.data)
+    except TypeError:
+        raise ProcessingError(f"unhandled masterdark data type : {dark.data.dtype.type}")
+
+    return np.interp(
+        dark.data,
+        (dark_min_allowed, dark_max_allowed),
+        (image_min_allowed, image_max_allowed)).astype(light.data.dtype)
+
+
+def _get_allowed_min_and_max(data):
+    """
+    Get the allowed minimum and maximum values according to data type
+
+    :param data: image data
+    :type data: numpy.ndarray
+
+    :return: a tuple of 2 values : minimum and maximum allowed values for data type
+    """
+
+    if issubclass(data.dtype.type, np.integer):
+        allowed_min = np.iinfo(data.dtype).min
+        allowed_max = np.iinfo(data.dtype).max
+    elif issubclass(data.dtype.type, np.floating):
+        allowed_min = 0.0
+        allowed_max = 1.0
+    else:
+        raise TypeError("Data type must be float or integer")
+
+    return allowed_min, allowed_max
+
+
+class HotPixelRemover(ImageProcessor):
+    """
+    Provides hot pixels removal.
+
+    A pixel is hot if its value is more than _HOT_PIXEL_RATIO times the mean of its 8 nearest neighbors of the same
+    color. Hot pixels are replaced with that mean. Bayer images are handled before debayering, one color plane at a
+    time. Color images are handled one channel at a time.
+
+    When defect map is enabled and a master dark is set, hot pixels are searched once, in master dark. Lights then only
+    get those pixels fixed, instead of being searched entirely.
+    """
+
+    @log
+    def __init__(self):
+        super().__init__()
+        self._defect_map_cache = MasterCache(HotPixelRemover._build_defect_map)
+
+    @log
+    def process_image(self, image: Image):
+
+        if not image:
+            return None
+
+        hpr_on = config.get_hot_pixel_remover()
+
+        _LOGGER.debug(f"Hot pixel remover enabled : {hpr_on}")
+
+        if hpr_on:
+
+            if not image.data.flags.writeable:
+                image.data = image.data.copy()
+
+            defect_map = None
+            if config.get_hot_pixel_defect_map() and config.get_use_master_dark():
+                defect_map = self._defect_map_cache.get(config.get_master_dark_file_path(), image)
+            else:
+                self._defect_map_cache.clear()
+
+            with Timer() as removal_timer:
+                if defect_map is not None:
+                    HotPixelRemover._fix_defects(image.data, defect_map, 2 if is_cfa(image) else 1)
+                    fixed_count = defect_map.size
+                else:
+                    fixed_count = sum(HotPixelRemover._fix_plane(plane) for plane in _get_color_planes(image))
+
+            _LOGGER.debug(f"*SD-HPR* {fixed_count} hot pixels fixed in {removal_timer.elapsed_in_milli_as_str} ms, "
+                          f"using defect map : {defect_map is not None}")
+
+        else:
+            self._defect_map_cache.clear()
+
+        return image
+
+    @staticmethod
+    def _find_hot_pixels(plane: np.ndarray):
+        """
+        Finds hot pixels of a single color plane
+
+        :param plane: the color plane
+        :type plane: numpy.ndarray
+
+        :return: a tuple of 2 arrays : hot pixels mask and neighbors means, as float32
+        :rtype: tuple
+        """
+        values = np.ascontiguousarray(plane, dtype=np.float32)
+        neighbor_means = cv2.boxFilter(values, -1, (3, 3), normalize=False, borderType=cv2.BORDER_REFLECT_101)
+        neighbor_means -= values
+        neighbor_means /= 8
+
+        return values > _HOT_PIXEL_RATIO * neighbor_means, neighbor_means
+
+    @staticmethod
+    def _fix_plane(plane: np.ndarray):
+        """
+        Replaces hot pixels of a single color plane, in place
+
+        :param plane: the color plane
+        :type plane: numpy.ndarray
+
+        :return: the number of fixed pixels
+        :rtype: int
+        """
+        hot_pixels, neighbor_means = HotPixelRemover._find_hot_pixels(plane)
+        plane[hot_pixels] = neighbor_means[hot_pixels]
+
+        return int(np.count_nonzero(hot_pixels))
+
+    @staticmethod
+    def _fix_defects(data: np.ndarray, defect_map: np.ndarray, step: int):
+        """
+        Replaces listed pixels with the mean of their 8 nearest neighbors of the same color, in place
+
+        :param data: the 2D image data
+        :type data: numpy.ndarray
+
+        :param defect_map: flat indices of pixels to fix
+        :type defect_map: numpy.ndarray
+
+        :param step: distance between 2 neighbors of the same color : 2 for bayer images, 1 otherwise
+        :type step: int
+        """
+        height, width = data.shape
+        rows, columns = np.unravel_index(defect_map, data.shape)
+        neighbor_sums = np.zeros(defect_map.size, dtype=np.float32)
+
+        for row_offset in (-step, 0, step):
+            for column_offset in (-step, 0, step):
+                if row_offset == column_offset == 0:
+                    continue
+
+                # neighbors outside the image are mirrored inside, like OpenCV does for full plane search
+                neighbor_rows = rows + row_offset
+                neighbor_rows = np.where((neighbor_rows < 0) | (neighbor_rows >= height),
+                                         rows - row_offset, neighbor_rows)
+                neighbor_columns = columns + column_offset
+                neighbor_columns = np.where((neighbor_columns < 0) | (neighbor_columns >= width),
+                                            columns - column_offset, neighbor_columns)
+
+                neighbor_sums += data[neighbor_rows, neighbor_columns]
+
+        data[rows, columns] = neighbor_sums / 8
+
+    @staticmethod
+    @log
+    def _build_defect_map(dark: Image, light: Image):
+        """
+        Finds hot pixels of master dark
+
+        :param dark: the master dark
+        :type dark: Image
+
+        :param light: the light
+        :type light: Image
+
+        :return: flat indices of dark hot pixels, or None if dark cannot be used for this light
+        :rtype: numpy.ndarray or None
+        """
+        if dark.data.shape != light.data.shape or light.is_color():
+            _LOGGER.debug(f"*SD-HPR* No defect map for light {light.data.shape} from dark {dark.data.shape}")
+            return None
+
+        hot_mask = np.zeros(dark.data.shape, dtype=bool)
+        step = 2 if is_cfa(light) else 1
+
+        for row in range(step):
+            for column in range(step):
+                hot_mask[row::step, column::step] = HotPixelRemover._find_hot_pixels(
+                    dark.data[row::step, column::step])[0]
+
+        defect_map = np.flatnonzero(hot_mask)
+        _LOGGER.info(f"Hot pixel defect map built from master dark : {defect_map.size} pixels")
+
+        return defect_map
+
+
+def _get_color_planes(image: Image):
+    """
+    Splits image data into color planes, sharing image data
+
+    :param image: the image
+    :type image: Image
+
+    :return: views on image data : 4 bayer color planes for bayer images, 1 plane per channel for color images, whole
+             data otherwise
+    :rtype: list
+    """
+    if image.is_color():
+        color_axis = image.data.shape.index(min(image.data.shape))
+        return list(np.moveaxis(image.data, color_axis, 0))
+
+    if is_cfa(image):
+        return [image.data[row::2, column::2] for row in range(2) for column in range(2)]
+
+    return [image.data]
+
+
+def create_pre_processes(profile: RunningProfile):
+    """
+    Creates the pre-process chain, from file reading to standardization
+
+    :param profile: the running profile
+    :type profile: RunningProfile
+
+    :return: pre-processors, in processing order
+    :rtype: List[ImageProcessor]
+    """
+    return [FileReader(profile), RemoveDark(), RemoveBias(), ApplyFlat(), HotPixelRemover(), Debayer(profile),
+            Standardize()]
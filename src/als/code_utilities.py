@@ -12,6 +12,12 @@ import psutil
 from PyQt5.QtCore import QObject, pyqtSignal, QFile, QIODevice, QTextStream
 
 
+# SignalingQueue policies, applied when an item is pushed to a full queue
+QUEUE_POLICY_BLOCK = "block"
+QUEUE_POLICY_DROP_OLDEST = "drop_oldest"
+QUEUE_POLICY_KEEP_LATEST = "keep_latest"
+QUEUE_POLICY_MERGE = "merge"
+
 # WARNING !!!!! Don't ever remove this USED import !!!!!
 # most IDEs report this as unused. They lie to you. We use it in get_text_content_of_resource()
 # pylint:disable=unused-import
@@ -91,13 +97,22 @@ class AlsException(Exception):
 
 class SignalingQueue(Queue, QObject):
     """
-    Queue subclass that emits a Qt signal when items are added or removed from the queue.
+    Queue subclass that emits Qt signals when items are added, removed or dropped from the queue.
+
+    Signals are :
 
-    Signal is :
+      - size_changed_signal : carries the new queue size
+      - items_dropped_signal : carries the number of items just dropped by queue policy
 
-      - size_changed_signal
+    A queue can be bounded, using set_policy(). Pushing an item to a queue never blocks. What happens when a bounded
+    queue is full depends on its policy :
 
-    and carries the new queue size
+      - QUEUE_POLICY_BLOCK : item is accepted. Consumers feeding this queue are expected to wait until it has room
+        before handling their next item. See is_full
+      - QUEUE_POLICY_DROP_OLDEST : oldest item is dropped
+      - QUEUE_POLICY_KEEP_LATEST : all queued items are dropped, regardless of capacity
+      - QUEUE_POLICY_MERGE : queued items with the same merge key as the new item are dropped, then the oldest
+        items are dropped if queue is still full
     """
 
     size_changed_signal = pyqtSignal(int)
@@ -108,10 +123,87 @@ class SignalingQueue(Queue, QObject):
     :type: int
     """
 
+    items_dropped_signal = pyqtSignal(int)
+    """
+    Qt signal stating that items have just been dropped by queue policy.
+
+    :param: the number of dropped items
+    :type: int
+    """
+
     @log
     def __init__(self, maxsize=0):
         Queue.__init__(self, maxsize)
         QObject.__init__(self)
+        self._policy = QUEUE_POLICY_BLOCK
+        self._capacity = 0
+        self._merge_key = SignalingQueue._get_default_merge_key
+        self._dropped_count = 0
+        self._last_put_dropped_count = 0
+
+    @log
+    def set_policy(self, policy: str, capacity: int = 0, merge_key=None):
+        """
+        Sets queue policy
+
+        :param policy: the policy : QUEUE_POLICY_BLOCK, QUEUE_POLICY_DROP_OLDEST, QUEUE_POLICY_KEEP_LATEST or
+               QUEUE_POLICY_MERGE
+        :type policy: str
+
+        :param capacity: queue capacity. 0 means unbounded
+        :type capacity: int
+
+        :param merge_key: function giving the merge key of an item, for QUEUE_POLICY_MERGE. Defaults to item
+               destination, for items having one, or item itself
+        :type merge_key: callable
+        """
+        if policy not in [QUEUE_POLICY_BLOCK, QUEUE_POLICY_DROP_OLDEST, QUEUE_POLICY_KEEP_LATEST, QUEUE_POLICY_MERGE]:
+            raise ValueError(f"Unsupported queue policy : {policy}")
+
+        with self.mutex:
+            self._policy = policy
+            self._capacity = capacity
+            self._merge_key = merge_key if merge_key is not None else SignalingQueue._get_default_merge_key
+
+    @property
+    def policy(self):
+        """
+        Retrieves queue policy
+
+        :return: the policy
+        :rtype: str
+        """
+        return self._policy
+
+    @property
+    def capacity(self):
+        """
+        Retrieves queue capacity
+
+        :return: the capacity. 0 means unbounded
+        :rtype: int
+        """
+        return self._capacity
+
+    @property
+    def dropped_count(self):
+        """
+        Retrieves the number of items dropped by queue policy since queue creation
+
+        :return: the number of dropped items
+        :rtype: int
+        """
+        return self._dropped_count
+
+    @property
+    def is_full(self):
+        """
+        Tells if queue is bounded and full
+
+        :return: True if queue holds at least as many items as its capacity
+        :rtype: bool
+        """
+        return 0 < self._capacity <= self.qsize()
 
     @log
     def get(self, block=True, timeout=None):
@@ -128,13 +220,51 @@ class SignalingQueue(Queue, QObject):
     @log
     def put(self, item, block=True, timeout=None):
         super().put(item, block, timeout)
-        self.size_changed_signal.emit(self.qsize())
+        self._emit_put_signals()
 
     @log
     def put_nowait(self, item):
         super().put_nowait(item)
+        self._emit_put_signals()
+
+    def _emit_put_signals(self):
+        with self.mutex:
+            dropped_count, self._last_put_dropped_count = self._last_put_dropped_count, 0
+
+        if dropped_count:
+            self.items_dropped_signal.emit(dropped_count)
         self.size_changed_signal.emit(self.qsize())
 
+    def _put(self, item):
+        # called by Queue with its mutex held
+        dropped_count = 0
+
+        if self._policy == QUEUE_POLICY_KEEP_LATEST:
+            dropped_count = len(self.queue)
+            self.queue.clear()
+
+        elif self._policy == QUEUE_POLICY_MERGE:
+            key = self._merge_key(item)
+            kept = [queued for queued in self.queue if self._merge_key(queued) != key]
+            dropped_count = len(self.queue) - len(kept)
+            self.queue.clear()
+            self.queue.extend(kept)
+
+        if self._policy in [QUEUE_POLICY_DROP_OLDEST, QUEUE_POLICY_MERGE] and self._capacity > 0:
+            while len(self.queue) >= self._capacity:
+                self.queue.popleft()
+                dropped_count += 1
+
+        self.queue.append(item)
+
+        self.unfinished_tasks -= dropped_count
+        self._dropped_count += dropped_count
+        self._last_put_dropped_count += dropped_count
+
+    @staticmethod
+    def _get_default_merge_key(item):
+        return getattr(item, 'destination', item)
+
 
 class AlsLogAdapter(LoggerAdapter):
 
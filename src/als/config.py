@@ -23,6 +23,7 @@ from configparser import ConfigParser, DuplicateOptionError, ParsingError
 from pathlib import Path
 
 from als.code_utilities import AlsException, AlsLogAdapter
+from als.model.base import DEBAYER_ALGORITHMS, DEBAYER_SUPERPIXEL, DEBAYER_BILINEAR
 from als.model.data import IMAGE_SAVE_TYPE_JPEG, DYNAMIC_DATA
 
 _CONFIG_FILE_PATH = os.path.expanduser("~/.als.cfg")
@@ -39,15 +40,34 @@ _IMAGE_SAVE_FORMAT = "image_save_format"
 _FULL_SCREEN = "full_screen"
 _WWW_REFRESH_PERIOD = "web_refresh_period"
 _MINIMUM_MATCH_COUNT = "alignment_minimum_match_count"
+_TRANSLATION_ONLY_ALIGNMENT = "alignment_translation_only"
+_STACKING_KAPPA = "stacking_kappa"
+_STACKING_WINDOW_SIZE = "stacking_window_size"
+_STACKING_MEMORY_BUDGET = "stacking_memory_budget"
+_STACKING_UNDO_DEPTH = "stacking_undo_depth"
 _USE_MASTER_DARK = "use_master_dark"
 _MASTER_DARK_FILE_PATH = "master_dark_file_path"
+_USE_MASTER_BIAS = "use_master_bias"
+_MASTER_BIAS_FILE_PATH = "master_bias_file_path"
+_USE_MASTER_FLAT = "use_master_flat"
+_MASTER_FLAT_FILE_PATH = "master_flat_file_path"
 _USE_HOT_PIXEL_REMOVER = "use_hot_pixel_remover"
+_USE_HOT_PIXEL_DEFECT_MAP = "use_hot_pixel_defect_map"
 _LANG = "lang"
 _BAYER_PATTERN = "bayer_pattern"
+_VISUAL_DEBAYER_ALGORITHM = "visual_debayer_algorithm"
+_PHOTO_DEBAYER_ALGORITHM = "photo_debayer_algorithm"
 _NIGHT_MODE = "night_mode"
 _SAVE_ON_STOP = "save_on_stop"
 _PROFILE = "profile"
 _PRESERVED_MEM = "preserved_mem"
+_PRE_PROCESS_WORKERS = "pre_process_workers"
+_ALIGN_WORKERS = "align_workers"
+_SCANNER_TYPE = "scanner_type"
+_INDI_SERVER_HOST = "indi_server_host"
+_INDI_SERVER_PORT = "indi_server_port"
+_INDI_DEVICE_NAME = "indi_device_name"
+_SYNTHETIC_CAMERA_SETTINGS = "synthetic_camera_settings"
 
 # keys used to describe logging level
 _LOG_LEVEL_DEBUG = "DEBUG"
@@ -78,18 +98,43 @@ _DEFAULTS = {
     _FULL_SCREEN:           0,
     _WWW_REFRESH_PERIOD:    5,
     _MINIMUM_MATCH_COUNT:   25,
+    _TRANSLATION_ONLY_ALIGNMENT: 0,
+    _STACKING_KAPPA:        3.0,
+    _STACKING_WINDOW_SIZE:  16,
+    _STACKING_MEMORY_BUDGET: 1024,
+    _STACKING_UNDO_DEPTH:   5,
     _USE_MASTER_DARK:       0,
     _MASTER_DARK_FILE_PATH: "",
+    _USE_MASTER_BIAS:       0,
+    _MASTER_BIAS_FILE_PATH: "",
+    _USE_MASTER_FLAT:       0,
+    _MASTER_FLAT_FILE_PATH: "",
     _USE_HOT_PIXEL_REMOVER: 0,
+    _USE_HOT_PIXEL_DEFECT_MAP: 0,
     _LANG:                  "sys",
     _BAYER_PATTERN:         "AUTO",
+    _VISUAL_DEBAYER_ALGORITHM: DEBAYER_SUPERPIXEL,
+    _PHOTO_DEBAYER_ALGORITHM: DEBAYER_BILINEAR,
     _NIGHT_MODE:            0,
     _SAVE_ON_STOP:          0,
     _PROFILE:               0,
     _PRESERVED_MEM:         1,
+    _PRE_PROCESS_WORKERS:   1,
+    _ALIGN_WORKERS:         1,
+    _SCANNER_TYPE:          "FS",
+    _INDI_SERVER_HOST:      "localhost",
+    _INDI_SERVER_PORT:      7624,
+    _INDI_DEVICE_NAME:      "",
+    _SYNTHETIC_CAMERA_SETTINGS: "",
 }
 _MAIN_SECTION_NAME = "main"
 
+# debayering algorithm keys, by profile
+_DEBAYER_ALGORITHM_KEYS = {
+    0: _VISUAL_DEBAYER_ALGORITHM,
+    1: _PHOTO_DEBAYER_ALGORITHM,
+}
+
 # application constants
 
 # module global data
@@ -200,6 +245,31 @@ def get_hot_pixel_remover():
         return int(_DEFAULTS[_USE_HOT_PIXEL_REMOVER]) == 1
 
 
+def set_hot_pixel_defect_map(defect_map_on: bool):
+    """
+    Set 'use hot pixel defect map' flag
+
+    :param defect_map_on: should hot pixel remover only fix pixels found hot in master dark ?
+    :type defect_map_on: bool
+    """
+
+    _set(_USE_HOT_PIXEL_DEFECT_MAP, "1" if defect_map_on else "0")
+
+
+def get_hot_pixel_defect_map():
+    """
+    Get 'use hot pixel defect map' flag
+
+    :return: True if hot pixel remover should only fix pixels found hot in master dark, False otherwise
+    :rtype: bool
+    """
+
+    try:
+        return int(_get(_USE_HOT_PIXEL_DEFECT_MAP)) == 1
+    except ValueError:
+        return int(_DEFAULTS[_USE_HOT_PIXEL_DEFECT_MAP]) == 1
+
+
 def set_save_on_stop(save_on_stop: bool):
     """
     Set 'save on stop' flag
@@ -345,6 +415,163 @@ def set_preserved_mem(code):
     _set(_PRESERVED_MEM, code)
 
 
+def get_pre_process_workers():
+    """
+    Retrieves the configured number of pre-processing worker processes.
+
+    :return: The configured number of pre-processing workers, or its default value if config entry
+             is not parsable as an int. 1 means pre-processing is done in the pre-process thread itself
+    :rtype: int
+    """
+    try:
+        return max(1, int(_get(_PRE_PROCESS_WORKERS)))
+    except ValueError:
+        return _DEFAULTS[_PRE_PROCESS_WORKERS]
+
+
+def set_pre_process_workers(count):
+    """
+    Sets number of pre-processing worker processes
+
+    :param count: number of workers
+    :type count: int
+    """
+    _set(_PRE_PROCESS_WORKERS, str(count))
+
+
+def get_align_workers():
+    """
+    Retrieves the configured number of alignment worker threads.
+
+    :return: The configured number of alignment workers, or its default value if config entry
+             is not parsable as an int. 1 means alignment is done in the stacker thread itself
+    :rtype: int
+    """
+    try:
+        return max(1, int(_get(_ALIGN_WORKERS)))
+    except ValueError:
+        return _DEFAULTS[_ALIGN_WORKERS]
+
+
+def set_align_workers(count):
+    """
+    Sets number of alignment worker threads
+
+    :param count: number of workers
+    :type count: int
+    """
+    _set(_ALIGN_WORKERS, str(count))
+
+
+def get_scanner_type():
+    """
+    Retrieves the configured input scanner type.
+
+    :return: the scanner type. Can be any value from :
+
+      - "FS" for a filesystem scanner
+      - "INDI" for an INDI client scanner
+      - "SYNTH" for a synthetic camera
+
+    :rtype: str
+    """
+    return _get(_SCANNER_TYPE)
+
+
+def set_scanner_type(scanner_type):
+    """
+    Sets input scanner type.
+
+    :param scanner_type: the scanner type. See get_scanner_type() for accepted values
+    :type scanner_type: str
+    """
+    _set(_SCANNER_TYPE, scanner_type)
+
+
+def get_indi_server_host():
+    """
+    Retrieves the configured INDI server host.
+
+    :return: the INDI server host
+    :rtype: str
+    """
+    return _get(_INDI_SERVER_HOST)
+
+
+def set_indi_server_host(host):
+    """
+    Sets INDI server host.
+
+    :param host: the INDI server host
+    :type host: str
+    """
+    _set(_INDI_SERVER_HOST, host)
+
+
+def get_indi_server_port():
+    """
+    Retrieves the configured INDI server port number.
+
+    :return: The configured port number, or its default value if config entry
+             is not parsable as an int.
+    :rtype: int
+    """
+    try:
+        return int(_get(_INDI_SERVER_PORT))
+    except ValueError:
+        return _DEFAULTS[_INDI_SERVER_PORT]
+
+
+def set_indi_server_port(port):
+    """
+    Sets INDI server port number.
+
+    :param port: the INDI server port number
+    :type port: int
+    """
+    _set(_INDI_SERVER_PORT, str(port))
+
+
+def get_indi_device_name():
+    """
+    Retrieves the name of the INDI device we get images from.
+
+    :return: the device name. An empty name means images are accepted from any device
+    :rtype: str
+    """
+    return _get(_INDI_DEVICE_NAME)
+
+
+def set_indi_device_name(name):
+    """
+    Sets the name of the INDI device we get images from.
+
+    :param name: the device name
+    :type name: str
+    """
+    _set(_INDI_DEVICE_NAME, name)
+
+
+def get_synthetic_camera_settings():
+    """
+    Retrieves synthetic camera settings.
+
+    :return: comma separated key=value pairs. See SyntheticCameraSettings for available keys
+    :rtype: str
+    """
+    return _get(_SYNTHETIC_CAMERA_SETTINGS)
+
+
+def set_synthetic_camera_settings(settings):
+    """
+    Sets synthetic camera settings.
+
+    :param settings: comma separated key=value pairs. See SyntheticCameraSettings for available keys
+    :type settings: str
+    """
+    _set(_SYNTHETIC_CAMERA_SETTINGS, settings)
+
+
 def get_www_server_refresh_period():
     """
     Retrieves the configured web server page refresh period.
@@ -409,6 +636,38 @@ def set_bayer_pattern(pattern):
     _set(_BAYER_PATTERN, pattern)
 
 
+def get_debayer_algorithm(profile):
+    """
+    Retrieves the debayering algorithm of a running profile
+
+    :param profile: the profile, as stored by set_profile()
+    :type profile: int
+
+    :return: the debayering algorithm. Any value of als.model.base.DEBAYER_ALGORITHMS
+    :rtype: str
+    """
+    key = _DEBAYER_ALGORITHM_KEYS[profile]
+    algorithm = _get(key)
+
+    if algorithm not in DEBAYER_ALGORITHMS:
+        return _DEFAULTS[key]
+
+    return algorithm
+
+
+def set_debayer_algorithm(profile, algorithm):
+    """
+    Sets the debayering algorithm of a running profile
+
+    :param profile: the profile, as stored by set_profile()
+    :type profile: int
+
+    :param algorithm: the debayering algorithm. See get_debayer_algorithm() for accepted values
+    :type algorithm: str
+    """
+    _set(_DEBAYER_ALGORITHM_KEYS[profile], algorithm)
+
+
 def get_lang():
     """
     Retrieves preferred language
@@ -492,6 +751,123 @@ def set_minimum_match_count(minimum_match_count):
     _set(_MINIMUM_MATCH_COUNT, str(minimum_match_count))
 
 
+def set_translation_only_alignment(translation_only: bool):
+    """
+    Set 'translation only alignment' flag
+
+    :param translation_only: should alignment first look for a pure translation, as fields do not rotate ?
+    :type translation_only: bool
+    """
+
+    _set(_TRANSLATION_ONLY_ALIGNMENT, "1" if translation_only else "0")
+
+
+def get_translation_only_alignment():
+    """
+    Get 'translation only alignment' flag
+
+    :return: True if alignment should first look for a pure translation, False otherwise
+    :rtype: bool
+    """
+
+    try:
+        return int(_get(_TRANSLATION_ONLY_ALIGNMENT)) == 1
+    except ValueError:
+        return int(_DEFAULTS[_TRANSLATION_ONLY_ALIGNMENT]) == 1
+
+
+def get_stacking_kappa():
+    """
+    Retrieves kappa-sigma stacking kappa value.
+
+    :return: how many standard deviations away from the mean a pixel value must be to be rejected
+    :rtype: float
+    """
+    try:
+        return max(0.5, float(_get(_STACKING_KAPPA)))
+    except ValueError:
+        return _DEFAULTS[_STACKING_KAPPA]
+
+
+def set_stacking_kappa(kappa: float):
+    """
+    Sets kappa-sigma stacking kappa value.
+
+    :param kappa: how many standard deviations away from the mean a pixel value must be to be rejected
+    :type kappa: float
+    """
+    _set(_STACKING_KAPPA, str(kappa))
+
+
+def get_stacking_window_size():
+    """
+    Retrieves the number of latest stacked images kept by stacking modes that need them.
+
+    :return: how many latest stacked images are kept
+    :rtype: int
+    """
+    try:
+        return max(1, int(_get(_STACKING_WINDOW_SIZE)))
+    except ValueError:
+        return _DEFAULTS[_STACKING_WINDOW_SIZE]
+
+
+def set_stacking_window_size(size: int):
+    """
+    Sets the number of latest stacked images kept by stacking modes that need them.
+
+    :param size: how many latest stacked images are kept
+    :type size: int
+    """
+    _set(_STACKING_WINDOW_SIZE, str(size))
+
+
+def get_stacking_memory_budget():
+    """
+    Retrieves the memory allowed for keeping latest stacked images in RAM. Beyond that, they are kept on disk.
+
+    :return: the memory budget, in MB
+    :rtype: int
+    """
+    try:
+        return max(1, int(_get(_STACKING_MEMORY_BUDGET)))
+    except ValueError:
+        return _DEFAULTS[_STACKING_MEMORY_BUDGET]
+
+
+def set_stacking_memory_budget(budget_mb: int):
+    """
+    Sets the memory allowed for keeping latest stacked images in RAM.
+
+    :param budget_mb: the memory budget, in MB
+    :type budget_mb: int
+    """
+    _set(_STACKING_MEMORY_BUDGET, str(budget_mb))
+
+
+def get_stacking_undo_depth():
+    """
+    Retrieves how many latest stacked images can be removed from a mean or sum stack.
+
+    :return: how many latest stacked images are kept for removal. 0 means removal is disabled
+    :rtype: int
+    """
+    try:
+        return max(0, int(_get(_STACKING_UNDO_DEPTH)))
+    except ValueError:
+        return _DEFAULTS[_STACKING_UNDO_DEPTH]
+
+
+def set_stacking_undo_depth(depth: int):
+    """
+    Sets how many latest stacked images can be removed from a mean or sum stack.
+
+    :param depth: how many latest stacked images are kept for removal
+    :type depth: int
+    """
+    _set(_STACKING_UNDO_DEPTH, str(depth))
+
+
 def set_use_master_dark(use_dark: bool):
     """
     Set use dark flag
@@ -537,6 +913,96 @@ def set_master_dark_file_path(path):
     _set(_MASTER_DARK_FILE_PATH, path)
 
 
+def set_use_master_bias(use_bias: bool):
+    """
+    Set use bias flag
+
+    :param use_bias: Remove master bias from images ?
+    :type use_bias: bool
+    """
+
+    _set(_USE_MASTER_BIAS, "1" if use_bias else "0")
+
+
+def get_use_master_bias():
+    """
+    Get use bias flag
+
+    :return: True if bias should be used, False otherwise
+    :rtype: bool
+    """
+
+    try:
+        return _get(_USE_MASTER_BIAS) == "1"
+    except ValueError:
+        return _DEFAULTS[_USE_MASTER_BIAS]
+
+
+def get_master_bias_file_path():
+    """
+    Retrieves the master bias file path.
+
+    :return: the master bias file path
+    :rtype: str
+    """
+    return _get(_MASTER_BIAS_FILE_PATH)
+
+
+def set_master_bias_file_path(path):
+    """
+    Sets the master bias file path.
+
+    :param path: the master bias file path
+    :type path: str
+    """
+    _set(_MASTER_BIAS_FILE_PATH, path)
+
+
+def set_use_master_flat(use_flat: bool):
+    """
+    Set use flat flag
+
+    :param use_flat: Apply master flat to images ?
+    :type use_flat: bool
+    """
+
+    _set(_USE_MASTER_FLAT, "1" if use_flat else "0")
+
+
+def get_use_master_flat():
+    """
+    Get use flat flag
+
+    :return: True if flat should be used, False otherwise
+    :rtype: bool
+    """
+
+    try:
+        return _get(_USE_MASTER_FLAT) == "1"
+    except ValueError:
+        return _DEFAULTS[_USE_MASTER_FLAT]
+
+
+def get_master_flat_file_path():
+    """
+    Retrieves the master flat file path.
+
+    :return: the master flat file path
+    :rtype: str
+    """
+    return _get(_MASTER_FLAT_FILE_PATH)
+
+
+def set_master_flat_file_path(path):
+    """
+    Sets the master flat file path.
+
+    :param path: the master flat file path
+    :type path: str
+    """
+    _set(_MASTER_FLAT_FILE_PATH, path)
+
+
 def get_window_geometry():
     """
     Retrieves main window geometry.
@@ -568,6 +1034,34 @@ def set_window_geometry(geometry_tuple):
     _set(_WINDOW_GEOMETRY, ",".join([str(value) for value in geometry_tuple]))
 
 
+def get_snapshot():
+    """
+    Retrieves a copy of all current config values.
+
+    This is used to hand current config to worker processes
+
+    :return: all config values, by key
+    :rtype: dict
+    """
+    return {key: _get(key) for key in _DEFAULTS}
+
+
+def load_snapshot(snapshot: dict):
+    """
+    Sets all config values from a snapshot taken with get_snapshot().
+
+    Nothing is saved to disk.
+
+    :param snapshot: the config values, by key
+    :type snapshot: dict
+    """
+    if not _CONFIG_PARSER.has_section(_MAIN_SECTION_NAME):
+        _CONFIG_PARSER.add_section(_MAIN_SECTION_NAME)
+
+    for key, value in snapshot.items():
+        _set(key, value)
+
+
 def save():
     """
     Saves settings to disk.
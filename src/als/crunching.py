@@ -3,6 +3,7 @@ A set of shared utilities for number crunching
 """
 from logging import getLogger
 
+import cv2
 import numpy as np
 
 from als.code_utilities import log, AlsLogAdapter
@@ -66,4 +67,97 @@ def get_image_memory_size(image: Image):
         return 4 * a * b * c
 
     (a, b) = image.data.shape
-    return 4 * a * b
\ No newline at end of file
+    return 4 * a * b
+
+
+@log
+def superpixel_debayer(data: np.ndarray, bayer_pattern: str):
+    """
+    Builds a color image from bayer data, using each 2x2 bayer cell as a single RGB pixel.
+
+    Red and blue values are taken as is and green value is the mean of both green pixels of the cell. Resulting
+    image is half the width and half the height of source data. An odd last row or column is dropped.
+
+    :param data: the raw bayer data
+    :type data: numpy.ndarray
+
+    :param bayer_pattern: the bayer pattern, as found in FITS headers. Example : 'RGGB'
+    :type bayer_pattern: str
+
+    :return: color data, with color axis last and same dtype as source data
+    :rtype: numpy.ndarray
+    """
+    height, width = data.shape[0] // 2 * 2, data.shape[1] // 2 * 2
+
+    planes = [data[row:height:2, column:width:2] for row in range(2) for column in range(2)]
+    green_planes = [plane for color, plane in zip(bayer_pattern, planes) if color == 'G']
+
+    result = np.empty((height // 2, width // 2, 3), dtype=data.dtype)
+    result[:, :, 0] = planes[bayer_pattern.index('R')]
+    result[:, :, 1] = (green_planes[0].astype(np.float32) + green_planes[1]) / 2
+    result[:, :, 2] = planes[bayer_pattern.index('B')]
+
+    return result
+
+
+def superpixel_luminance(data: np.ndarray):
+    """
+    Builds a luminance proxy from bayer data : the mean of each 2x2 bayer cell.
+
+    Resulting image is half the width and half the height of source data. An odd last row or column is dropped.
+
+    :param data: the raw bayer data
+    :type data: numpy.ndarray
+
+    :return: luminance, as float32
+    :rtype: numpy.ndarray
+    """
+    height, width = data.shape[0] // 2 * 2, data.shape[1] // 2 * 2
+
+    luminance = data[0:height:2, 0:width:2].astype(np.float32)
+    luminance += data[0:height:2, 1:width:2]
+    luminance += data[1:height:2, 0:width:2]
+    luminance += data[1:height:2, 1:width:2]
+    luminance /= 4
+
+    return luminance
+
+
+# bilinear interpolation kernels, applied to a color plane with zeros at other colors locations
+_BILINEAR_GREEN_KERNEL = np.array([[0, 1, 0], [1, 4, 1], [0, 1, 0]], dtype=np.float32) / 4
+_BILINEAR_RED_BLUE_KERNEL = np.array([[1, 2, 1], [2, 4, 2], [1, 2, 1]], dtype=np.float32) / 4
+
+
+def bilinear_debayer(data: np.ndarray, bayer_pattern: str):
+    """
+    Builds a color image from bayer data, using bilinear interpolation.
+
+    Unlike OpenCV debayering, this works on float data, so it can be used on stacked bayer data
+
+    :param data: the raw bayer data
+    :type data: numpy.ndarray
+
+    :param bayer_pattern: the bayer pattern, as found in FITS headers. Example : 'RGGB'
+    :type bayer_pattern: str
+
+    :return: color data, with color axis last, as float32
+    :rtype: numpy.ndarray
+    """
+    height, width = data.shape
+    values = data.astype(np.float32, copy=False)
+    result = np.empty((height, width, 3), dtype=np.float32)
+    color_plane = np.empty_like(values)
+
+    for channel, color in enumerate('RGB'):
+        color_plane.fill(0)
+        for cell_index, cell_color in enumerate(bayer_pattern):
+            if cell_color == color:
+                row, column = divmod(cell_index, 2)
+                color_plane[row::2, column::2] = values[row::2, column::2]
+
+        kernel = _BILINEAR_GREEN_KERNEL if color == 'G' else _BILINEAR_RED_BLUE_KERNEL
+
+        # reflecting around edge pixels keeps bayer parity
+        result[:, :, channel] = cv2.filter2D(color_plane, -1, kernel, borderType=cv2.BORDER_REFLECT_101)
+
+    return result
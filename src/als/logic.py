@@ -27,11 +27,13 @@ from typing import List
 from PyQt5.QtCore import QFile, QT_TRANSLATE_NOOP, QCoreApplication, QThread, QTimer
 
 from als import config
+from als.calibration import create_pre_processes
 from als.code_utilities import log, AlsException, SignalingQueue, get_text_content_of_resource, get_timestamp, \
     available_memory, AlsLogAdapter
-from als.streams.input import InputScanner, ScannerStartError
+from als.streams.input import create_scanner
 from als.streams.network import get_ip, WebServer
 from als.streams.output import ImageSaver
+from als.streams.scanner import InputScanner, ScannerStartError, SCANNER_TYPE_FILESYSTEM
 from als.messaging import MESSAGE_HUB
 from als.model.base import Image, Session, VisualProfile, PhotoProfile
 from als.model.data import (
@@ -40,8 +42,8 @@ from als.model.data import (
     IMAGE_SAVE_TYPE_JPEG, WEB_SERVED_IMAGE_FILE_NAME_BASE
 )
 from als.model.params import ProcessingParameter
-from als.processing import Pipeline, Debayer, Standardize, ConvertForOutput, Levels, ColorBalance, AutoStretch, \
-    HotPixelRemover, RemoveDark, FileReader, HistogramComputer, QImageGenerator
+from als.processing import Pipeline, ParallelPipeline, ConvertForOutput, Levels, ColorBalance, AutoStretch, \
+    HistogramComputer, QImageGenerator, Debayer
 from als.stack import Stacker
 
 _LOGGER = AlsLogAdapter(getLogger(__name__), {})
@@ -94,21 +96,35 @@ class Controller:
 
         DYNAMIC_DATA.last_timing = 0
 
-        self._input_scanner: InputScanner = InputScanner.create_scanner()
-
         profile_code = config.get_profile()
         self._profile = Controller.profiles[profile_code]
+        self._profile.set_debayer_algorithm(config.get_debayer_algorithm(profile_code))
         _LOGGER.debug(f"*SD-PROFILE* Using running profile: {profile_code}")
 
+        self._input_scanner: InputScanner = create_scanner(self._profile, config.get_scanner_type())
+
         self._pre_process_queue: SignalingQueue = DYNAMIC_DATA.pre_process_queue
-        self._pre_process_pipeline: Pipeline = Pipeline(
-            'pre-process',
-            self._pre_process_queue,
-            [FileReader(self._profile), RemoveDark(), HotPixelRemover(), Debayer(), Standardize()])
+        pre_processes = create_pre_processes(self._profile)
+        pre_process_workers = config.get_pre_process_workers()
+        if pre_process_workers > 1:
+            _LOGGER.debug(f"*SD-PREPROC* Using {pre_process_workers} pre-process worker processes")
+            self._pre_process_pipeline: Pipeline = ParallelPipeline(
+                'pre-process',
+                self._pre_process_queue,
+                pre_processes,
+                pre_process_workers)
+        else:
+            self._pre_process_pipeline: Pipeline = Pipeline(
+                'pre-process',
+                self._pre_process_queue,
+                pre_processes)
         self._pre_process_pipeline.start(self._profile.get_pre_process_priority)
 
         self._stacker_queue: SignalingQueue = DYNAMIC_DATA.stacker_queue
-        self._stacker: Stacker = Stacker(self._stacker_queue, self._profile)
+        align_workers = config.get_align_workers()
+        if align_workers > 1:
+            _LOGGER.debug(f"*SD-ALIGN* Using {align_workers} alignment worker threads")
+        self._stacker: Stacker = Stacker(self._stacker_queue, self._profile, align_workers)
         self._stacker.stacking_mode = I18n.STACKING_MODE_MEAN
         self._stacker.align_before_stack = True
         self._stacker.start(self._profile.get_stacking_priority)
@@ -121,6 +137,7 @@ class Controller:
         self._rgb_processor = ColorBalance()
         self._autostretch_processor = AutoStretch()
         self._levels_processor = Levels()
+        self._post_process_pipeline.add_process(Debayer(self._profile, at_output=True))
         self._post_process_pipeline.add_process(self._autostretch_processor)
         self._post_process_pipeline.add_process(self._levels_processor)
         self._post_process_pipeline.add_process(self._rgb_processor)
@@ -137,6 +154,7 @@ class Controller:
         self._image_timings = dict()
 
         self._input_scanner.new_image_path_signal[str].connect(self.on_new_image_path)
+        self._input_scanner.new_image_signal[Image].connect(self.on_new_image)
         self._pre_process_pipeline.new_result_signal[Image].connect(self.on_new_pre_processed_image)
         self._stacker.stack_size_changed_signal[int].connect(self.on_stack_size_changed)
         self._stacker.new_result_signal[Image].connect(self.on_new_stack_result)
@@ -158,6 +176,23 @@ class Controller:
 
         DYNAMIC_DATA.session.status_changed_signal.connect(self._notify_model_observers)
 
+        self._pre_process_queue.items_dropped_signal[int].connect(self.on_frames_dropped)
+        self._stacker_queue.items_dropped_signal[int].connect(self.on_frames_dropped)
+
+        queue_policies = self._profile.get_queue_policies
+        for queue_name, queue in [('pre-process', self._pre_process_queue),
+                                  ('stack', self._stacker_queue),
+                                  ('post-process', self._post_process_queue),
+                                  ('save', self._saver_queue)]:
+            if queue_name in queue_policies:
+                policy, capacity = queue_policies[queue_name]
+                queue.set_policy(policy, capacity)
+                _LOGGER.debug(f"*SD-QPOLICY* {queue_name} queue policy: {policy} - capacity: {capacity}")
+
+        self._pre_process_pipeline.set_downstream_queue(self._stacker_queue)
+        self._stacker.set_downstream_queue(self._post_process_queue)
+        self._post_process_pipeline.set_downstream_queue(self._saver_queue)
+
         self._metrics_timer = QTimer()
         self._metrics_timer.setInterval(2000)
         self._metrics_timer.timeout.connect(self.collect_metrics)
@@ -295,6 +330,30 @@ class Controller:
         """
         self._stacker.stacking_mode = mode
 
+    @log
+    def remove_last_frames(self, count: int = 1):
+        """
+        Removes the latest stacked frames from stack, without stacking anything again
+
+        :param count: how many frames to remove
+        :type count: int
+
+        :return: how many frames were removed
+        :rtype: int
+        """
+        removed_count = self._stacker.remove_last_frames(count)
+
+        if removed_count > 0:
+            MESSAGE_HUB.dispatch_info(__name__,
+                                      QT_TRANSLATE_NOOP("", "Removed {} latest frame(s) from stack"),
+                                      [removed_count, ])
+        elif self._stacker.size > 0:
+            MESSAGE_HUB.dispatch_warning(__name__,
+                                         QT_TRANSLATE_NOOP("", "No more frames can be removed from stack in mode {}"),
+                                         [self._stacker.stacking_mode, ])
+
+        return removed_count
+
     @log
     def on_stack_size_changed(self, size):
         """
@@ -342,7 +401,7 @@ class Controller:
         if image.exposure_time != Image.UNDEF_EXP_TIME:
             DYNAMIC_DATA.total_exposure_time += image.exposure_time
 
-        self.purge_queue(self._post_process_queue)
+        # post-process queue policy makes sure only the latest stacking result is waiting
         self._post_process_queue.put(image)
 
     @log
@@ -356,6 +415,17 @@ class Controller:
         self._image_timings[image_path] = time.time()
         self._pre_process_queue.put(image_path)
 
+    @log
+    def on_new_image(self, image: Image):
+        """
+        A new image as been received in memory by input scanner
+
+        :param image: the new image
+        :type image: Image
+        """
+        self._image_timings[image.ticket] = time.time()
+        self._pre_process_queue.put(image)
+
     @log
     def on_new_pre_processed_image(self, image: Image):
         """
@@ -366,6 +436,18 @@ class Controller:
         """
         self._stacker_queue.put(image)
 
+    @log
+    def on_frames_dropped(self, count: int):
+        """
+        Qt slot executed when frames have been dropped from a queue by its policy
+
+        :param count: number of dropped frames
+        :type count: int
+        """
+        DYNAMIC_DATA.dropped_frame_count += count
+        _LOGGER.info(f"*SD-DROP* {count} frame(s) dropped. Total: {DYNAMIC_DATA.dropped_frame_count}")
+        self._notify_model_observers()
+
     @log
     def on_pre_process_queue_size_changed(self, new_size):
         """
@@ -489,14 +571,17 @@ class Controller:
                 self._image_timings.clear()
                 DYNAMIC_DATA.last_timing = 0
                 DYNAMIC_DATA.total_exposure_time = 0
+                DYNAMIC_DATA.dropped_frame_count = 0
 
                 # checking presence of critical folders
                 critical_folders_dict = {
-                    "scan": config.get_scan_folder_path(),
                     "work": config.get_work_folder_path(),
                     "web":  config.get_web_folder_path(),
                 }
 
+                if config.get_scanner_type() == SCANNER_TYPE_FILESYSTEM:
+                    critical_folders_dict["scan"] = config.get_scan_folder_path()
+
                 for role, path in critical_folders_dict.items():
                     if not Path(path).is_dir():
                         title = QT_TRANSLATE_NOOP("", "Missing critical folder")
@@ -3,6 +3,7 @@ Main module, basically in charge of application init / start
 """
 import argparse
 import locale
+import multiprocessing
 import os
 import platform
 import sys
@@ -48,6 +49,9 @@ def main():
     """
     Runs ALS
     """
+    # needed by pre-process worker processes when running from a frozen bundle
+    multiprocessing.freeze_support()
+
     parser = argparse.ArgumentParser()
     parser.add_argument("-s", "--start_session", help="Start session on application startup", action="store_true")
     parser.add_argument("-w", "--start_server", help="Start web server on application startup", action="store_true")
@@ -0,0 +1,486 @@
+"""
+Builds master calibration frames : darks, flats or biases combined into a single FITS file.
+
+Memory use does not depend on the number of frames :
+
+  - frames are first copied, in a pool of worker processes, into a cube file on disk, next to the master
+  - workers then combine the cube strip by strip. Strip size is computed so all strips being combined at the same
+    time fit in a memory budget
+
+Masters keep the data type of their frames, so they can be used by dark, bias and flat processors directly.
+
+Usage :
+
+    als-master [-t {dark,bias,flat}] [-m {median,kappa-sigma}] [-k KAPPA] [-i ITERATIONS] [-b BIAS] [-o OUTPUT]
+               [-w WORKERS] [--memory MEMORY] [--use] INPUT [INPUT ...]
+
+Each INPUT is either an image file or a folder. Folders are searched recursively for files.
+"""
+import os
+import sys
+import tempfile
+import warnings
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from logging import getLogger
+from pathlib import Path
+
+import numpy as np
+from astropy.io import fits
+from PyQt5.QtCore import QThread, pyqtSignal, QCoreApplication
+
+from als import config
+from als.code_utilities import log, AlsLogAdapter, Timer
+from als.model.data import I18n
+from als.streams.input import read_disk_image, collect_input_paths
+
+_LOGGER = AlsLogAdapter(getLogger(__name__), {})
+
+MASTER_TYPE_DARK = "dark"
+MASTER_TYPE_BIAS = "bias"
+MASTER_TYPE_FLAT = "flat"
+
+MASTER_METHOD_MEDIAN = "median"
+MASTER_METHOD_KAPPA_SIGMA = "kappa-sigma"
+
+DEFAULT_KAPPA = 3.
+DEFAULT_ITERATIONS = 3
+DEFAULT_MEMORY_BUDGET_MB = 1024
+
+# combining a strip needs the float32 strip and a few temporaries of the same size
+_STRIP_MEMORY_FACTOR = 3 * np.dtype(np.float32).itemsize
+
+
+class MasterBuildError(Exception):
+    """
+    Raised when a master cannot be built
+    """
+
+
+class MasterBuilder(QThread):
+    """
+    Builds a master in the background.
+
+    Progress is emitted as a (done, total) tuple of steps. Once thread is finished, error holds the error message, if
+    any
+    """
+
+    progress_signal = pyqtSignal(int, int)
+    """Qt signal emitted on build progress"""
+
+    # pylint: disable=R0913
+    @log
+    def __init__(self, paths, method: str, destination: str, bias_path: str = None, worker_count: int = 1):
+        QThread.__init__(self)
+        self._paths = paths
+        self._method = method
+        self._destination = destination
+        self._bias_path = bias_path
+        self._worker_count = worker_count
+        self.error = None
+
+    @log
+    def run(self):
+        """
+        Builds the master. Build errors are stored in self.error instead of being raised, including worker process
+        failures, so they can be reported once thread is finished
+        """
+        try:
+            build_master(self._paths,
+                         self._method,
+                         self._destination,
+                         bias_path=self._bias_path,
+                         worker_count=self._worker_count,
+                         progress_callback=self.progress_signal.emit)
+
+        except MasterBuildError as build_error:
+            self.error = str(build_error)
+
+        except (BrokenProcessPool, MemoryError) as worker_error:
+            _LOGGER.error(f"Master build failed : {worker_error!r}")
+            self.error = f"Could not build master : {worker_error!r}"
+
+
+# pylint: disable=R0913, R0914
+@log
+def build_master(paths, method: str, destination: str, kappa: float = DEFAULT_KAPPA,
+                 iterations: int = DEFAULT_ITERATIONS, bias_path: str = None, worker_count: int = 1,
+                 memory_budget_mb: int = DEFAULT_MEMORY_BUDGET_MB, progress_callback=None):
+    """
+    Combines frames into a master and saves it as FITS
+
+    :param paths: frame file paths
+    :type paths: list
+
+    :param method: combination method : MASTER_METHOD_MEDIAN or MASTER_METHOD_KAPPA_SIGMA
+    :type method: str
+
+    :param destination: path of the master FITS file
+    :type destination: str
+
+    :param kappa: for kappa-sigma combination, pixel values further than kappa times standard deviation from mean
+                  are rejected
+    :type kappa: float
+
+    :param iterations: for kappa-sigma combination, max number of rejection passes
+    :type iterations: int
+
+    :param bias_path: optional master bias file path, subtracted from frames before combination
+    :type bias_path: str
+
+    :param worker_count: number of worker processes
+    :type worker_count: int
+
+    :param memory_budget_mb: memory allowed for combination, in MB, shared by all workers
+    :type memory_budget_mb: int
+
+    :param progress_callback: optional function called with done and total step counts
+    :type progress_callback: callable
+
+    :return: the number of combined frames
+    :rtype: int
+
+    :raises: MasterBuildError if master cannot be built
+    """
+    if method not in [MASTER_METHOD_MEDIAN, MASTER_METHOD_KAPPA_SIGMA]:
+        raise MasterBuildError(f"Unknown combination method : {method}")
+
+    paths = [str(path) for path in paths]
+    if not paths:
+        raise MasterBuildError("No frame to combine")
+
+    first_frame = read_disk_image(Path(paths[0]))
+    if first_frame is None:
+        raise MasterBuildError(f"Could not read {paths[0]}")
+
+    frame_shape = first_frame.data.shape
+    frame_dtype = first_frame.data.dtype
+    pixel_count = first_frame.data.size
+
+    bias_data = _read_bias(bias_path, first_frame.data) if bias_path else None
+
+    cube_file, cube_path = tempfile.mkstemp(prefix=".als_master_", suffix=".cube",
+                                            dir=str(Path(destination).resolve().parent))
+    os.close(cube_file)
+    cube_shape = (len(paths), pixel_count)
+
+    try:
+        with Timer() as build_timer:
+            cube = np.memmap(cube_path, dtype=frame_dtype, mode='w+', shape=cube_shape)
+            cube[0] = first_frame.data.reshape(-1)
+            cube.flush()
+            del cube
+
+            strip_size = _compute_strip_size(len(paths), pixel_count, worker_count, memory_budget_mb)
+            strips = [(start, min(start + strip_size, pixel_count)) for start in range(0, pixel_count, strip_size)]
+
+            total_steps = len(paths) + len(strips)
+            done_steps = 1
+            _report_progress(progress_callback, done_steps, total_steps)
+
+            exposure_times = [first_frame.exposure_time]
+            valid_indices = [0]
+
+            with ProcessPoolExecutor(max_workers=worker_count,
+                                     initializer=config.load_snapshot,
+                                     initargs=(config.get_snapshot(), )) as executor:
+
+                store_futures = [
+                    executor.submit(_store_frame, path, cube_path, cube_shape, frame_dtype.str, frame_shape, index)
+                    for index, path in enumerate(paths) if index > 0]
+
+                for index, future in enumerate(store_futures, start=1):
+                    exposure_time = future.result()
+                    if exposure_time is None:
+                        _LOGGER.warning(f"Frame {paths[index]} is unreadable or does not match "
+                                        f"{frame_shape} {frame_dtype.name}. It is ignored")
+                    else:
+                        valid_indices.append(index)
+                        exposure_times.append(exposure_time)
+                    done_steps += 1
+                    _report_progress(progress_callback, done_steps, total_steps)
+
+                master_data = np.empty(pixel_count, dtype=frame_dtype)
+
+                combine_futures = [
+                    executor.submit(_combine_strip, cube_path, cube_shape, frame_dtype.str, valid_indices,
+                                    start, end, method, kappa, iterations,
+                                    None if bias_data is None else bias_data[start:end])
+                    for start, end in strips]
+
+                for (start, end), future in zip(strips, combine_futures):
+                    master_data[start:end] = future.result()
+                    done_steps += 1
+                    _report_progress(progress_callback, done_steps, total_steps)
+
+        _save_master(master_data.reshape(frame_shape), destination, method, first_frame.bayer_pattern,
+                     exposure_times)
+
+    except OSError as os_error:
+        raise MasterBuildError(f"Could not build master : {os_error}")
+
+    finally:
+        try:
+            Path(cube_path).unlink()
+        except OSError as os_error:
+            _LOGGER.warning(f"Could not remove temporary cube file {cube_path} : {os_error}")
+
+    _LOGGER.info(f"Master {destination} built from {len(valid_indices)} frames in "
+                 f"{build_timer.elapsed_in_milli_as_str} ms, using {len(strips)} strips")
+
+    return len(valid_indices)
+
+
+def _read_bias(bias_path: str, frame_data: np.ndarray):
+    """
+    Reads master bias to be subtracted from frames
+
+    :param bias_path: master bias file path
+    :type bias_path: str
+
+    :param frame_data: data of a frame
+    :type frame_data: numpy.ndarray
+
+    :return: flattened bias data, as float32
+    :rtype: numpy.ndarray
+
+    :raises: MasterBuildError if bias cannot be read or does not match frames
+    """
+    bias = read_disk_image(Path(bias_path))
+
+    if bias is None:
+        raise MasterBuildError(f"Could not read bias {bias_path}")
+
+    if bias.data.shape != frame_data.shape:
+        raise MasterBuildError(f"Bias shape {bias.data.shape} does not match frames shape {frame_data.shape}")
+
+    return bias.data.astype(np.float32).reshape(-1)
+
+
+def _compute_strip_size(frame_count: int, pixel_count: int, worker_count: int, memory_budget_mb: int):
+    """
+    Computes the number of pixels combined at once by each worker
+
+    :param frame_count: number of frames
+    :type frame_count: int
+
+    :param pixel_count: number of pixels in a frame
+    :type pixel_count: int
+
+    :param worker_count: number of workers combining strips at the same time
+    :type worker_count: int
+
+    :param memory_budget_mb: memory allowed for combination, in MB
+    :type memory_budget_mb: int
+
+    :return: strip size, in pixels
+    :rtype: int
+    """
+    budget_per_worker = memory_budget_mb * 2 ** 20 // max(1, worker_count)
+    strip_size = budget_per_worker // (frame_count * _STRIP_MEMORY_FACTOR)
+
+    return int(min(pixel_count, max(1024, strip_size)))
+
+
+def _report_progress(progress_callback, done: int, total: int):
+    if progress_callback is not None:
+        progress_callback(done, total)
+
+
+# pylint: disable=R0913
+def _store_frame(path: str, cube_path: str, cube_shape: tuple, dtype_str: str, frame_shape: tuple, index: int):
+    """
+    Reads a frame and copies it into the cube. Runs in a worker process
+
+    :return: frame exposure time or None if frame could not be stored
+    :rtype: float or None
+    """
+    image = read_disk_image(Path(path))
+
+    if image is None or image.data.shape != frame_shape or image.data.dtype.str != dtype_str:
+        return None
+
+    cube = np.memmap(cube_path, dtype=np.dtype(dtype_str), mode='r+', shape=cube_shape)
+    cube[index] = image.data.reshape(-1)
+    cube.flush()
+
+    return image.exposure_time
+
+
+# pylint: disable=R0913
+def _combine_strip(cube_path: str, cube_shape: tuple, dtype_str: str, valid_indices, start: int, end: int,
+                   method: str, kappa: float, iterations: int, bias_strip):
+    """
+    Combines a strip of all valid frames. Runs in a worker process
+
+    :return: combined strip, with frames data type
+    :rtype: numpy.ndarray
+    """
+    dtype = np.dtype(dtype_str)
+    cube = np.memmap(cube_path, dtype=dtype, mode='r', shape=cube_shape)
+    strip = cube[valid_indices, start:end].astype(np.float32)
+    del cube
+
+    if bias_strip is not None:
+        strip -= bias_strip
+
+    if method == MASTER_METHOD_MEDIAN:
+        combined = np.median(strip, axis=0)
+    else:
+        combined = kappa_sigma_combine(strip, kappa, iterations)
+
+    if issubclass(dtype.type, np.integer):
+        type_info = np.iinfo(dtype)
+        combined = np.clip(np.rint(combined), type_info.min, type_info.max)
+
+    return combined.astype(dtype)
+
+
+def kappa_sigma_combine(strip: np.ndarray, kappa: float, iterations: int):
+    """
+    Averages values along first axis, after iteratively rejecting outliers.
+
+    Strip is modified : rejected values are set to NaN
+
+    :param strip: float values, first axis being frames
+    :type strip: numpy.ndarray
+
+    :param kappa: values further than kappa times standard deviation from mean are rejected
+    :type kappa: float
+
+    :param iterations: max number of rejection passes
+    :type iterations: int
+
+    :return: mean of kept values
+    :rtype: numpy.ndarray
+    """
+    with warnings.catch_warnings():
+        # pixels with all values rejected give NaN means, and we know it
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+
+        for _ in range(iterations):
+            mean = np.nanmean(strip, axis=0)
+            deviation = np.nanstd(strip, axis=0)
+
+            with np.errstate(invalid='ignore'):
+                rejected = np.abs(strip - mean) > kappa * deviation
+
+            if not rejected.any():
+                break
+
+            strip[rejected] = np.nan
+
+        combined = np.nanmean(strip, axis=0)
+
+    return np.nan_to_num(combined)
+
+
+def _save_master(data: np.ndarray, destination: str, method: str, bayer_pattern: str, exposure_times):
+    """
+    Saves master as FITS, with headers read by ALS
+    """
+    header = fits.Header()
+    header['NCOMBINE'] = (len(exposure_times), "number of combined frames")
+    header['COMBINE'] = (method, "combination method")
+
+    if bayer_pattern:
+        header['BAYERPAT'] = bayer_pattern
+
+    known_exposure_times = [exposure_time for exposure_time in exposure_times if exposure_time is not None and
+                            exposure_time >= 0]
+    if known_exposure_times:
+        header['EXPTIME'] = float(np.mean(known_exposure_times))
+
+    fits.PrimaryHDU(data=data, header=header).writeto(destination, overwrite=True)
+
+
+def get_default_master_path(master_type: str):
+    """
+    Gets default master file path for a master type
+
+    :param master_type: master type : MASTER_TYPE_DARK, MASTER_TYPE_BIAS or MASTER_TYPE_FLAT
+    :type master_type: str
+
+    :return: master file path, in work folder
+    :rtype: str
+    """
+    return str(Path(config.get_work_folder_path()) / f"master_{master_type}.fits")
+
+
+def use_master(master_type: str, path: str):
+    """
+    Sets a master as the one used by calibration processors, and enables them
+
+    :param master_type: master type : MASTER_TYPE_DARK, MASTER_TYPE_BIAS or MASTER_TYPE_FLAT
+    :type master_type: str
+
+    :param path: master file path
+    :type path: str
+    """
+    setters = {
+        MASTER_TYPE_DARK: (config.set_master_dark_file_path, config.set_use_master_dark),
+        MASTER_TYPE_BIAS: (config.set_master_bias_file_path, config.set_use_master_bias),
+        MASTER_TYPE_FLAT: (config.set_master_flat_file_path, config.set_use_master_flat),
+    }
+    set_path, set_use = setters[master_type]
+    set_path(path)
+    set_use(True)
+
+
+def main():
+    """
+    Builds a master from the command line
+    """
+    parser = ArgumentParser(description="Combines dark, bias or flat frames into a master")
+    parser.add_argument("inputs", nargs="+", help="frame files or folders")
+    parser.add_argument("-t", "--type", choices=[MASTER_TYPE_DARK, MASTER_TYPE_BIAS, MASTER_TYPE_FLAT],
+                        default=MASTER_TYPE_DARK, help="master type")
+    parser.add_argument("-m", "--method", choices=[MASTER_METHOD_MEDIAN, MASTER_METHOD_KAPPA_SIGMA],
+                        default=MASTER_METHOD_MEDIAN, help="combination method")
+    parser.add_argument("-k", "--kappa", type=float, default=DEFAULT_KAPPA, help="kappa-sigma rejection threshold")
+    parser.add_argument("-i", "--iterations", type=int, default=DEFAULT_ITERATIONS,
+                        help="kappa-sigma max rejection passes")
+    parser.add_argument("-b", "--bias", help="master bias to subtract from frames, typically when building flats")
+    parser.add_argument("-o", "--output", help="master file path. Defaults to master_<TYPE>.fits in work folder")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--memory", type=int, default=DEFAULT_MEMORY_BUDGET_MB,
+                        help="memory budget for combination, in MB")
+    parser.add_argument("--use", action="store_true", help="save master path in ALS config and enable it")
+    args = parser.parse_args()
+
+    # Qt translation needs an application instance, even a non GUI one
+    app = QCoreApplication(sys.argv[:1])
+    config.setup()
+    I18n().setup()
+
+    paths, missing_inputs = collect_input_paths(args.inputs)
+    for missing_input in missing_inputs:
+        print(f"Ignoring missing input : {missing_input}", file=sys.stderr)
+
+    destination = args.output or get_default_master_path(args.type)
+
+    try:
+        frame_count = build_master(paths,
+                                   args.method,
+                                   destination,
+                                   kappa=args.kappa,
+                                   iterations=max(1, args.iterations),
+                                   bias_path=args.bias,
+                                   worker_count=max(1, args.workers),
+                                   memory_budget_mb=max(1, args.memory))
+    except MasterBuildError as build_error:
+        print(build_error, file=sys.stderr)
+        sys.exit(1)
+
+    print(f"Master {args.type} built from {frame_count} of {len(paths)} frames into {destination}")
+
+    if args.use:
+        use_master(args.type, str(Path(destination).resolve()))
+        config.save()
+
+    del app
+
+
+if __name__ == '__main__':
+    main()
@@ -6,10 +6,18 @@ from logging import getLogger
 import numpy as np
 from PyQt5.QtCore import pyqtSignal, QObject, QThread
 
-from als.code_utilities import log, AlsLogAdapter
+from als.code_utilities import log, AlsLogAdapter, QUEUE_POLICY_BLOCK, QUEUE_POLICY_DROP_OLDEST, \
+    QUEUE_POLICY_KEEP_LATEST, QUEUE_POLICY_MERGE
 
 _LOGGER = AlsLogAdapter(getLogger(__name__), {})
 
+DEBAYER_SUPERPIXEL = "superpixel"
+DEBAYER_BILINEAR = "bilinear"
+DEBAYER_EDGE_AWARE = "edge-aware"
+DEBAYER_VNG = "vng"
+DEBAYER_AT_OUTPUT = "at-output"
+DEBAYER_ALGORITHMS = [DEBAYER_SUPERPIXEL, DEBAYER_BILINEAR, DEBAYER_EDGE_AWARE, DEBAYER_VNG, DEBAYER_AT_OUTPUT]
+
 
 class Session(QObject):
     """
@@ -337,15 +345,29 @@ class RunningProfile:
     @log
     def __init__(self):
         self._align_detection_surface_ratios: list = []
+        self._align_binning_factors: list = []
         self._pre_process_priority: int = -1
         self._stacking_priority: int = -1
         self._post_process_priority: int = -1
         self._file_read_size_polling_period: float = -1
+        self._zero_copy_ingest: bool = False
+        self._debayer_algorithm: str = DEBAYER_BILINEAR
+        self._queue_policies: dict = {}
 
     @property
     def ratios(self):
         return self._align_detection_surface_ratios
 
+    @property
+    def get_align_binning_factors(self):
+        """
+        Binning factors tried, in order, for coarse to fine alignment. Empty when coarse to fine alignment is not used.
+
+        :return: the binning factors
+        :rtype: list
+        """
+        return self._align_binning_factors
+
     @property
     def get_pre_process_priority(self):
         return self._pre_process_priority
@@ -362,6 +384,40 @@ class RunningProfile:
     def get_file_read_size_polling_period(self):
         return self._file_read_size_polling_period
 
+    @property
+    def get_zero_copy_ingest(self):
+        return self._zero_copy_ingest
+
+    @property
+    def get_debayer_algorithm(self):
+        """
+        Debayering algorithm used on incoming bayer images.
+
+        :return: one of DEBAYER_SUPERPIXEL, DEBAYER_BILINEAR, DEBAYER_EDGE_AWARE, DEBAYER_VNG or DEBAYER_AT_OUTPUT
+        :rtype: str
+        """
+        return self._debayer_algorithm
+
+    @log
+    def set_debayer_algorithm(self, algorithm: str):
+        """
+        Overrides default debayering algorithm of this profile, typically with user preference.
+
+        :param algorithm: the debayering algorithm. See get_debayer_algorithm for accepted values
+        :type algorithm: str
+        """
+        self._debayer_algorithm = algorithm
+
+    @property
+    def get_queue_policies(self):
+        """
+        Policies of the processing queues.
+
+        :return: (policy, capacity) tuples, keyed by queue name : 'pre-process', 'stack', 'post-process' and 'save'
+        :rtype: dict
+        """
+        return self._queue_policies
+
 
 class VisualProfile(RunningProfile):
 
@@ -369,10 +425,22 @@ class VisualProfile(RunningProfile):
     def __init__(self):
         super().__init__()
         self._align_detection_surface_ratios = [.1, .33, 1.]
+        # coarse star matching on binned images, refined on full resolution stars
+        self._align_binning_factors = [4, 2]
         self._pre_process_priority = QThread.HighestPriority
         self._stacking_priority = QThread.HighestPriority
         self._post_process_priority = QThread.LowPriority
         self._file_read_size_polling_period = .01
+        self._zero_copy_ingest = True
+        # half resolution, but cheapest and noise friendly
+        self._debayer_algorithm = DEBAYER_SUPERPIXEL
+        # we'd rather drop frames than lag behind the sky
+        self._queue_policies = {
+            'pre-process': (QUEUE_POLICY_DROP_OLDEST, 2),
+            'stack': (QUEUE_POLICY_KEEP_LATEST, 1),
+            'post-process': (QUEUE_POLICY_KEEP_LATEST, 1),
+            'save': (QUEUE_POLICY_MERGE, 0),
+        }
 
 
 class PhotoProfile(RunningProfile):
@@ -385,3 +453,12 @@ class PhotoProfile(RunningProfile):
         self._stacking_priority = QThread.LowPriority
         self._post_process_priority = QThread.HighestPriority
         self._file_read_size_polling_period = .5
+        self._zero_copy_ingest = True
+        self._debayer_algorithm = DEBAYER_BILINEAR
+        # we never drop a frame : pre-processing waits for the stacker to catch up
+        self._queue_policies = {
+            'pre-process': (QUEUE_POLICY_BLOCK, 0),
+            'stack': (QUEUE_POLICY_BLOCK, 2),
+            'post-process': (QUEUE_POLICY_KEEP_LATEST, 1),
+            'save': (QUEUE_POLICY_MERGE, 0),
+        }
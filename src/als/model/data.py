@@ -35,6 +35,9 @@ class I18n(QObject):
 
     STACKING_MODE_SUM = "TEMP"
     STACKING_MODE_MEAN = "TEMP"
+    STACKING_MODE_KAPPA_SIGMA = "TEMP"
+    STACKING_MODE_MEDIAN = "TEMP"
+    STACKING_MODE_SLIDING_MEAN = "TEMP"
     WORKER_STATUS_BUSY = "TEMP"
 
     SCANNER = "TEMP"
@@ -73,6 +76,9 @@ class I18n(QObject):
         """
         I18n.STACKING_MODE_SUM = self.tr("sum")
         I18n.STACKING_MODE_MEAN = self.tr("mean")
+        I18n.STACKING_MODE_KAPPA_SIGMA = self.tr("kappa-sigma")
+        I18n.STACKING_MODE_MEDIAN = self.tr("median")
+        I18n.STACKING_MODE_SLIDING_MEAN = self.tr("sliding mean")
         I18n.WORKER_STATUS_BUSY = self.tr("busy")
         I18n.SCANNER = self.tr("scanner")
         I18n.OF = self.tr("of")
@@ -124,6 +130,7 @@ class DynamicData:
         self.post_processor_result_qimage = None
         self.last_timing = 0
         self.total_exposure_time: int = 0
+        self.dropped_frame_count: int = 0
 
 
 class HistogramContainer:
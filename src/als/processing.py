@@ -1,34 +1,43 @@
 """
 Provides all means of image processing
 """
+import os
 import time
 from abc import abstractmethod
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from logging import getLogger
 from pathlib import Path
 from typing import List
 
 import cv2
 import numpy as np
-from PyQt5.QtCore import QThread, pyqtSignal, QT_TRANSLATE_NOOP, QFileInfo
+from PyQt5.QtCore import QThread, pyqtSignal, QT_TRANSLATE_NOOP
 from PyQt5.QtGui import QPixmap
 from qimage2ndarray import array2qimage
-from scipy.signal import convolve2d
 
 from als import config
-from als.code_utilities import log, Timer, SignalingQueue, human_readable_byte_size, available_memory, AlsLogAdapter
-from als.crunching import compute_histograms_for_display
-from als.streams import input as als_input
+from als.code_utilities import log, Timer, SignalingQueue, human_readable_byte_size, available_memory, AlsLogAdapter, \
+    QUEUE_POLICY_BLOCK
+from als.crunching import compute_histograms_for_display, superpixel_debayer, bilinear_debayer
 from als.streams.input import read_disk_image
 from als.messaging import MESSAGE_HUB
-from als.model.base import Image, RunningProfile
+from als.model.base import Image, RunningProfile, DEBAYER_SUPERPIXEL, DEBAYER_BILINEAR, DEBAYER_EDGE_AWARE, \
+    DEBAYER_VNG, DEBAYER_AT_OUTPUT
 from als.model.data import I18n, DYNAMIC_DATA
 from als.model.params import ProcessingParameter, RangeParameter, SwitchParameter
 from contrib.stretch import Stretch
 
+try:
+    from multiprocessing import resource_tracker, shared_memory
+    _SharedMemory = shared_memory.SharedMemory
+except ImportError:  # pragma: no cover - python < 3.8
+    resource_tracker = shared_memory = None
+    _SharedMemory = object
+
 _LOGGER = AlsLogAdapter(getLogger(__name__), {})
 
 _16_BITS_MAX_VALUE = 2**16 - 1
-_HOT_PIXEL_RATIO = 2
 
 
 class ProcessingError(Exception):
@@ -312,6 +321,7 @@ class Standardize(ImageProcessor):
 
       #. each array element is of type float32
 
+    This is where the float32 working buffer gets allocated. Data that is already float32 is not copied.
     """
     @log
     def process_image(self, image: Image):
@@ -322,7 +332,7 @@ class Standardize(ImageProcessor):
         if image.is_color():
             image.set_color_axis_as(0)
 
-        image.data = np.float32(image.data)
+        image.data = image.data.astype(np.float32, copy=False)
 
         return image
 
@@ -346,6 +356,11 @@ class FileReader(ImageProcessor):
 
     # //FIXME : BEWARE, in this specific processor, what we actually process is file paths, not image objects
     def process_image(self, image: Image):
+
+        # images received in memory by input scanner are already read
+        if isinstance(image, Image):
+            return image
+
         image_path = image
 
         # TODO: Move this logic to Controller somehow
@@ -361,137 +376,64 @@ class FileReader(ImageProcessor):
 
         _LOGGER.debug('RAM amount is OK. Reading new file...')
 
-        file_is_complete = False
-        last_file_size = -1
-
-        while not file_is_complete:
-            size = QFileInfo(image_path).size()
-            _LOGGER.debug(f"File {image_path}'s size = {size}")
-
-            if size == last_file_size:
-                file_is_complete = True
-                _LOGGER.debug(f"File {image_path} is ready to be read")
-
-            last_file_size = size
-
-            if not file_is_complete:
-                time.sleep(self._profile.get_file_read_size_polling_period)
-
-        image = read_disk_image(Path(image_path))
+        # input scanner only hands us complete files
+        image = read_disk_image(Path(image_path), zero_copy=self._profile.get_zero_copy_ingest)
         if image:
             image.ticket = image_path
         return image
 
 
-class HotPixelRemover(ImageProcessor):
-    """Provides hot pixels removal"""
-
-    @staticmethod
-    def _neighbors_average(data):
-        """
-        returns an array containing the means of all original array's pixels' neighbors
-        :param data: the image to compute means for
-        :return: an array containing the means of all original array's pixels' neighbors
-        :rtype: np.Array
-        """
-
-        kernel = np.ones((3, 3))
-        kernel[1, 1] = 0
-
-        neighbor_sum = convolve2d(data, kernel, mode='same', boundary='fill', fillvalue=0)
-        num_neighbor = convolve2d(np.ones(data.shape), kernel, mode='same', boundary='fill', fillvalue=0)
-
-        return (neighbor_sum / num_neighbor).astype(data.dtype)
-
-    @log
-    def process_image(self, image: Image):
-
-        # the idea is to check every pixel value against its 8 neighbors
-        # if its value is more than _HOT_RATIO times the mean of its neighbors' values
-        # me replace its value with that mean
-
-        # this can only work on B&W or non-debayered color images
-
-        if not image:
-            return None
-
-        hpr_on = config.get_hot_pixel_remover()
-
-        _LOGGER.debug(f"Hot pixel remover enabled : {hpr_on}")
-
-        if hpr_on:
+def is_cfa(image: Image):
+    """
+    Tells if image data is a raw bayer matrix, as seen by Debayer processor
 
-            if not image.is_color():
-                means = HotPixelRemover._neighbors_average(image.data)
-                image.data = np.where(image.data / means > _HOT_PIXEL_RATIO, means, image.data)
-            else:
-                MESSAGE_HUB.dispatch_warning(
-                    __name__,
-                    QT_TRANSLATE_NOOP("", "Hot Pixel Remover cannot work on debayered color images.")
-                )
+    :param image: the image
+    :type image: Image
 
-        return image
+    :return: True if image is to be debayered
+    :rtype: bool
+    """
+    return not image.is_color() and (image.needs_debayering() or config.get_bayer_pattern() != "AUTO")
 
 
 # pylint: disable=R0903
 class Debayer(ImageProcessor):
     """
     Provides image debayering.
-    """
-
-    @log
-    def process_image(self, image: Image):
-
-        if not image:
-            return None
-
-        preferred_bayer_pattern = config.get_bayer_pattern()
-
-        if preferred_bayer_pattern == "AUTO" and not image.needs_debayering():
-            return image
-
-        cv2_debayer_dict = {
-
-            "BG": cv2.COLOR_BAYER_BG2RGB,
-            "GB": cv2.COLOR_BAYER_GB2RGB,
-            "RG": cv2.COLOR_BAYER_RG2RGB,
-            "GR": cv2.COLOR_BAYER_GR2RGB
-        }
-
-        if preferred_bayer_pattern != 'AUTO':
-            bayer_pattern = preferred_bayer_pattern
-
-            if image.needs_debayering() and bayer_pattern != image.bayer_pattern:
-                pattern_mismatch_msg = QT_TRANSLATE_NOOP(
-                    "",
-                    "The bayer pattern defined in your preferences differs from the one present in current image. "
-                    "Preferred: {} vs image: {}. Debayering result may be wrong.")
-                pattern_mismatch_values = [preferred_bayer_pattern, image.bayer_pattern]
-                MESSAGE_HUB.dispatch_warning(__name__,
-                                             pattern_mismatch_msg,
-                                             pattern_mismatch_values)
-
-        else:
-            bayer_pattern = image.bayer_pattern
-
-        cv_debay = bayer_pattern[3] + bayer_pattern[2]
 
-        try:
-            debayered_data = cv2.cvtColor(image.data, cv2_debayer_dict[cv_debay])
-        except KeyError:
-            raise ProcessingError(f"unsupported bayer pattern : {bayer_pattern}")
-        except cv2.error as error:
-            raise ProcessingError(f"Debayering error : {str(error)}")
+    Debayering algorithm is chosen by running profile :
+
+      - DEBAYER_SUPERPIXEL : each 2x2 bayer cell is turned into a single color pixel, so resulting image is a quarter
+        of the original size
+      - DEBAYER_BILINEAR : OpenCV bilinear interpolation
+      - DEBAYER_EDGE_AWARE : OpenCV edge aware interpolation
+      - DEBAYER_VNG : OpenCV variable number of gradients interpolation. OpenCV only supports it for 8 bits images,
+        others are debayered using edge aware interpolation
+      - DEBAYER_AT_OUTPUT : images are left untouched, so they are stacked as bayer data. A second Debayer processor,
+        created with at_output=True, debayers stacking results at the start of post-processing, using bilinear
+        interpolation
+    """
 
-        image.data = debayered_data
+    _OPENCV_CONVERSION_SUFFIXES = {
+        DEBAYER_BILINEAR: "",
+        DEBAYER_EDGE_AWARE: "_EA",
+        DEBAYER_VNG: "_VNG",
+    }
 
-        return image
+    @log
+    def __init__(self, profile: RunningProfile, at_output: bool = False):
+        """
+        Constructs a Debayer processor
 
+        :param profile: the running profile
+        :type profile: RunningProfile
 
-class RemoveDark(ImageProcessor):
-    """
-    Provides image dark removal.
-    """
+        :param at_output: is this processor debayering stacking results ?
+        :type at_output: bool
+        """
+        super().__init__()
+        self._profile = profile
+        self._at_output = at_output
 
     @log
     def process_image(self, image: Image):
@@ -499,90 +441,101 @@ class RemoveDark(ImageProcessor):
         if not image:
             return None
 
-        do_subtract = config.get_use_master_dark()
+        if self._at_output != (self._profile.get_debayer_algorithm == DEBAYER_AT_OUTPUT):
+            return image
 
-        _LOGGER.debug(f"Dark subtraction enabled : {do_subtract}")
+        bayer_pattern = Debayer._get_bayer_pattern(image)
 
-        if do_subtract:
+        if not bayer_pattern:
+            return image
 
-            dark = als_input.read_disk_image(Path(config.get_master_dark_file_path()))
+        if len(bayer_pattern) != 4 or sorted(bayer_pattern) != ['B', 'G', 'G', 'R']:
+            raise ProcessingError(f"unsupported bayer pattern : {bayer_pattern}")
 
-            if dark is None:
-                read_error_message = QT_TRANSLATE_NOOP(
-                    "",
-                    "Could not read dark {}. Dark subtraction is SKIPPED"
-                )
-                read_error_values = [config.get_master_dark_file_path(), ]
-                MESSAGE_HUB.dispatch_warning(__name__, read_error_message, read_error_values)
-                return image
+        if self._at_output:
+            # stacker keeps a reference to its result : we must not modify it
+            image = image.clone(keep_ref_to_data=True)
+            image.data = bilinear_debayer(image.data, bayer_pattern)
+            image.set_color_axis_as(0)
+            return image
 
-            if not image.is_same_shape_as(dark):
-                mismatch_message = QT_TRANSLATE_NOOP(
-                    "",
-                    "Data structure inconsistency. Light: {} vs Dark: {}. Dark subtraction is SKIPPED"
-                )
-                mismatch_values = [image.data.shape, dark.data.shape]
-                MESSAGE_HUB.dispatch_warning(__name__, mismatch_message, mismatch_values)
-                return image
+        algorithm = self._profile.get_debayer_algorithm
 
-            if image.data.dtype.name != dark.data.dtype.name:
+        with Timer() as debayer_timer:
+            if algorithm == DEBAYER_SUPERPIXEL:
+                image.data = superpixel_debayer(image.data, bayer_pattern)
+            else:
+                image.data = Debayer._opencv_debayer(image.data, bayer_pattern, algorithm)
 
-                MESSAGE_HUB.dispatch_info(
-                    __name__,
-                    QT_TRANSLATE_NOOP(
-                        "",
-                        "Dark & Light data types mismatch. Light: {} vs Dark: {}. Dark needs to be conformed."
-                    ),
-                    [image.data.dtype.name, dark.data.dtype.name])
+        _LOGGER.debug(f"*SD-DEBAYER* {algorithm} debayering done in {debayer_timer.elapsed_in_milli_as_str} ms")
 
-                with Timer() as conforming_timer:
+        return image
 
-                    try:
-                        image_min_allowed, image_max_allowed = RemoveDark._get_allowed_min_and_max(image.data)
-                    except TypeError:
-                        raise ProcessingError(f"unhandled image data type : {image.data.dtype.type}")
+    @staticmethod
+    def _get_bayer_pattern(image: Image):
+        """
+        Gets bayer pattern to use for an image, taking user preference into account
 
-                    try:
-                        dark_min_allowed, dark_max_allowed = RemoveDark._get_allowed_min_and_max(dark.data)
-                    except TypeError:
-                        raise ProcessingError(f"unhandled masterdark data type : {dark.data.dtype.type}")
+        :param image: the image
+        :type image: Image
 
-                    dark.data = np.interp(
-                        dark.data,
-                        (dark_min_allowed, dark_max_allowed),
-                        (image_min_allowed, image_max_allowed)).astype(image.data.dtype)
+        :return: the bayer pattern or None if image is not to be debayered
+        :rtype: str or None
+        """
+        preferred_bayer_pattern = config.get_bayer_pattern()
 
-                _LOGGER.debug(f"Dark frame conforming done in {conforming_timer.elapsed_in_milli_as_str} ms")
+        if image.is_color() or (preferred_bayer_pattern == "AUTO" and not image.needs_debayering()):
+            return None
 
-            _LOGGER.debug("Subtracting dark frame...")
+        if preferred_bayer_pattern == 'AUTO':
+            return image.bayer_pattern
 
-            with Timer() as subtraction_timer:
-                image.data = np.where(image.data > dark.data, image.data - dark.data, 0)
-            _LOGGER.debug(f"Dark frame subtracted in {subtraction_timer.elapsed_in_milli_as_str} ms")
+        if image.needs_debayering() and preferred_bayer_pattern != image.bayer_pattern:
+            pattern_mismatch_msg = QT_TRANSLATE_NOOP(
+                "",
+                "The bayer pattern defined in your preferences differs from the one present in current image. "
+                "Preferred: {} vs image: {}. Debayering result may be wrong.")
+            pattern_mismatch_values = [preferred_bayer_pattern, image.bayer_pattern]
+            MESSAGE_HUB.dispatch_warning(__name__,
+                                         pattern_mismatch_msg,
+                                         pattern_mismatch_values)
 
-        return image
+        return preferred_bayer_pattern
 
     @staticmethod
-    def _get_allowed_min_and_max(data):
+    def _opencv_debayer(data: np.ndarray, bayer_pattern: str, algorithm: str):
         """
-        Get the allowed minimum and maximum values according to data type
+        Debayers data using OpenCV
 
-        :param data: image data
+        :param data: the bayer data
         :type data: numpy.ndarray
 
-        :return: a tuple of 2 values : minimum and maximum allowed values for data type
+        :param bayer_pattern: the bayer pattern
+        :type bayer_pattern: str
+
+        :param algorithm: the debayering algorithm
+        :type algorithm: str
+
+        :return: debayered data, with color axis last
+        :rtype: numpy.ndarray
+
+        :raises: ProcessingError if debayering fails
         """
+        if algorithm == DEBAYER_VNG and data.dtype != np.uint8:
+            algorithm = DEBAYER_EDGE_AWARE
 
-        if issubclass(data.dtype.type, np.integer):
-            allowed_min = np.iinfo(data.dtype).min
-            allowed_max = np.iinfo(data.dtype).max
-        elif issubclass(data.dtype.type, np.floating):
-            allowed_min = 0.0
-            allowed_max = 1.0
-        else:
-            raise TypeError("Data type must be float or integer")
+        try:
+            suffix = Debayer._OPENCV_CONVERSION_SUFFIXES[algorithm]
+        except KeyError:
+            raise ProcessingError(f"unsupported debayering algorithm : {algorithm}")
 
-        return allowed_min, allowed_max
+        # OpenCV names bayer patterns after the 2nd row of the matrix
+        conversion = getattr(cv2, f"COLOR_BAYER_{bayer_pattern[3]}{bayer_pattern[2]}2RGB{suffix}")
+
+        try:
+            return cv2.cvtColor(data, conversion)
+        except cv2.error as error:
+            raise ProcessingError(f"Debayering error : {str(error)}")
 
 
 class ConvertForOutput(ImageProcessor):
@@ -628,6 +581,9 @@ class QueueConsumer(QThread):
     Responsible of grabbing images from a queue
 
     actual processing payload is to be implemented in the following abstract method : _handle_image().
+
+    If the queue our results are pushed to is full and has QUEUE_POLICY_BLOCK policy, we wait until it has room
+    before grabbing our next item. Results are pushed by whoever listens to our signals, so this is a soft limit.
     """
 
     new_result_signal = pyqtSignal(Image)
@@ -645,6 +601,34 @@ class QueueConsumer(QThread):
         self._stop_asked = False
         self._name = name
         self._queue = queue
+        self._downstream_queue = None
+
+    @log
+    def set_downstream_queue(self, queue: SignalingQueue):
+        """
+        Sets the queue our results are pushed to
+
+        :param queue: the queue
+        :type queue: SignalingQueue
+        """
+        self._downstream_queue = queue
+
+    def _downstream_has_room(self, in_flight_count: int = 0):
+        """
+        Tells if we can grab a new item without overflowing our downstream queue
+
+        :param in_flight_count: number of items we are already processing
+        :type in_flight_count: int
+
+        :return: False if downstream queue has QUEUE_POLICY_BLOCK policy and would be full
+        :rtype: bool
+        """
+        queue = self._downstream_queue
+
+        if queue is None or queue.policy != QUEUE_POLICY_BLOCK or queue.capacity == 0:
+            return True
+
+        return queue.qsize() + in_flight_count < queue.capacity
 
     @abstractmethod
     @log
@@ -665,7 +649,7 @@ class QueueConsumer(QThread):
         """
         while not self._stop_asked:
 
-            if self._queue.qsize() > 0:
+            if self._queue.qsize() > 0 and self._downstream_has_room():
 
                 self.busy_signal.emit()
                 item = self._queue.get()
@@ -684,6 +668,69 @@ class QueueConsumer(QThread):
 
             self.msleep(20)
 
+    def _run_ordered(self, worker_count: int, submit, complete, can_retrieve=None):
+        """
+        Polls the queue and submits items for processing, up to worker_count items at the same time.
+
+        Items are completed in the exact order they were retrieved from the queue, as soon as all items retrieved
+        before them are completed. Returns once stop is asked : items still being processed are cancelled
+
+        :param worker_count: max number of items being processed at the same time
+        :type worker_count: int
+
+        :param submit: function called with each retrieved item, returning its future result, or None if item is to
+                       be entirely handled on completion
+        :type submit: callable
+
+        :param complete: function called, in queue order, with each item, its future result or None, and a boolean
+                         telling if it was the last item being processed
+        :type complete: callable
+
+        :param can_retrieve: optional function called with the number of items being processed, telling if next item
+                             can be retrieved now
+        :type can_retrieve: callable
+        """
+        # (item, timer start, future) tuples, in queue order
+        pending = deque()
+
+        while not self._stop_asked:
+
+            while self._queue.qsize() > 0 and len(pending) < worker_count and self._downstream_has_room(len(pending)):
+
+                if not pending:
+                    self.busy_signal.emit()
+
+                if can_retrieve is not None and not can_retrieve(len(pending)):
+                    break
+
+                item = self._queue.get()
+                MESSAGE_HUB.dispatch_info(__name__,
+                                          QT_TRANSLATE_NOOP("", "Start {} on {}"),
+                                          [self._name, item.origin if type(item) == Image else item])
+
+                pending.append((item, time.time(), submit(item)))
+
+            while pending and (pending[0][2] is None or pending[0][2].done()):
+
+                item, start, future = pending.popleft()
+                complete(item, future, not pending)
+
+                MESSAGE_HUB.dispatch_info(
+                    __name__,
+                    QT_TRANSLATE_NOOP("", "End {} on {} in {} ms"),
+                    [self._name,
+                     item.origin if type(item) == Image else item,
+                     "%0.3f" % ((time.time() - start) * 1000)])
+
+                if not pending:
+                    self.waiting_signal.emit()
+
+            self.msleep(20)
+
+        for _, _, future in pending:
+            if future is not None:
+                future.cancel()
+
     @log
     def stop(self):
         """
@@ -727,3 +774,223 @@ class Pipeline(QueueConsumer):
         :type process: ImageProcessor
         """
         self._processes.append(process)
+
+
+class ParallelPipeline(Pipeline):
+    """
+    Pipeline specialization running its image processors in a pool of worker processes.
+
+    Several items are processed at the same time, one per worker, but results are emitted in the exact order
+    items were retrieved from the queue.
+
+    Processed image data is handed back to this pipeline through shared memory, if available. Workers copy it into a
+    shared memory block, which is then used in place by this pipeline, until image data is released.
+    """
+
+    @log
+    def __init__(self, name: str, queue: SignalingQueue, final_processes: list, worker_count: int):
+        Pipeline.__init__(self, name, queue, final_processes)
+        self._worker_count = worker_count
+
+    @log
+    def run(self):
+        """
+        Starts polling the queue and submits each item to worker processes.
+
+        Results are emitted as soon as all items retrieved before them have been emitted.
+
+        If any processing error occurs, the current image is dropped
+        """
+        with create_process_pool(self._processes + self._final_processes, self._worker_count) as executor:
+            self._run_ordered(self._worker_count,
+                              lambda item: submit_to_process_pool(executor, item),
+                              self._emit_pool_result)
+
+    # pylint: disable=W0613
+    def _emit_pool_result(self, item, future, last: bool):
+        """
+        Emits the image processed by a pool worker, unless it was dropped
+
+        :param item: the processed item
+        :param future: the future returned by submit_to_process_pool()
+        :type future: concurrent.futures.Future
+
+        :param last: is this the last item being processed ?
+        :type last: bool
+        """
+        image = get_process_pool_result(future)
+        if image is not None:
+            self.new_result_signal.emit(image)
+
+
+def create_process_pool(processes: List[ImageProcessor], worker_count: int):
+    """
+    Creates a pool of worker processes, each applying the same image processors to the items it is given
+
+    :param processes: the image processors to apply, in order
+    :type processes: List[ImageProcessor]
+
+    :param worker_count: number of worker processes
+    :type worker_count: int
+
+    :return: the pool
+    :rtype: concurrent.futures.ProcessPoolExecutor
+    """
+    if resource_tracker is not None:
+        # workers must share our tracker, so shared memory blocks we release are not reported as leaked
+        resource_tracker.ensure_running()
+
+    return ProcessPoolExecutor(max_workers=worker_count, initializer=_init_pool_worker, initargs=(processes, ))
+
+
+def submit_to_process_pool(executor: ProcessPoolExecutor, item):
+    """
+    Submits an item to a pool created by create_process_pool(). Workers use current config
+
+    :param executor: the pool
+    :type executor: concurrent.futures.ProcessPoolExecutor
+
+    :param item: the item to process. Usually an image path
+
+    :return: the future result, to be read with get_process_pool_result()
+    :rtype: concurrent.futures.Future
+    """
+    return executor.submit(_process_in_pool_worker, item, config.get_snapshot())
+
+
+def get_process_pool_result(future):
+    """
+    Retrieves the image processed by a pool worker. Waits for it if needed.
+
+    Processing errors are reported as warnings
+
+    :param future: the future returned by submit_to_process_pool()
+    :type future: concurrent.futures.Future
+
+    :return: the processed image, or None if item was dropped by processors or a processing error occurred
+    :rtype: Image or None
+    """
+    image, shared_data, error = future.result()
+
+    if error is not None:
+        message = QT_TRANSLATE_NOOP("", "Error applying process '{}' to image {} : {} *** Image will be ignored")
+        MESSAGE_HUB.dispatch_warning(__name__, message, list(error))
+        return None
+
+    if image is not None and shared_data is not None:
+        image.data = _read_shared_data(*shared_data)
+
+    return image
+
+
+# image processors used by current pool worker process
+_POOL_WORKER_PROCESSES: List[ImageProcessor] = []
+
+
+def _init_pool_worker(processes: List[ImageProcessor]):
+    """
+    Initializes a pool worker process
+
+    :param processes: the image processors to apply to all items handled by this worker
+    :type processes: List[ImageProcessor]
+    """
+    _POOL_WORKER_PROCESSES.extend(processes)
+
+
+def _process_in_pool_worker(item, config_snapshot: dict):
+    """
+    Applies pool worker processors to an item
+
+    :param item: the item to process. Usually an image path
+    :param config_snapshot: current config of main process
+    :type config_snapshot: dict
+
+    :return: a tuple of : processed image or None, shared memory data descriptor or None, error details or None
+    :rtype: tuple
+    """
+    config.load_snapshot(config_snapshot)
+
+    image = item
+    processor = None
+
+    try:
+        for processor in _POOL_WORKER_PROCESSES:
+            image = processor.process_image(image)
+
+    except ProcessingError as processing_error:
+        return None, None, (processor.__class__.__name__, str(image), str(processing_error))
+
+    if image is None or shared_memory is None:
+        return image, None, None
+
+    shared_data = _write_shared_data(image.data)
+    image.data = None
+
+    return image, shared_data, None
+
+
+def _write_shared_data(data: np.ndarray):
+    """
+    Copies array into a new shared memory block.
+
+    Block is to be released by the process reading it back with _read_shared_data()
+
+    :param data: the array to share
+    :type data: np.ndarray
+
+    :return: shared memory block name, array shape and array dtype
+    :rtype: tuple
+    """
+    block = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    np.ndarray(data.shape, dtype=data.dtype, buffer=block.buf)[...] = data
+    block.close()
+
+    return block.name, data.shape, data.dtype.str
+
+
+def _read_shared_data(name: str, shape: tuple, dtype: str):
+    """
+    Wraps a shared memory block into an array, without copying it.
+
+    Block name is released at once, so no other process can attach to it. Block memory itself is released with the
+    returned array
+
+    :param name: shared memory block name
+    :type name: str
+
+    :param shape: array shape
+    :type shape: tuple
+
+    :param dtype: array dtype
+    :type dtype: str
+
+    :return: the array
+    :rtype: np.ndarray
+    """
+    block = _SharedDataBlock(name=name)
+    data = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    block.unlink()
+
+    return data
+
+
+class _SharedDataBlock(_SharedMemory):
+    """
+    Shared memory block which memory lives as long as arrays wrapping it.
+
+    Block file descriptor is closed as soon as block is mapped : the memory map holds its own descriptor, closed with
+    the map by the last array wrapping it. Closing the map when the block object goes away would fail, as long as such
+    arrays exist
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name=name)
+
+        # Windows blocks have no file descriptor
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __del__(self):
+        # memory map is closed by the last array wrapping it
+        pass
@@ -16,23 +16,31 @@ Provides image stacking features
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
-from multiprocessing import Process, Manager
 
-import astroalign as al
 import numpy as np
 from PyQt5.QtCore import pyqtSignal, QT_TRANSLATE_NOOP
 from skimage.transform import SimilarityTransform
 
 from als import config
+from als.accumulation import StackAccumulator, KappaSigmaAccumulator, MedianAccumulator, FrameWindow
+from als.align import ReferenceFeatures, ReferenceStars, TranslationReference, AlignmentError, find_transform, \
+    find_translation, bin_image, unbin_transform, refine_transform, apply_transform, get_integer_shift
 from als.code_utilities import log, Timer, AlsLogAdapter
 from als.messaging import MESSAGE_HUB
 from als.model.base import Image, RunningProfile
 from als.model.data import I18n
-from als.processing import QueueConsumer
+from als.crunching import superpixel_luminance
+from als.processing import QueueConsumer, is_cfa
 
 _LOGGER = AlsLogAdapter(getLogger(__name__), {})
 
+# binned alignment data smaller than this, in pixels, holds too few stars to be worth searching
+_MINIMUM_BINNED_SIZE = 200
+
 
 class StackingError(Exception):
     """
@@ -44,20 +52,45 @@ class StackingError(Exception):
 class Stacker(QueueConsumer):
     """
     Responsible for image stacking : alignment and registration
+
+    Bayer images, left for debayering at output by running profile, are stacked as bayer data (split CFA) :
+
+      - alignment transformation is searched on a luminance proxy : the mean of each 2x2 bayer cell
+      - each of the 4 bayer color planes is aligned on its own, so interpolation never mixes colors
+      - aligned planes are interleaved back and stacked, so each bayer color gets its own sum
+
+    Stacking result stays bayer data, to be debayered once by post-processing.
+
+    Alignment only depends on the align reference, not on the stack content. With several alignment workers, queued
+    images are aligned in parallel by a pool of threads, while stacking stays a serial step, applying aligned images
+    in the exact order they were retrieved from the queue.
     """
 
     stack_size_changed_signal = pyqtSignal(int)
     """Qt signal emitted when stack size changed"""
 
     @log
-    def __init__(self, stack_queue, profile: RunningProfile):
+    def __init__(self, stack_queue, profile: RunningProfile, worker_count: int = 1):
         QueueConsumer.__init__(self, "stack", stack_queue)
         self._size: int = 0
         self._last_stacking_result: Image = None
+        self._accumulator = StackAccumulator()
+        # stacking and removal of stacked images may come from different threads
+        self._accumulator_lock = threading.Lock()
+        # latest stacked image, waiting to carry the next published stacking result
+        self._unpublished_image: Image = None
         self._align_reference: Image = None
+        self._align_reference_data: np.ndarray = None
+        self._reference_features: dict = dict()
+        self._reference_features_lock = threading.Lock()
+        # free buffers aligned data is written to, reused from one image to the next
+        self._aligned_data_buffers = deque()
+        # free flat buffers bayer color planes are warped into, before being interleaved into aligned data
+        self._cfa_plane_buffers = deque()
         self._stacking_mode = I18n.STACKING_MODE_MEAN
         self._align_before_stack = True
         self._profile = profile
+        self._worker_count = worker_count
 
     @property
     @log
@@ -110,19 +143,42 @@ class Stacker(QueueConsumer):
         """
         self._size = 0
         self._last_stacking_result = None
+
+        with self._accumulator_lock:
+            self._accumulator.reset()
+            self._unpublished_image = None
+
         self._align_reference = None
+        self._align_reference_data = None
+        self._reference_features.clear()
+        self._aligned_data_buffers.clear()
+        self._cfa_plane_buffers.clear()
         self.stack_size_changed_signal.emit(self.size)
 
     @log
-    def _publish_stacking_result(self, image: Image):
+    def _publish_stacking_result(self):
         """
-        Record a new stacking result
-
-        :param image: new stacking result
-        :type image: Image
+        Computes and records a new stacking result, if images were stacked since last one. Result is carried by the
+        latest stacked image
         """
+        with self._accumulator_lock:
+            image = self._unpublished_image
+
+            if image is None:
+                return
+
+            self._unpublished_image = None
+
+            with Timer() as publish_timer:
+                if self._stacking_mode == I18n.STACKING_MODE_SUM:
+                    image.data = self._accumulator.get_sum()
+                else:
+                    image.data = self._accumulator.get_result()
+
+        _LOGGER.debug(f"Computed {self._stacking_mode} of {self._accumulator.size} images in "
+                      f"{publish_timer.elapsed_in_milli_as_str} ms")
+
         self._last_stacking_result = image
-        self.size += 1
         self.new_result_signal.emit(image)
 
     @property
@@ -149,41 +205,250 @@ class Stacker(QueueConsumer):
         self.stack_size_changed_signal.emit(self.size)
 
     @log
-    def _handle_item(self, image: Image):
+    def run(self):
+        """
+        Starts polling the queue and stacks each image.
 
-        if self.size == 0:
-            _LOGGER.debug("This is the first image for this stack. Publishing right away")
-            self._publish_stacking_result(image)
-            self._align_reference = image
+        With several alignment workers, images are submitted to a thread pool for alignment, as long as an align
+        reference exists. Aligned images are stacked as soon as all images retrieved before them have been stacked.
+        """
+        if self._worker_count < 2:
+            QueueConsumer.run(self)
+            return
+
+        with ThreadPoolExecutor(max_workers=self._worker_count, thread_name_prefix="align") as executor:
+
+            def submit(image: Image):
+                # without align reference, image is handled on completion, once all images before it are stacked
+                return executor.submit(self._prepare_image, image) if self._align_reference is not None else None
+
+            # next image may become align reference : all images retrieved before it are stacked first
+            self._run_ordered(self._worker_count,
+                              submit,
+                              self._complete_prepared_image,
+                              lambda pending_count: self._align_reference is not None or pending_count == 0)
+
+    def _complete_prepared_image(self, image: Image, future, last: bool):
+        """
+        Stacks an image prepared by an alignment worker, or handles it entirely if it was not submitted
+
+        :param image: the image
+        :type image: Image
+
+        :param future: the future aligned data or None
+        :type future: concurrent.futures.Future
 
+        :param last: is this the last image being prepared ?
+        :type last: bool
+        """
+        if future is None:
+            self._handle_item(image, publish=False)
         else:
             try:
-                if not image.is_same_shape_as(self._last_stacking_result):
-                    raise StackingError(
-                        "Image dimensions or color don't match stack content. "
-                        f"New image shape : {image.data.shape} <=> "
-                        f"Reference shape : {self._last_stacking_result.data.shape}"
-                    )
+                self._accumulate(image, future.result())
+            except StackingError as stacking_error:
+                Stacker._report_discarded_image(image, stacking_error)
 
-                try:
-                    if self._align_before_stack:
+        if last and self._queue.qsize() == 0:
+            self._publish_stacking_result()
 
-                        # alignment is a memory greedy process, we take special care of such errors
-                        try:
-                            self._align_image(image)
-                        except OSError as os_error:
-                            raise StackingError(os_error)
+    @log
+    def _handle_item(self, image: Image, publish: bool = None):
+        """
+        Stacks an image
 
-                    self._stack_image(image)
+        :param image: the image to stack
+        :type image: Image
 
-                except AttributeError:
-                    raise StackingError("Our reference images are gone.")
+        :param publish: do we publish the new stacking result ? Default : only if no image waits in our queue, so
+                        images stacked back to back don't each compute a result nobody reads
+        :type publish: bool
+        """
+        try:
+            if self.size == 0:
+                self._use_as_reference(image)
+            else:
+                self._accumulate(image, self._prepare_image(image))
+        except StackingError as stacking_error:
+            Stacker._report_discarded_image(image, stacking_error)
 
-                self._publish_stacking_result(image)
+        if publish or (publish is None and self._queue.qsize() == 0):
+            self._publish_stacking_result()
 
-            except StackingError as stacking_error:
-                message = QT_TRANSLATE_NOOP("", "Could not stack image {} : {}. Image is DISCARDED")
-                MESSAGE_HUB.dispatch_warning(__name__, message, [image.origin, stacking_error])
+    @log
+    def _use_as_reference(self, image: Image):
+        """
+        Starts a new stack with image, which becomes the align reference
+
+        :param image: the first image of the stack
+        :type image: Image
+        """
+        _LOGGER.debug("This is the first image for this stack")
+        self._align_reference = image
+        self._align_reference_data = Stacker._get_alignment_data(image)
+        self._reference_features.clear()
+
+        with self._accumulator_lock:
+            self._accumulator.reset()
+            self._accumulator = self._create_accumulator()
+
+        self._stack_image(image, None)
+
+    def _create_accumulator(self):
+        """
+        Creates an empty accumulator suited to current stacking mode
+
+        :return: the accumulator
+        :rtype: StackAccumulator
+        """
+        if self._stacking_mode == I18n.STACKING_MODE_KAPPA_SIGMA:
+            kappa = config.get_stacking_kappa()
+            _LOGGER.debug(f"Kappa-sigma stacking with kappa = {kappa}")
+            return KappaSigmaAccumulator(kappa)
+
+        if self._stacking_mode == I18n.STACKING_MODE_MEDIAN:
+            window_size = config.get_stacking_window_size()
+            _LOGGER.debug(f"Median stacking of the latest {window_size} images")
+            return MedianAccumulator(self._create_frame_window(window_size))
+
+        if self._stacking_mode == I18n.STACKING_MODE_SLIDING_MEAN:
+            window_size = config.get_stacking_window_size()
+            _LOGGER.debug(f"Mean stacking of the latest {window_size} images")
+            return StackAccumulator(self._create_frame_window(window_size), sliding=True)
+
+        undo_depth = config.get_stacking_undo_depth()
+        return StackAccumulator(self._create_frame_window(undo_depth) if undo_depth > 0 else None)
+
+    @staticmethod
+    def _create_frame_window(size: int):
+        """
+        Creates a window keeping the latest stacked images, kept on disk if it does not fit in memory budget
+
+        :param size: how many images the window holds
+        :type size: int
+
+        :return: the window
+        :rtype: FrameWindow
+        """
+        return FrameWindow(size, config.get_stacking_memory_budget(), config.get_work_folder_path())
+
+    @log
+    def remove_last_frames(self, count: int):
+        """
+        Removes the latest stacked images from stack, and publishes the resulting stacking result.
+
+        Only images still held by the accumulator frame window can be removed. Each removal is a subtraction from the
+        running sum : nothing is stacked again
+
+        :param count: how many images to remove
+        :type count: int
+
+        :return: how many images were removed
+        :rtype: int
+        """
+        with self._accumulator_lock:
+            removed_count = self._accumulator.remove_latest(count)
+
+            if removed_count == 0:
+                return 0
+
+            self.size = self._accumulator.size
+
+            if self.size == 0:
+                # next image starts a new stack
+                self._unpublished_image = None
+            elif self._unpublished_image is None and self._last_stacking_result is not None:
+                # last result may still be post-processed : new result gets its own image
+                self._unpublished_image = self._last_stacking_result.clone(keep_ref_to_data=True)
+                self._unpublished_image.exposure_time = Image.UNDEF_EXP_TIME
+
+        _LOGGER.debug(f"Removed {removed_count} latest images from stack")
+        self._publish_stacking_result()
+
+        return removed_count
+
+    @log
+    def _prepare_image(self, image: Image):
+        """
+        Checks image against align reference and aligns it, if needed.
+
+        This only reads align reference and its cached features, so it is safe to run in several alignment workers
+        at once. The image data is modified in place by this function
+
+        :param image: the image to prepare for stacking
+        :type image: Image
+
+        :return: None if image is not aligned. Otherwise, a tuple of 2 elements : the buffer holding aligned image
+                 data, to be released once image is stacked, and the coverage of aligned image
+        :rtype: tuple or None
+
+        :raises: StackingError if image cannot be stacked
+        """
+        try:
+            if not image.is_same_shape_as(self._align_reference):
+                raise StackingError(
+                    "Image dimensions or color don't match stack content. "
+                    f"New image shape : {image.data.shape} <=> "
+                    f"Reference shape : {self._align_reference.data.shape}"
+                )
+
+            if not self._align_before_stack:
+                return None
+
+            # alignment is a memory greedy process, we take special care of such errors
+            try:
+                coverage = self._align_image(image)
+            except OSError as os_error:
+                raise StackingError(os_error)
+
+            return image.data, coverage
+
+        except AttributeError:
+            raise StackingError("Our reference images are gone.")
+
+    @log
+    def _accumulate(self, image: Image, alignment: tuple):
+        """
+        Stacks a prepared image.
+
+        If stack was reset since image was prepared, image starts a new stack
+
+        :param image: the prepared image
+        :type image: Image
+
+        :param alignment: aligned data buffer and coverage, as returned by _prepare_image()
+        :type alignment: tuple or None
+
+        :raises: StackingError if image cannot be stacked
+        """
+        if self.size == 0:
+            # image data buffer now belongs to align reference, it is not released
+            self._use_as_reference(image)
+            return
+
+        aligned_data_buffer, coverage = alignment if alignment is not None else (None, None)
+
+        try:
+            self._stack_image(image, coverage)
+        except AttributeError:
+            raise StackingError("Our reference images are gone.")
+        finally:
+            if aligned_data_buffer is not None:
+                self._aligned_data_buffers.append(aligned_data_buffer)
+
+    @staticmethod
+    def _report_discarded_image(image: Image, stacking_error: StackingError):
+        """
+        Warns user that an image could not be stacked
+
+        :param image: the discarded image
+        :type image: Image
+
+        :param stacking_error: the reason
+        :type stacking_error: StackingError
+        """
+        message = QT_TRANSLATE_NOOP("", "Could not stack image {} : {}. Image is DISCARDED")
+        MESSAGE_HUB.dispatch_warning(__name__, message, [image.origin, stacking_error])
 
     @log
     def _align_image(self, image):
@@ -194,25 +459,34 @@ class Stacker(QueueConsumer):
 
         :param image: the image to be aligned
         :type image: Image
+
+        :return: coverage of aligned image : 1 where its pixels come from its own field, 0 elsewhere
+        :rtype: numpy.ndarray
         """
 
         with Timer() as find_timer:
-            transformation = self._find_transformation(image)
+            transformation = self._find_translation(image) if config.get_translation_only_alignment() else None
+
+            if transformation is None:
+                transformation = self._find_transformation(image)
         _LOGGER.debug(f"Found transformation for alignment of {image.origin} in "
                       f"{find_timer.elapsed_in_milli_as_str} ms")
 
         with Timer() as apply_timer:
-            self._apply_transformation(image, transformation)
+            coverage = self._apply_transformation(image, transformation)
         _LOGGER.debug(f"Applied transformation for alignment of {image.origin} in "
                       f"{apply_timer.elapsed_in_milli_as_str} ms")
 
+        return coverage
+
     @log
     def _apply_transformation(self, image: Image, transformation: SimilarityTransform):
         """
         Apply a transformation to an image.
 
-        If image is color, channels are processed using multiprocessing, allowing global operation to take less time on
-        a multi core CPU
+        All color channels are warped in a single pass, into a buffer reused from one image to the next. If image is
+        bayer data, each bayer color plane is warped on its own, unless transformation is a whole bayer cells
+        translation. Planes are warped into a contiguous buffer, also reused, then interleaved into aligned data.
 
         Image is modified in place by this function
 
@@ -221,117 +495,158 @@ class Stacker(QueueConsumer):
 
         :param transformation: the transformation to apply
         :type transformation: skimage.transform._geometric.SimilarityTransform
-        """
-        if image.is_color():
-            _LOGGER.debug(f"Aligning color image...")
 
-            # do_mp = platform.system() not in ["Darwin", "Windows"]
-            # TODO check if MP 'spawn' start method is stable, faster 
-            # and suppports frozen apps when we switch to python >= 3.8
-            do_mp = False
+        :return: coverage of aligned image : 1 where its pixels come from its own field, 0 elsewhere
+        :rtype: numpy.ndarray
+        """
+        try:
+            aligned_data = self._aligned_data_buffers.pop()
+        except IndexError:
+            aligned_data = None
 
-            if do_mp:
+        if aligned_data is None or aligned_data.shape != image.data.shape:
+            aligned_data = np.empty(image.data.shape, dtype=np.float32)
 
-                _LOGGER.debug("Using multiprocessing to align color image...")
-                manager = Manager()
-                results_dict = manager.dict()
-                channel_processors = []
+        coverage = np.empty(image.data.shape[-2:], dtype=np.uint8)
 
-                for channel in range(3):
-                    processor = Process(target=Stacker._apply_single_channel_transformation,
-                                        args=(image,
-                                              self._last_stacking_result,
-                                              transformation,
-                                              results_dict,
-                                              channel))
-                    processor.start()
-                    channel_processors.append(processor)
+        if is_cfa(image) and get_integer_shift(transformation) is None:
+            _LOGGER.debug("Aligning bayer image...")
 
-                for processor in channel_processors:
-                    processor.join()
+            try:
+                plane_buffer, plane_coverage_buffer = self._cfa_plane_buffers.pop()
+            except IndexError:
+                plane_buffer = plane_coverage_buffer = None
 
-                _LOGGER.debug("Color channel processes are done. Fetching results and storing results...")
+            # first plane is the largest one when image has an odd dimension
+            largest_plane_size = coverage[::2, ::2].size
 
-                for channel, data in results_dict.items():
-                    image.data[channel] = data
+            if plane_buffer is None or plane_buffer.size != largest_plane_size:
+                plane_buffer = np.empty(largest_plane_size, dtype=np.float32)
+                plane_coverage_buffer = np.empty(largest_plane_size, dtype=np.uint8)
 
-                _LOGGER.debug("Using multiprocessing to align color image: DONE")
+            for row in range(2):
+                for column in range(2):
+                    plane_transformation = Stacker._get_cfa_plane_transformation(transformation, row, column)
+                    plane_shape = coverage[row::2, column::2].shape
+                    plane_size = plane_shape[0] * plane_shape[1]
+                    plane_data = plane_buffer[:plane_size].reshape(plane_shape)
+                    plane_coverage = plane_coverage_buffer[:plane_size].reshape(plane_shape)
 
-            else:
+                    apply_transform(plane_transformation, image.data[row::2, column::2], plane_data, plane_coverage)
 
-                _LOGGER.debug("Aligning color image in single process...")
+                    aligned_data[row::2, column::2] = plane_data
+                    coverage[row::2, column::2] = plane_coverage
 
-                results_dict = dict()
+            self._cfa_plane_buffers.append((plane_buffer, plane_coverage_buffer))
 
-                for channel in range(3):
-                    Stacker._apply_single_channel_transformation(image,
-                                                                 self._last_stacking_result,
-                                                                 transformation,
-                                                                 results_dict,
-                                                                 channel)
+            _LOGGER.debug("Aligning bayer image DONE")
 
-                for channel, data in results_dict.items():
-                    image.data[channel] = data
+        elif is_cfa(image):
+            _LOGGER.debug("Aligning bayer image by whole bayer cells...")
 
-                _LOGGER.debug("Aligning color image in single process: SONE")
+            # luminance proxy pixels are bayer cells
+            apply_transform(SimilarityTransform(matrix=np.diag([2, 2, 1]) @ transformation.params @
+                                                np.diag([.5, .5, 1])),
+                            image.data,
+                            aligned_data,
+                            coverage)
 
-            _LOGGER.debug(f"Aligning color image DONE")
+            _LOGGER.debug("Aligning bayer image by whole bayer cells DONE")
 
         else:
-            _LOGGER.debug(f"Aligning b&w image...")
+            _LOGGER.debug(f"Aligning image...")
 
-            result_dict = dict()
+            apply_transform(transformation, image.data, aligned_data, coverage)
 
-            Stacker._apply_single_channel_transformation(
-                image,
-                self._last_stacking_result,
-                transformation,
-                result_dict
-            )
+            _LOGGER.debug(f"Aligning image DONE")
 
-            image.data = result_dict[0]
+        image.data = aligned_data
 
-            _LOGGER.debug(f"Aligning b&w image : DONE")
+        return coverage
 
     @staticmethod
-    def _apply_single_channel_transformation(image, reference, transformation, results_dict, channel=None):
+    def _get_cfa_plane_transformation(transformation: SimilarityTransform, row: int, column: int):
         """
-        apply a transformation on a specific channel (RGB) of a color image, or whole data of a b&w image.
+        Adapts a transformation found on bayer luminance proxy to a single bayer color plane.
 
-        :param image: the image to apply transformation to
+        Luminance pixel (x, y) is centered on bayer cell (x, y). The plane pixel of the same cell is offset from that
+        center by a quarter of a luminance pixel, towards its row and column in the cell.
+
+        :param transformation: transformation found on luminance proxy
+        :type transformation: SimilarityTransform
+
+        :param row: the plane row in bayer cell : 0 or 1
+        :type row: int
+
+        :param column: the plane column in bayer cell : 0 or 1
+        :type column: int
+
+        :return: the transformation to apply to the plane
+        :rtype: SimilarityTransform
+        """
+        offset = np.array([(column - .5) / 2, (row - .5) / 2])
+
+        to_luminance = SimilarityTransform(translation=offset)
+        from_luminance = SimilarityTransform(translation=-offset)
+
+        return SimilarityTransform(matrix=from_luminance.params @ transformation.params @ to_luminance.params)
+
+    @staticmethod
+    def _get_alignment_data(image: Image):
+        """
+        Gets image data used to search alignment transformations
+
+        :param image: the image
         :type image: Image
 
-        :param reference: the align reference image
-        :type reference: Image
+        :return: green channel for color images, luminance proxy for bayer images, whole data otherwise
+        :rtype: numpy.ndarray
+        """
+        if image.is_color():
+            return image.data[1]
 
-        :param transformation: the transformation to apply
-        :type transformation: skimage.transform._geometric.SimilarityTransform
+        if is_cfa(image):
+            return superpixel_luminance(image.data)
 
-        :param results_dict: the dict into which transformation result is to be stored. dict key is the channel number
-               for a color image, or 0 for a b&w image
-        :type results_dict: dict
+        return image.data
 
-        :param channel: the 0 indexed number of the color channel to process (0=red, 1=green, 2=blue)
-        :type channel: int
+    @log
+    def _find_translation(self, image: Image):
         """
+        Try and find a pure translation aligning image with stored align reference, using phase correlation.
 
-        if channel is not None:
-            target_index = channel
-            source_data = image.data[channel]
-            reference_data = reference.data[channel]
-        else:
-            target_index = 0
-            source_data = image.data
-            reference_data = reference.data
+        This is the fast path for fields that do not rotate.
 
-        results_dict[target_index] = np.float32(al.apply_transform(transformation, source_data, reference_data))
+        :param image: the image to be aligned
+        :type image: Image
+
+        :return: the found translation, or None if image cannot be aligned by a pure translation
+        :rtype: SimilarityTransform or None
+        """
+        minimum_matches_for_valid_transform = config.get_minimum_match_count()
+
+        try:
+            transformation, matches = find_translation(Stacker._get_alignment_data(image),
+                                                       self._get_translation_reference(),
+                                                       self._get_reference_stars(),
+                                                       minimum_matches_for_valid_transform)
+
+        except AlignmentError as alignment_error:
+            _LOGGER.debug(f"Could not find valid translation : {alignment_error}")
+            return None
+
+        Stacker._log_accepted_transformation("phase correlation", transformation, len(matches[0]))
+        return transformation
 
     @log
     def _find_transformation(self, image: Image):
         """
         Iteratively try and find a valid transformation to align image with stored align reference.
 
-        We perform 3 tries with growing image sizes of a centered image subset : 10%, 30% and 100% of image size
+        If profile uses coarse to fine alignment, we first match stars on binned data, for each profile binning factor,
+        and refine found transformation using full resolution stars near their predicted positions.
+
+        Then we perform tries with growing image sizes of a centered image subset, as set by profile ratios
 
         :param image: the image to be aligned
         :type image: Image
@@ -343,35 +658,50 @@ class Stacker(QueueConsumer):
         minimum_matches_for_valid_transform = config.get_minimum_match_count()
         _LOGGER.debug(f"*SD-REQ* configured minimum match count: {minimum_matches_for_valid_transform}")
 
+        new_data = Stacker._get_alignment_data(image)
+
+        for factor in self._profile.get_align_binning_factors:
+
+            if min(new_data.shape) // factor < _MINIMUM_BINNED_SIZE:
+                continue
+
+            try:
+                _LOGGER.debug(f"Searching valid transformation on {factor}x{factor} binned data")
+
+                coarse_transformation, _ = find_transform(bin_image(new_data, factor),
+                                                          self._get_binned_reference_features(factor))
+                transformation, matches = refine_transform(unbin_transform(coarse_transformation, factor),
+                                                           new_data,
+                                                           self._get_reference_stars(),
+                                                           minimum_matches_for_valid_transform)
+
+                Stacker._log_accepted_transformation(f"binning factor: {factor}", transformation, len(matches[0]))
+                return transformation
+
+            # pylint: disable=W0703
+            except Exception as alignment_error:
+                # on failure, we still have the full search below
+                _LOGGER.debug(f"Could not find valid transformation with binning factor = {factor} : "
+                              f"{alignment_error}")
+
         for ratio in self._profile.ratios:
 
             top, bottom, left, right = self._get_image_subset_boundaries(ratio)
 
-            # pick green channel if image has color
-            if image.is_color():
-                new_subset = image.data[1][top:bottom, left:right]
-                ref_subset = self._align_reference.data[1][top:bottom, left:right]
-            else:
-                new_subset = image.data[top:bottom, left:right]
-                ref_subset = self._align_reference.data[top:bottom, left:right]
+            new_subset = new_data[top:bottom, left:right]
 
             try:
                 _LOGGER.debug(f"Searching valid transformation on subset "
                               f"with ratio:{ratio} and shape: {new_subset.shape}")
 
-                transformation, matches = al.find_transform(new_subset, ref_subset)
+                transformation, matches = find_transform(new_subset, self._get_reference_features(ratio))
                 matches_count = len(matches[0])
 
                 if matches_count < minimum_matches_for_valid_transform:
                     raise StackingError(f"Alignment matches count is lower than configured threshold : "
                                         f"{matches_count} < {minimum_matches_for_valid_transform}.")
 
-                _LOGGER.debug("*SD-ALIGNOK* Image matching vs ref: Accepted")
-                _LOGGER.debug(f"*SD-RATIO* Accepted transformation with subset ratio: {ratio}")
-                _LOGGER.debug(f"*SD-ROT* Accepted rotation: {transformation.rotation}")
-                _LOGGER.debug(f"*SD-TRANS* Accepted translation: {transformation.translation}")
-                _LOGGER.debug(f"*SD-SCALE* Accepted scale: {transformation.scale}")
-                _LOGGER.debug(f"*SD-MATCHES* Accepted image matched features count : {matches_count}")
+                Stacker._log_accepted_transformation(f"subset ratio: {ratio}", transformation, matches_count)
                 return transformation
 
             # pylint: disable=W0703
@@ -385,21 +715,131 @@ class Stacker(QueueConsumer):
                 _LOGGER.debug(f"Could not find valid transformation on subset with ratio = {ratio}.")
                 continue
 
+    @staticmethod
+    def _log_accepted_transformation(search: str, transformation: SimilarityTransform, matches_count: int):
+        """
+        Logs details of an accepted alignment transformation
+
+        :param search: description of the search that found the transformation
+        :type search: str
+
+        :param transformation: the accepted transformation
+        :type transformation: SimilarityTransform
+
+        :param matches_count: count of matching stars
+        :type matches_count: int
+        """
+        _LOGGER.debug("*SD-ALIGNOK* Image matching vs ref: Accepted")
+        _LOGGER.debug(f"*SD-RATIO* Accepted transformation with {search}")
+        _LOGGER.debug(f"*SD-ROT* Accepted rotation: {transformation.rotation}")
+        _LOGGER.debug(f"*SD-TRANS* Accepted translation: {transformation.translation}")
+        _LOGGER.debug(f"*SD-SCALE* Accepted scale: {transformation.scale}")
+        _LOGGER.debug(f"*SD-MATCHES* Accepted image matched features count : {matches_count}")
+
+    @log
+    def _get_reference_features(self, ratio: float):
+        """
+        Gets star features of alignment reference subset. They are computed on first call for each subset ratio,
+        then kept until alignment reference changes
+
+        :param ratio: size ratio of subset vs alignment reference data
+        :type ratio: float
+
+        :return: the reference subset features
+        :rtype: ReferenceFeatures
+
+        :raises: AlignmentError if reference subset does not hold enough stars
+        """
+        def compute_features():
+            top, bottom, left, right = self._get_image_subset_boundaries(ratio)
+            return ReferenceFeatures(self._align_reference_data[top:bottom, left:right])
+
+        return self._get_reference_item(ratio, compute_features)
+
+    @log
+    def _get_binned_reference_features(self, factor: int):
+        """
+        Gets star features of binned alignment reference. They are computed on first call for each binning factor,
+        then kept until alignment reference changes
+
+        :param factor: the binning factor
+        :type factor: int
+
+        :return: the binned reference features
+        :rtype: ReferenceFeatures
+
+        :raises: AlignmentError if binned reference does not hold enough stars
+        """
+        return self._get_reference_item(('binned', factor),
+                                        lambda: ReferenceFeatures(bin_image(self._align_reference_data, factor)))
+
+    @log
+    def _get_reference_stars(self):
+        """
+        Gets full resolution star centroids of alignment reference, used to refine transformations found on binned
+        data. They are computed on first call, then kept until alignment reference changes
+
+        :return: the reference stars
+        :rtype: ReferenceStars
+
+        :raises: AlignmentError if reference does not hold enough stars
+        """
+        return self._get_reference_item('stars', lambda: ReferenceStars(self._align_reference_data))
+
+    @log
+    def _get_translation_reference(self):
+        """
+        Gets alignment reference prepared for phase correlation. It is computed on first call, then kept until
+        alignment reference changes
+
+        :return: the translation reference
+        :rtype: TranslationReference
+        """
+        return self._get_reference_item('translation', lambda: TranslationReference(self._align_reference_data))
+
+    def _get_reference_item(self, key, compute):
+        """
+        Gets an alignment reference item from cache, computing it on first call.
+
+        Computation failures are cached too, so a reference lacking stars is not searched again for each new image
+
+        :param key: the cache key
+        :param compute: callable computing the item
+        :type compute: callable
+
+        :return: the cached item
+
+        :raises: AlignmentError if item computation failed
+        """
+        # alignment workers wait for the first of them computing an item
+        with self._reference_features_lock:
+            if key not in self._reference_features:
+                try:
+                    self._reference_features[key] = compute()
+                except AlignmentError as alignment_error:
+                    self._reference_features[key] = alignment_error
+
+            item = self._reference_features[key]
+
+        if isinstance(item, AlignmentError):
+            raise item
+
+        return item
+
     @log
     def _get_image_subset_boundaries(self, ratio: float):
         """
         Retrieves a tuple of 4 int values representing the limits of a centered box (a.k.a. subset) as big as
-        ratio * stored stacking result's size
+        ratio * alignment reference data size
 
-        :param ratio: size ratio of subset vs stacking result
+        :param ratio: size ratio of subset vs alignment reference data
         :type ratio: float
 
         :return: a tuple of 4 int for top, bottom, left, right
         :rtype: tuple
         """
 
-        width = self._last_stacking_result.width
-        height = self._last_stacking_result.height
+        height, width = self._align_reference_data.shape
 
         horizontal_margin = int((width - (width * ratio)) / 2)
         vertical_margin = int((height - (height * ratio)) / 2)
@@ -412,21 +852,30 @@ class Stacker(QueueConsumer):
         return top, bottom, left, right
 
     @log
-    def _stack_image(self, image: Image):
+    def _stack_image(self, image: Image, coverage: np.ndarray):
         """
-        Compute stacking according to user defined stacking mode
-
-        the image data is modified in place by this function
+        Adds image to stack accumulation. Stacking result is only computed when published
 
         :param image: the image to be stacked
         :type image: Image
-        """
 
-        _LOGGER.debug(f"Stacking in {self._stacking_mode} mode...")
-        if self._stacking_mode == I18n.STACKING_MODE_SUM:
-            image.data = image.data + self._last_stacking_result.data
-        elif self._stacking_mode == I18n.STACKING_MODE_MEAN:
-            image.data = (self.size * self._last_stacking_result.data + image.data) / (self.size + 1)
-        else:
+        :param coverage: coverage of aligned image, as returned by _align_image(). None if image covers whole stack
+        :type coverage: numpy.ndarray
+        """
+        if self._stacking_mode not in [I18n.STACKING_MODE_SUM,
+                                       I18n.STACKING_MODE_MEAN,
+                                       I18n.STACKING_MODE_KAPPA_SIGMA,
+                                       I18n.STACKING_MODE_MEDIAN,
+                                       I18n.STACKING_MODE_SLIDING_MEAN]:
             raise StackingError(f"Unsupported stacking mode : {self._stacking_mode}")
-        _LOGGER.debug(f"Stacking in {self._stacking_mode} done.")
+
+        with self._accumulator_lock:
+            # accumulators keeping latest images may have to write them to disk
+            try:
+                self._accumulator.add(image.data, coverage)
+            except OSError as os_error:
+                raise StackingError(os_error)
+
+            self._unpublished_image = image
+            # in sliding mode, images leaving the window leave the stack
+            self.size = self._accumulator.size
@@ -0,0 +1,336 @@
+"""
+Provides the folder scanner : it gets new images from files written in scan folder.
+"""
+import os
+import sys
+import threading
+import time
+from logging import getLogger
+from pathlib import Path
+
+import psutil
+from PyQt5.QtCore import QObject, QT_TRANSLATE_NOOP
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
+
+from als import config
+from als.code_utilities import log, AlsLogAdapter
+from als.messaging import MESSAGE_HUB
+from als.model.base import RunningProfile
+from als.streams.scanner import InputScanner, ScannerStartError
+
+_LOGGER = AlsLogAdapter(getLogger(__name__), {})
+
+SCANNER_BACKEND_AUTO = "auto"
+SCANNER_BACKEND_NATIVE = "native"
+SCANNER_BACKEND_POLLING = "polling"
+
+# how long a file must keep the same size and modification time before we consider it complete, when we
+# also expect a close-after-write event for it. This is a safety net for writers we never get such event from.
+_CLOSE_EVENT_FALLBACK_STABILITY_WINDOW = 2.0
+
+# how long a file must keep the same size and modification time before we consider it complete, when no
+# close-after-write event can be expected. Profile polling period only sets how often we look, as a short stability
+# window would declare complete files a slow writer is still writing
+_MINIMUM_STABILITY_WINDOW = 0.5
+
+# filesystems on which kernel notifications are either not available or not reliable
+_NETWORK_FILESYSTEM_TYPES = ['nfs', 'nfs4', 'cifs', 'smb', 'smbfs', 'smb2', 'afpfs', 'ncpfs', '9p', 'davfs',
+                             'webdav', 'sshfs', 'fuse.sshfs', 'fuse.gvfsd-fuse']
+
+
+class FolderScanner(FileSystemEventHandler, InputScanner, QObject):
+    """
+    Watches file changes (creation, move) in a specific filesystem folder
+
+    the watched directory is retrieved from user config on scanner startup.
+
+    Depending on the requested backend, file changes are detected using :
+
+      - kernel notifications (inotify on Linux, FSEvents on macOS, ReadDirectoryChangesW on Windows)
+      - periodic polling of the whole scan folder tree
+
+    The default 'auto' backend uses kernel notifications whenever they are available and falls back to
+    polling for network mounts or if the native observer fails to start.
+
+    New file paths are only broadcast once files are complete :
+
+      - moved files are complete as soon as they are detected
+      - created files are complete when we get a close-after-write event for them (inotify only)
+      - if no such event is available, created files are complete when their size and modification time stay
+        unchanged for a whole stability window, of at least 0.5 s whatever the running profile polling period
+    """
+    @log
+    def __init__(self, profile: RunningProfile, backend: str = SCANNER_BACKEND_AUTO):
+        FileSystemEventHandler.__init__(self)
+        InputScanner.__init__(self)
+        QObject.__init__(self)
+        self._observer = None
+        self._backend = backend
+        self._profile = profile
+        self._pending_files = dict()
+        self._pending_files_lock = threading.Lock()
+        self._stability_checker = None
+        self._stability_checker_stop_event = threading.Event()
+
+    @property
+    def active_backend(self):
+        """
+        Retrieves the backend actually used by the running scanner
+
+        :return: SCANNER_BACKEND_NATIVE or SCANNER_BACKEND_POLLING. None if scanner is not running
+        :rtype: str or None
+        """
+        if self._observer is None:
+            return None
+
+        return SCANNER_BACKEND_POLLING if isinstance(self._observer, PollingObserver) else SCANNER_BACKEND_NATIVE
+
+    @log
+    def start(self):
+        """
+        Starts scanning scan folder for new files
+        """
+        scan_folder_path = config.get_scan_folder_path()
+
+        use_polling = self._backend == SCANNER_BACKEND_POLLING
+
+        if self._backend == SCANNER_BACKEND_AUTO and _is_on_network_filesystem(scan_folder_path):
+            MESSAGE_HUB.dispatch_info(
+                __name__,
+                QT_TRANSLATE_NOOP("", "Scan folder {} is on a network mount. Using polling scanner"),
+                [scan_folder_path, ])
+            use_polling = True
+
+        if not use_polling:
+            try:
+                self._start_observer(Observer(), scan_folder_path)
+
+            except OSError as os_error:
+                if self._backend == SCANNER_BACKEND_NATIVE:
+                    raise ScannerStartError(os_error)
+
+                MESSAGE_HUB.dispatch_warning(
+                    __name__,
+                    QT_TRANSLATE_NOOP("", "Native folder scanner failed to start : {}. Falling back to polling"),
+                    [str(os_error), ])
+                use_polling = True
+
+        if use_polling:
+            try:
+                self._start_observer(PollingObserver(), scan_folder_path)
+            except OSError as os_error:
+                raise ScannerStartError(os_error)
+
+        _LOGGER.debug(f"*SD-SCAN-BACKEND* Folder scanner backend: {self.active_backend}")
+
+        self._stability_checker_stop_event.clear()
+        self._stability_checker = threading.Thread(target=self._check_pending_files_stability,
+                                                   name="FileStabilityChecker",
+                                                   daemon=True)
+        self._stability_checker.start()
+
+    @log
+    def _start_observer(self, observer, scan_folder_path: str):
+        """
+        Schedules and starts a watchdog observer on scan folder
+
+        :param observer: the observer to start
+        :type observer: watchdog.observers.api.BaseObserver
+
+        :param scan_folder_path: path of the folder to watch
+        :type scan_folder_path: str
+
+        :raises: OSError if observer could not be started
+        """
+        self._observer = observer
+
+        try:
+            self._observer.schedule(self, scan_folder_path, recursive=True)
+            self._observer.start()
+        except OSError:
+            self._observer = None
+            raise
+
+    @log
+    def stop(self):
+        """
+        Stops scanning scan folder for new files
+        """
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+
+        if self._stability_checker is not None:
+            self._stability_checker_stop_event.set()
+            self._stability_checker.join()
+            self._stability_checker = None
+
+        with self._pending_files_lock:
+            self._pending_files.clear()
+
+    @property
+    def expects_close_events(self):
+        """
+        Tells if the running observer notifies us when a file opened for writing is closed
+
+        :return: True if we get close-after-write events, False otherwise
+        :rtype: bool
+        """
+        return sys.platform.startswith('linux') and self.active_backend == SCANNER_BACKEND_NATIVE
+
+    @log
+    def _check_pending_files_stability(self):
+        """
+        Periodically checks size and modification time of files we are waiting for and declares them complete when
+        both values did not change for a whole stability window.
+
+        Runs in its own thread until scanner is stopped
+        """
+        polling_period = self._profile.get_file_read_size_polling_period
+
+        while not self._stability_checker_stop_event.wait(polling_period):
+
+            if self.expects_close_events:
+                stability_window = max(polling_period, _CLOSE_EVENT_FALLBACK_STABILITY_WINDOW)
+            else:
+                stability_window = max(polling_period, _MINIMUM_STABILITY_WINDOW)
+
+            now = time.time()
+            ready_paths = list()
+
+            with self._pending_files_lock:
+                for path, pending_file in self._pending_files.items():
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+
+                    signature = (stat.st_size, stat.st_mtime)
+
+                    if signature != pending_file.signature or stat.st_size == 0:
+                        pending_file.signature = signature
+                        pending_file.stable_since = now
+
+                    elif now - pending_file.stable_since >= stability_window:
+                        ready_paths.append(path)
+
+            for path in ready_paths:
+                _LOGGER.debug(f"File {path} is stable. Declaring it complete")
+                self._declare_file_complete(path)
+
+    @log
+    def _declare_file_complete(self, path: str):
+        """
+        Stop waiting for a file and broadcast its path.
+
+        Stability checker and close events may both find the same file complete : only the first one to remove it from
+        pending files broadcasts it
+
+        :param path: path of the complete file
+        :type path: str
+        """
+        with self._pending_files_lock:
+            pending_file = self._pending_files.pop(path, None)
+
+        if pending_file is None:
+            _LOGGER.debug(f"File {path} was already declared complete")
+            return
+
+        wait_time = time.time() - pending_file.detection_time
+        _LOGGER.debug(f"*SD-FWAIT* File {path} waited for completion: {wait_time * 1000:0.3f} ms")
+
+        self.broadcast_image_path(path)
+
+    @log
+    def on_moved(self, event):
+        if event.event_type == 'moved' and not event.is_directory:
+            image_path = event.dest_path
+            _LOGGER.debug(f"File move detected : {image_path}")
+
+            with self._pending_files_lock:
+                self._pending_files.pop(event.src_path, None)
+                # a moved file is complete at once
+                self._pending_files.setdefault(image_path, _PendingFile())
+
+            self._declare_file_complete(image_path)
+
+    @log
+    def on_created(self, event):
+        if event.event_type == 'created' and not event.is_directory:
+            image_path = event.src_path
+            _LOGGER.debug(f"File creation detected : {image_path}")
+
+            with self._pending_files_lock:
+                self._pending_files[image_path] = _PendingFile()
+
+    @log
+    def on_closed(self, event):
+        if event.event_type == 'closed' and not event.is_directory:
+            image_path = event.src_path
+            _LOGGER.debug(f"File close after write detected : {image_path}")
+
+            self._declare_file_complete(image_path)
+
+
+# pylint: disable=R0903
+class _PendingFile:
+    """
+    Holds what we know about a file we are waiting for completion
+    """
+
+    def __init__(self):
+        self.detection_time = time.time()
+        self.stable_since = self.detection_time
+        self.signature = None
+
+
+@log
+def _is_on_network_filesystem(path: str):
+    """
+    Tells if a path is located on a network mount
+
+    :param path: the path to check
+    :type path: str
+
+    :return: True if path is located on a network mount, False otherwise or if we can't tell
+    :rtype: bool
+    """
+    try:
+        resolved_path = str(Path(path).resolve())
+        partitions = psutil.disk_partitions(all=True)
+    except OSError:
+        return False
+
+    # the partition holding our path is the one with the longest mount point our path is below
+    best_match = None
+    for partition in partitions:
+        if _is_below_mount_point(resolved_path, partition.mountpoint):
+            if best_match is None or len(partition.mountpoint) > len(best_match.mountpoint):
+                best_match = partition
+
+    if best_match is None:
+        return False
+
+    return best_match.fstype.lower() in _NETWORK_FILESYSTEM_TYPES or 'remote' in best_match.opts
+
+
+def _is_below_mount_point(path: str, mount_point: str):
+    """
+    Tells if a path is located below a mount point, comparing whole path components : /mnt/nas2 is not below /mnt/nas
+
+    :param path: the resolved path
+    :type path: str
+
+    :param mount_point: the mount point
+    :type mount_point: str
+
+    :return: True if path is the mount point or is located below it
+    :rtype: bool
+    """
+    try:
+        return os.path.commonpath([path, mount_point]) == os.path.normpath(mount_point)
+    except ValueError:
+        # paths are on different drives
+        return False
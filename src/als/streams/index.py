@@ -0,0 +1,268 @@
+"""
+Provides a persistent index of image files metadata.
+
+The index is a SQLite database stored in the work folder. For each file we read, it stores file size, modification
+time and the image metadata we extracted while reading it. Files we could open but failed to decode are stored as
+rejected.
+
+An index entry is only used as long as its file keeps the same size, modification time and partial hash. The
+partial hash only covers file size and the first and last few kB of the file : it is cheap to compute for large
+files, and catches files rewritten in place while keeping their size and modification time, as long as headers or
+trailing data changed.
+"""
+import hashlib
+import sqlite3
+import threading
+from logging import getLogger
+from pathlib import Path
+
+from als import config
+from als.code_utilities import log, AlsLogAdapter
+from als.model.base import Image
+
+_LOGGER = AlsLogAdapter(getLogger(__name__), {})
+
+INDEX_FILE_NAME = ".als_index.sqlite"
+
+# index is a cache : tables of an older schema version are dropped, not migrated
+_SCHEMA_VERSION = 3
+
+# number of bytes hashed at start and at end of files
+_HASHED_CHUNK_SIZE = 64 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    partial_hash TEXT NOT NULL,
+    shape TEXT,
+    dtype TEXT,
+    bayer_pattern TEXT,
+    exposure_time REAL,
+    rejected INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+class IndexEntry:
+    """
+    Metadata of an indexed file
+    """
+    # pylint: disable=R0913
+    def __init__(self, path: str, size: int, mtime_ns: int, partial_hash: str, shape: str, dtype: str,
+                 bayer_pattern: str, exposure_time: float, rejected: int):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.partial_hash = partial_hash
+        self.shape = tuple(int(dim) for dim in shape.split('x')) if shape else None
+        self.dtype = dtype
+        self.bayer_pattern = bayer_pattern
+        self.exposure_time = exposure_time if exposure_time is not None else Image.UNDEF_EXP_TIME
+        self.rejected = bool(rejected)
+
+    def __repr__(self):
+        return (f'{{'
+                f'Path={self.path}, '
+                f'Rejected={self.rejected}, '
+                f'Shape={self.shape}, '
+                f'Dtype={self.dtype}, '
+                f'Bayer={self.bayer_pattern}, '
+                f'Exp. time={self.exposure_time}'
+                f'}}')
+
+    def matches(self, image: Image):
+        """
+        Tells if an image read from indexed file has the indexed shape, data type and bayer pattern.
+
+        If not, file content changed while keeping its size, modification time and partial hash, and other indexed
+        metadata can't be trusted either
+
+        :param image: the image read from indexed file
+        :type image: Image
+
+        :return: True if image matches this entry
+        :rtype: bool
+        """
+        return (not self.rejected and
+                self.shape == image.data.shape and
+                self.dtype == str(image.data.dtype) and
+                self.bayer_pattern == image.bayer_pattern)
+
+
+class MetadataIndex:
+    """
+    Persistent index of image files metadata.
+
+    SQLite connections can only be used by the thread that opened them, so each thread gets its own connection.
+
+    Any database error disables the index for the rest of the run : reading images must never depend on it.
+    """
+
+    @log
+    def __init__(self):
+        self._local = threading.local()
+        self._enabled = True
+
+    @log
+    def lookup(self, path: Path):
+        """
+        Retrieves index entry of a file, if file has not changed since it was indexed
+
+        :param path: path of the file
+        :type path: Path
+
+        :return: the entry or None if file is not indexed or has changed since
+        :rtype: IndexEntry or None
+        """
+        connection = self._get_connection()
+        if connection is None:
+            return None
+
+        try:
+            stat = path.stat()
+            row = connection.execute(
+                "SELECT path, size, mtime_ns, partial_hash, shape, dtype, bayer_pattern, exposure_time, rejected "
+                "FROM files WHERE path = ?",
+                (str(path.resolve()), )).fetchone()
+
+            if row is None:
+                return None
+
+            entry = IndexEntry(*row)
+
+            if (entry.size != stat.st_size or
+                    entry.mtime_ns != stat.st_mtime_ns or
+                    entry.partial_hash != _compute_partial_hash(path, stat.st_size)):
+                _LOGGER.debug(f"*SD-INDEX* Outdated index entry for {path}")
+                return None
+
+        except OSError:
+            return None
+        except sqlite3.Error as error:
+            self._disable(error)
+            return None
+
+        return entry
+
+    @log
+    def record_image(self, path: Path, image: Image):
+        """
+        Stores metadata of an image successfully read from file
+
+        :param path: path of the file
+        :type path: Path
+
+        :param image: the image read from file
+        :type image: Image
+        """
+        shape = 'x'.join(str(dim) for dim in image.data.shape)
+        self._record(path, shape, str(image.data.dtype), image.bayer_pattern, image.exposure_time, False)
+
+    @log
+    def record_rejected(self, path: Path):
+        """
+        Stores a file as rejected : it could be opened, but not decoded
+
+        :param path: path of the file
+        :type path: Path
+        """
+        self._record(path, None, None, None, None, True)
+
+    # pylint: disable=R0913
+    def _record(self, path: Path, shape, dtype, bayer_pattern, exposure_time, rejected: bool):
+        connection = self._get_connection()
+        if connection is None:
+            return
+
+        try:
+            stat = path.stat()
+            partial_hash = _compute_partial_hash(path, stat.st_size)
+
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO files "
+                    "(path, size, mtime_ns, partial_hash, shape, dtype, bayer_pattern, exposure_time, rejected) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (str(path.resolve()), stat.st_size, stat.st_mtime_ns, partial_hash, shape, dtype,
+                     bayer_pattern, exposure_time, int(rejected)))
+
+        except OSError as error:
+            _LOGGER.debug(f"*SD-INDEX* Could not index {path} : {error}")
+        except sqlite3.Error as error:
+            self._disable(error)
+
+    def _get_connection(self):
+        """
+        Gets the index connection for current thread, opening it if needed.
+
+        A new connection is opened if work folder changed since last one was opened
+
+        :return: the connection or None if index is disabled or work folder does not exist
+        :rtype: sqlite3.Connection or None
+        """
+        if not self._enabled:
+            return None
+
+        work_folder = Path(config.get_work_folder_path())
+        if not work_folder.is_dir():
+            return None
+
+        index_path = str(work_folder / INDEX_FILE_NAME)
+
+        if getattr(self._local, 'index_path', None) != index_path:
+
+            if getattr(self._local, 'connection', None) is not None:
+                self._local.connection.close()
+
+            try:
+                connection = sqlite3.connect(index_path, timeout=5)
+                connection.execute("PRAGMA journal_mode=WAL")
+                if connection.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+                    with connection:
+                        connection.execute("DROP TABLE IF EXISTS files")
+                        connection.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+                connection.execute(_SCHEMA)
+            except sqlite3.Error as error:
+                self._disable(error)
+                return None
+
+            self._local.connection = connection
+            self._local.index_path = index_path
+            _LOGGER.debug(f"*SD-INDEX* Opened metadata index {index_path}")
+
+        return self._local.connection
+
+    def _disable(self, error: Exception):
+        self._enabled = False
+        _LOGGER.warning(f"Metadata index disabled after error : {error}")
+
+
+def _compute_partial_hash(path: Path, size: int):
+    """
+    Hashes file size and the first and last _HASHED_CHUNK_SIZE bytes of a file
+
+    :param path: path of the file
+    :type path: Path
+
+    :param size: file size, in bytes
+    :type size: int
+
+    :return: hexadecimal digest
+    :rtype: str
+
+    :raises: OSError if file cannot be read
+    """
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+
+    with path.open('rb') as file:
+        digest.update(file.read(_HASHED_CHUNK_SIZE))
+        if size > _HASHED_CHUNK_SIZE:
+            file.seek(max(_HASHED_CHUNK_SIZE, size - _HASHED_CHUNK_SIZE))
+            digest.update(file.read(_HASHED_CHUNK_SIZE))
+
+    return digest.hexdigest()
+
+
+METADATA_INDEX = MetadataIndex()
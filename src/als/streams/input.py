@@ -1,165 +1,298 @@
 """
 Provides everything need to handle ALS main inputs : images.
 
-We need to read file and in the future, get images from INDI
+We read images from files or get them straight from an INDI server
 """
-from abc import abstractmethod
+import base64
+import socket
+import threading
+import zlib
+from contextlib import nullcontext
+from io import BytesIO
 from logging import getLogger
 from pathlib import Path
+from xml.etree.ElementTree import XMLPullParser, ParseError
+from xml.sax.saxutils import quoteattr
 
 import cv2
 import exifread
-from PyQt5.QtCore import pyqtSignal, QObject, QT_TRANSLATE_NOOP
+import numpy as np
+from PyQt5.QtCore import QObject, QT_TRANSLATE_NOOP
 from astropy.io import fits
 from rawpy import imread
 from rawpy._rawpy import LibRawNonFatalError, LibRawFatalError
-from watchdog.events import FileSystemEventHandler
-from watchdog.observers.polling import PollingObserver
 
 from als import config
 from als.code_utilities import log, AlsLogAdapter
 from als.messaging import MESSAGE_HUB
-from als.model.base import Image
+from als.model.base import Image, RunningProfile
+from als.streams.folder import FolderScanner
+from als.streams.index import METADATA_INDEX
+from als.streams.scanner import InputScanner, ScannerStartError, SCANNER_TYPE_FILESYSTEM, SCANNER_TYPE_INDI, \
+    SCANNER_TYPE_SYNTHETIC
+from als.streams.synthetic import SyntheticScanner, SyntheticCameraSettings
 
 _LOGGER = AlsLogAdapter(getLogger(__name__), {})
 
 _IGNORED_FILENAME_START_PATTERNS = ['.', '~', 'tmp']
 EXPOSURE_TIME_EXIF_TAG = 'EXIF ExposureTime'
-SCANNER_TYPE_FILESYSTEM = "FS"
 
+# INDI client settings
+_INDI_PROTOCOL_VERSION = "1.7"
+_INDI_CONNECT_TIMEOUT = 5
+_INDI_RECEIVE_SIZE = 1024 ** 2
 
-class InputError(Exception):
-    """
-    Base class for all Exception subclasses in this module
+
+@log
+def create_scanner(profile: RunningProfile, scanner_type: str = SCANNER_TYPE_FILESYSTEM):
     """
+    Factory for image scanners.
 
+    :param profile: the running profile
+    :type profile: RunningProfile
 
-class ScannerStartError(InputError):
-    """
-    Raised when folder scanner start is in error.
-    """
+    :param scanner_type: the type of scanner to create. Accepted values are :
+
+      - "FS" for a filesystem scanner
+      - "INDI" for an INDI client scanner
+      - "SYNTH" for a synthetic camera, using settings from user config
 
+    :type scanner_type: str.
 
-class InputScanner:
+    :return: the right scanner implementation
+    :rtype: InputScanner subclass
     """
-    Base abstract class for all code responsible of ALS "image acquisition".
 
-    Subclasses are responsible for :
+    if scanner_type == SCANNER_TYPE_FILESYSTEM:
+        return FolderScanner(profile)
+
+    if scanner_type == SCANNER_TYPE_INDI:
+        return IndiScanner()
+
+    if scanner_type == SCANNER_TYPE_SYNTHETIC:
+        return SyntheticScanner(SyntheticCameraSettings.from_string(config.get_synthetic_camera_settings()))
 
-      - replying to start & stop commands
-      - reading images from actual source
-      - creating Image objects
-      - broadcasting every new image
+    raise ValueError(f"Unsupported scanner type : {scanner_type}")
+
+
+class IndiScanner(InputScanner, QObject):
     """
+    Receives images from an INDI server, as FITS BLOBs.
 
-    new_image_path_signal = pyqtSignal(str)
-    """Qt signal emitted when a new image is detected by scanner"""
+    Server address and device name are retrieved from user config on scanner startup.
 
+    This is a minimal INDI client : it asks for all properties, enables BLOBs on every device defining a BLOB
+    vector, or only on the configured device if any, and decodes each received FITS BLOB into an Image, without
+    touching disk.
+    """
     @log
-    def broadcast_image_path(self, path: str):
-        """
-        Send a signal with newly detected image path to anyone who cares
-
-        :param path: the new image path
-        :type path: str
-        """
-        if path is not None:
-            self.new_image_path_signal.emit(path)
+    def __init__(self):
+        InputScanner.__init__(self)
+        QObject.__init__(self)
+        self._socket = None
+        self._receiver = None
+        self._device_name = ""
+        self._blob_enabled_devices = set()
+        self._received_count = 0
 
-    @abstractmethod
+    @log
     def start(self):
         """
-        Starts checking for new images
+        Connects to INDI server and starts receiving images
 
-        :raises: ScannerStartError if startup fails
+        :raises: ScannerStartError if server cannot be reached
         """
+        host = config.get_indi_server_host()
+        port = config.get_indi_server_port()
+        self._device_name = config.get_indi_device_name()
+        self._blob_enabled_devices.clear()
+
+        try:
+            self._socket = socket.create_connection((host, port), timeout=_INDI_CONNECT_TIMEOUT)
+            self._socket.settimeout(None)
+            self._socket.sendall(f'<getProperties version="{_INDI_PROTOCOL_VERSION}"/>'.encode())
+        except OSError as os_error:
+            self._socket = None
+            raise ScannerStartError(os_error)
 
-    @abstractmethod
+        _LOGGER.debug(f"*SD-INDI* Connected to INDI server {host}:{port}")
+
+        self._receiver = threading.Thread(target=self._receive,
+                                          args=(self._socket, ),
+                                          name="IndiReceiver",
+                                          daemon=True)
+        self._receiver.start()
+
+    @log
     def stop(self):
         """
-        Stops checking for new images
+        Disconnects from INDI server
         """
-
-    @staticmethod
-    @log
-    def create_scanner(scanner_type: str = SCANNER_TYPE_FILESYSTEM):
+        if self._socket is not None:
+            # receiver thread only reports errors on current connection
+            connection, self._socket = self._socket, None
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.close()
+
+        if self._receiver is not None:
+            self._receiver.join()
+            self._receiver = None
+
+    def _receive(self, connection: socket.socket):
         """
-        Factory for image scanners.
-
-        :param scanner_type: the type of scanner to create. Accepted values are :
+        Parses server messages until connection is closed.
 
-          - "FS" for a filesystem scanner
+        INDI messages are a stream of top level XML elements, so we parse them as children of a fake root element
+        and drop each of them once it is handled.
 
-        :type scanner_type: str.
+        :param connection: the server connection
+        :type connection: socket.socket
+        """
+        parser = XMLPullParser(events=("start", "end"))
+        parser.feed("<indi>")
+        depth = 0
+        root = None
 
-        :return: the right scanner implementation
-        :rtype: InputScanner subclass
+        try:
+            while True:
+                chunk = connection.recv(_INDI_RECEIVE_SIZE)
+                if not chunk:
+                    break
+
+                parser.feed(chunk)
+
+                for event, element in parser.read_events():
+                    if event == "start":
+                        depth += 1
+                        if depth == 1:
+                            root = element
+                    else:
+                        depth -= 1
+                        if depth == 1:
+                            self._handle_message(connection, element)
+                            root.clear()
+
+        except (OSError, ParseError) as error:
+            if self._socket is connection:
+                MESSAGE_HUB.dispatch_error(
+                    __name__,
+                    QT_TRANSLATE_NOOP("", "Error receiving from INDI server : {}"),
+                    [str(error), ])
+            return
+
+        if self._socket is connection:
+            MESSAGE_HUB.dispatch_warning(__name__, QT_TRANSLATE_NOOP("", "INDI server closed connection"))
+
+    def _handle_message(self, connection: socket.socket, element):
         """
+        Handles a single INDI message
 
-        if scanner_type == SCANNER_TYPE_FILESYSTEM:
-            return FolderScanner()
+        :param connection: the server connection
+        :type connection: socket.socket
 
-        raise ValueError(f"Unsupported scanner type : {scanner_type}")
+        :param element: the message
+        :type element: xml.etree.ElementTree.Element
+        """
+        device = element.get("device", "")
 
+        if self._device_name and device != self._device_name:
+            return
 
-class FolderScanner(FileSystemEventHandler, InputScanner, QObject):
-    """
-    Watches file changes (creation, move) in a specific filesystem folder
+        if element.tag == "defBLOBVector" and device not in self._blob_enabled_devices:
+            self._blob_enabled_devices.add(device)
+            connection.sendall(f'<enableBLOB device={quoteattr(device)}>Also</enableBLOB>'.encode())
+            _LOGGER.debug(f"*SD-INDI* BLOBs enabled for device {device}")
 
-    the watched directory is retrieved from user config on scanner startup
-    """
-    @log
-    def __init__(self):
-        FileSystemEventHandler.__init__(self)
-        InputScanner.__init__(self)
-        QObject.__init__(self)
-        self._observer = None
+        elif element.tag == "setBLOBVector":
+            for blob in element.iter("oneBLOB"):
+                self._handle_blob(device, blob)
 
-    @log
-    def start(self):
+    def _handle_blob(self, device: str, blob):
         """
-        Starts scanning scan folder for new files
+        Decodes a FITS BLOB and broadcasts resulting image
+
+        :param device: name of the device the BLOB comes from
+        :type device: str
+
+        :param blob: the BLOB element
+        :type blob: xml.etree.ElementTree.Element
         """
+        blob_format = blob.get("format", "").lower()
+
+        if blob_format not in ['.fits', '.fits.z', '.fit', '.fit.z']:
+            _LOGGER.debug(f"*SD-INDI* Ignoring BLOB with format {blob_format} from {device}")
+            return
+
         try:
-            scan_folder_path = config.get_scan_folder_path()
-            self._observer = PollingObserver()
-            self._observer.schedule(self, scan_folder_path, recursive=True)
-            self._observer.start()
-        except OSError as os_error:
-            raise ScannerStartError(os_error)
+            content = base64.b64decode(blob.text or "")
+            if blob_format.endswith('.z'):
+                content = zlib.decompress(content)
+            image = read_fit_bytes(content)
 
-    @log
-    def stop(self):
-        """
-        Stops scanning scan folder for new files
-        """
-        if self._observer is not None:
-            self._observer.stop()
-            self._observer = None
+        except (ValueError, zlib.error, OSError, TypeError) as error:
+            MESSAGE_HUB.dispatch_error(
+                __name__,
+                QT_TRANSLATE_NOOP("", "Error reading image from INDI device {} : {}"),
+                [device, str(error)])
+            return
 
-    @log
-    def on_moved(self, event):
-        if event.event_type == 'moved':
-            image_path = event.dest_path
-            _LOGGER.debug(f"File move detected : {image_path}")
-            self.broadcast_image_path(image_path)
+        self._received_count += 1
+        image.origin = f"INDI : {device} #{self._received_count}"
+        image.ticket = image.origin
 
-    @log
-    def on_created(self, event):
-        if event.event_type == 'created':
-            image_path = event.src_path
-            _LOGGER.debug(f"File creation detected : {image_path}")
-            self.broadcast_image_path(image_path)
+        MESSAGE_HUB.dispatch_info(
+            __name__,
+            QT_TRANSLATE_NOOP("", "Successful image read from {}"),
+            [image.origin, ]
+        )
+        self.broadcast_image(image)
+
+
+@log
+def collect_input_paths(inputs):
+    """
+    Builds the sorted list of files found in inputs
+
+    :param inputs: file or folder paths
+    :type inputs: list
+
+    :return: a tuple of 2 lists : file paths, sorted by name inside each folder, in inputs order, and inputs that
+             could not be found. Reporting those is left to callers
+    :rtype: tuple
+    """
+    paths = []
+    missing_inputs = []
+
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            paths.extend(sorted(child for child in path.rglob('*') if child.is_file()))
+        elif path.is_file():
+            paths.append(path)
+        else:
+            missing_inputs.append(item)
+
+    return paths, missing_inputs
 
 
 @log
-def read_disk_image(path: Path):
+def read_disk_image(path: Path, zero_copy: bool = False):
     """
     Reads an image from disk
 
+    Metadata of each file read is stored in the metadata index, so known RAW EXIFs are not parsed again and files
+    we already failed to decode are skipped right away, as long as they have not changed.
+
     :param path: path to the file to load image from
     :type path:  pathlib.Path
 
+    :param zero_copy: avoid intermediate copies of image data. FITS data is memory-mapped and RAW data is
+                      a view on LibRaw's own buffers
+    :type zero_copy: bool
+
     :return: the image read from disk or None if image is ignored or an error occurred
     :rtype: Image or None
     """
@@ -174,13 +307,35 @@ def read_disk_image(path: Path):
 
     if not ignore_image:
 
+        index_entry = METADATA_INDEX.lookup(path)
+
+        if index_entry is not None and index_entry.rejected:
+            MESSAGE_HUB.dispatch_info(
+                __name__,
+                QT_TRANSLATE_NOOP("", "Skipping file {} : it was already rejected"),
+                [str(path.resolve()), ]
+            )
+            return None
+
         if path.suffix.lower() in ['.fit', '.fits', '.fts']:
-            image = _read_fit_image(path)
+            image = _read_fit_image(path, zero_copy)
 
         elif path.suffix.lower() in ['.jpg', '.jpeg', '.png', '.tif', '.tiff']:
             image = _read_standard_image(path)
         else:
-            image = _read_raw_image(path)
+            image = _read_raw_image(path, zero_copy, read_exifs=index_entry is None)
+            if image is not None and index_entry is not None:
+                if index_entry.matches(image):
+                    image.exposure_time = index_entry.exposure_time
+                else:
+                    extract_exifs(image, path)
+
+        if image is None:
+            # a file we could not even open may be readable later : only decoding failures are final
+            if _is_readable(path):
+                METADATA_INDEX.record_rejected(path)
+        elif index_entry is None or not index_entry.matches(image):
+            METADATA_INDEX.record_image(path, image)
 
         if image is not None:
             image.origin = f"FILE : {str(path.resolve())}"
@@ -193,31 +348,53 @@ def read_disk_image(path: Path):
     return image
 
 
+def _is_readable(path: Path):
+    """
+    Tells if a file can be opened and read right now
+
+    :param path: path of the file
+    :type path: pathlib.Path
+
+    :return: False if file could not be opened or read, because of permissions or a lock for instance
+    :rtype: bool
+    """
+    try:
+        with open(path, 'rb') as file:
+            file.read(1)
+    except OSError:
+        return False
+
+    return True
+
+
 @log
-def _read_fit_image(path: Path):
+def _read_fit_image(path: Path, zero_copy: bool = False):
     """
     read FIT image from filesystem
 
     :param path: path to image file to load from
     :type path: pathlib.Path
 
+    :param zero_copy: memory-map file data and skip astropy's own scaling
+    :type zero_copy: bool
+
     :return: the loaded image, with data and headers parsed or None if a known error occurred
     :rtype: Image or None
     """
     try:
-        with fits.open(str(path.resolve())) as fit:
+        with fits.open(str(path.resolve()), memmap=zero_copy, do_not_scale_image_data=zero_copy) as fit:
             # pylint: disable=E1101
             data = fit[0].data
             header = fit[0].header
 
-        image = Image(data)
+            if zero_copy and data is not None:
+                data = _get_native_fit_data(data, header)
 
-        if 'BAYERPAT' in header:
-            image.bayer_pattern = header['BAYERPAT']
+                if data is None:
+                    _LOGGER.debug(f"Unhandled FITS data scaling for {path}. Reading it the usual way")
+                    return _read_fit_image(path, zero_copy=False)
 
-        if 'EXPTIME' in header:
-            image.exposure_time = header['EXPTIME']
-            _LOGGER.debug(f"*SD-EXP_T* extracted exposure time: {image.exposure_time}")
+        image = _build_fit_image(data, header)
 
     except (OSError, TypeError) as error:
         _report_fs_error(path, error)
@@ -226,6 +403,89 @@ def _read_fit_image(path: Path):
     return image
 
 
+@log
+def read_fit_bytes(content: bytes):
+    """
+    Reads a FIT image from memory
+
+    :param content: FIT file content
+    :type content: bytes
+
+    :return: the loaded image, with data and headers parsed
+
+    :raises: OSError or TypeError if content is not a valid FIT file
+    """
+    with fits.open(BytesIO(content)) as fit:
+        # pylint: disable=E1101
+        return _build_fit_image(fit[0].data, fit[0].header)
+
+
+def _build_fit_image(data, header):
+    """
+    Builds an image from FIT data and header
+
+    :param data: image data
+    :type data: numpy.ndarray
+
+    :param header: FIT header
+    :type header: astropy.io.fits.Header
+
+    :return: the image
+    :rtype: Image
+    """
+    image = Image(data)
+
+    if 'BAYERPAT' in header:
+        image.bayer_pattern = header['BAYERPAT']
+
+    if 'EXPTIME' in header:
+        image.exposure_time = header['EXPTIME']
+        _LOGGER.debug(f"*SD-EXP_T* extracted exposure time: {image.exposure_time}")
+
+    return image
+
+
+@log
+def _get_native_fit_data(raw_data, header):
+    """
+    Builds native, scaled data from unscaled FITS data, using at most one pass over the raw data.
+
+    FITS data is big endian, so we can only keep raw data as is for single byte data types. For all other types,
+    byte swapping and scaling are done in a single operation.
+
+    :param raw_data: unscaled data, as stored in FITS file
+    :type raw_data: numpy.ndarray
+
+    :param header: FITS header
+    :type header: astropy.io.fits.Header
+
+    :return: native data or None if FITS scaling is not one we handle
+    :rtype: numpy.ndarray or None
+    """
+    bzero = header.get('BZERO', 0)
+    bscale = header.get('BSCALE', 1)
+
+    if bscale != 1:
+        return None
+
+    if bzero == 0:
+        if raw_data.dtype.isnative:
+            return raw_data
+        return raw_data.astype(raw_data.dtype.newbyteorder('='))
+
+    # unsigned integers are stored as signed ones with an offset of 2 ** (bits - 1). Removing that offset is
+    # the same as flipping the sign bit
+    if raw_data.dtype.kind == 'i' and bzero == 2 ** (raw_data.dtype.itemsize * 8 - 1):
+        unsigned_type = np.dtype(f'u{raw_data.dtype.itemsize}')
+        native_data = np.empty(raw_data.shape, dtype=unsigned_type)
+        np.bitwise_xor(raw_data.view(unsigned_type.newbyteorder(raw_data.dtype.byteorder)),
+                       unsigned_type.type(bzero),
+                       out=native_data)
+        return native_data
+
+    return None
+
+
 @log
 def _read_standard_image(path: Path):
     """
@@ -248,19 +508,29 @@ def _read_standard_image(path: Path):
 
 
 @log
-def _read_raw_image(path: Path):
+def _read_raw_image(path: Path, zero_copy: bool = False, read_exifs: bool = True):
     """
     Reads a RAW DLSR image from file
 
     :param path: path to the file to read from
     :type path: pathlib.Path
 
+    :param zero_copy: use a view on LibRaw buffers as image data, instead of a copy
+    :type zero_copy: bool
+
+    :param read_exifs: read EXIF tags from file. Set this to False when they are already known
+    :type read_exifs: bool
+
     :return: the image or None if a known error occurred
     :rtype: Image or None
     """
 
     try:
-        with imread(str(path.resolve())) as raw_image:
+        raw_image = imread(str(path.resolve()))
+
+        # in zero copy mode, image data is a view on LibRaw buffers. That view holds a reference to raw_image, and
+        # buffers are released when the view is garbage collected. So we must not close raw_image ourselves
+        with nullcontext(raw_image) if zero_copy else raw_image:
 
             # in here, we make sure we store the bayer pattern as it would be advertised if image was a FITS image.
             #
@@ -318,10 +588,14 @@ def _read_raw_image(path: Path):
 
             _LOGGER.debug(f"Computed, FITS-compatible bayer pattern = {bayer_pattern}")
 
-            new_image = Image(raw_image.raw_image_visible.copy())
+            if zero_copy:
+                new_image = Image(raw_image.raw_image_visible)
+            else:
+                new_image = Image(raw_image.raw_image_visible.copy())
             new_image.bayer_pattern = bayer_pattern
 
-            extract_exifs(new_image, path)
+            if read_exifs:
+                extract_exifs(new_image, path)
 
             return new_image
 
@@ -0,0 +1,82 @@
+"""
+Provides the base of input scanners : the sources ALS gets new images from.
+
+Scanner implementations live in their own modules. Use als.streams.input.create_scanner() to get one.
+"""
+from abc import abstractmethod
+
+from PyQt5.QtCore import pyqtSignal
+
+from als.code_utilities import log
+from als.model.base import Image
+
+SCANNER_TYPE_FILESYSTEM = "FS"
+SCANNER_TYPE_INDI = "INDI"
+SCANNER_TYPE_SYNTHETIC = "SYNTH"
+
+
+class InputError(Exception):
+    """
+    Base class for all Exception subclasses in this module
+    """
+
+
+class ScannerStartError(InputError):
+    """
+    Raised when folder scanner start is in error.
+    """
+
+
+class InputScanner:
+    """
+    Base abstract class for all code responsible of ALS "image acquisition".
+
+    Subclasses are responsible for :
+
+      - replying to start & stop commands
+      - reading images from actual source
+      - creating Image objects
+      - broadcasting every new image
+    """
+
+    new_image_path_signal = pyqtSignal(str)
+    """Qt signal emitted when a new image is detected by scanner"""
+
+    new_image_signal = pyqtSignal(Image)
+    """Qt signal emitted when a new image is received in memory by scanner"""
+
+    @log
+    def broadcast_image_path(self, path: str):
+        """
+        Send a signal with newly detected image path to anyone who cares
+
+        :param path: the new image path
+        :type path: str
+        """
+        if path is not None:
+            self.new_image_path_signal.emit(path)
+
+    @log
+    def broadcast_image(self, image: Image):
+        """
+        Send a signal with newly received image to anyone who cares
+
+        :param image: the new image
+        :type image: Image
+        """
+        if image is not None:
+            self.new_image_signal.emit(image)
+
+    @abstractmethod
+    def start(self):
+        """
+        Starts checking for new images
+
+        :raises: ScannerStartError if startup fails
+        """
+
+    @abstractmethod
+    def stop(self):
+        """
+        Stops checking for new images
+        """
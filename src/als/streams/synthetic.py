@@ -0,0 +1,292 @@
+"""
+Provides a synthetic camera : an input scanner generating star field images.
+
+It is used to push ALS at controlled frame rates and sensor sizes, and to check alignment accuracy against known
+transforms, without any real camera nor sky.
+"""
+import threading
+import time
+from logging import getLogger
+
+import numpy as np
+from PyQt5.QtCore import QObject
+from skimage.transform import SimilarityTransform
+
+from als.code_utilities import log, AlsLogAdapter
+from als.model.base import Image
+from als.streams.scanner import InputScanner
+
+_LOGGER = AlsLogAdapter(getLogger(__name__), {})
+
+# stars are rendered as gaussian spots, drawn in square stamps of this size
+_STAR_STAMP_SIZE = 9
+
+# relative response of each bayer color to our white stars
+_BAYER_COLOR_RESPONSE = {'R': .8, 'G': 1., 'B': .7}
+
+
+class SyntheticCameraSettings:
+    """
+    Synthetic camera settings.
+
+    Settings can be parsed from a string of comma separated key=value pairs, each key being the name of an attribute
+    of this class. Example : "width=1920,height=1080,bayer=RGGB,rate=2"
+    """
+
+    # pylint: disable=R0902
+    def __init__(self):
+        self.width = 1304
+        """image width, in pixels"""
+
+        self.height = 976
+        """image height, in pixels"""
+
+        self.bits = 16
+        """image bit depth : 8 or 16"""
+
+        self.bayer = ""
+        """bayer pattern, as found in FITS headers. Empty for B&W images"""
+
+        self.stars = 300
+        """number of stars in the field"""
+
+        self.fwhm = 3.
+        """star FWHM, in pixels"""
+
+        self.background = 1000.
+        """sky background level, in 16 bits ADU"""
+
+        self.noise = 20.
+        """standard deviation of gaussian noise, in 16 bits ADU"""
+
+        self.drift_x = 1.
+        """horizontal drift between two consecutive frames, in pixels"""
+
+        self.drift_y = .5
+        """vertical drift between two consecutive frames, in pixels"""
+
+        self.rotation = .02
+        """field rotation between two consecutive frames, in degrees"""
+
+        self.rate = 1.
+        """frames per second. 0 means as fast as possible"""
+
+        self.count = 0
+        """number of frames to emit. 0 means no limit"""
+
+        self.exposure = 1.
+        """exposure time advertised by each frame, in seconds"""
+
+        self.seed = 0
+        """random seed, so runs are reproducible"""
+
+    @staticmethod
+    def from_string(settings_string: str):
+        """
+        Parses settings from a string
+
+        :param settings_string: comma separated key=value pairs. Missing keys keep their default value
+        :type settings_string: str
+
+        :return: the settings
+        :rtype: SyntheticCameraSettings
+
+        :raises: ValueError if string holds an unknown key or an invalid value
+        """
+        settings = SyntheticCameraSettings()
+
+        for pair in filter(None, (item.strip() for item in settings_string.split(','))):
+            key, _, value = pair.partition('=')
+            key = key.strip()
+
+            if key.startswith('_') or not hasattr(settings, key):
+                raise ValueError(f"Unknown synthetic camera setting : {key}")
+
+            default = getattr(settings, key)
+            setattr(settings, key, value.strip().upper() if isinstance(default, str) else type(default)(value))
+
+        if settings.bits not in [8, 16]:
+            raise ValueError(f"Unsupported synthetic camera bit depth : {settings.bits}")
+
+        if settings.bayer and sorted(settings.bayer) != ['B', 'G', 'G', 'R']:
+            raise ValueError(f"Unsupported synthetic camera bayer pattern : {settings.bayer}")
+
+        return settings
+
+
+class SyntheticScanner(InputScanner, QObject):
+    """
+    Emits generated star field images.
+
+    All frames show the same star field, each one moved by a known similarity transform : frame N is frame 0
+    rotated around image center by N * rotation and translated by N * drift.
+
+    The true transform of each frame is recorded in true_transforms, keyed by image origin. It maps frame 0
+    coordinates to that frame coordinates.
+    """
+
+    @log
+    def __init__(self, settings: SyntheticCameraSettings):
+        InputScanner.__init__(self)
+        QObject.__init__(self)
+        self._settings = settings
+        self._emitter = None
+        self._stop_event = threading.Event()
+        self._frame_index = 0
+        self._stars = None
+        self.true_transforms = dict()
+
+    @log
+    def start(self):
+        """
+        Starts emitting frames
+        """
+        if self._stars is None:
+            self._stars = generate_star_catalog(self._settings)
+
+        self._stop_event.clear()
+        self._emitter = threading.Thread(target=self._emit_frames, name="SyntheticCamera", daemon=True)
+        self._emitter.start()
+
+    @log
+    def stop(self):
+        """
+        Stops emitting frames
+        """
+        if self._emitter is not None:
+            self._stop_event.set()
+            self._emitter.join()
+            self._emitter = None
+
+    def _emit_frames(self):
+        period = 1 / self._settings.rate if self._settings.rate > 0 else 0
+        next_frame_time = time.time()
+
+        while not self._stop_event.is_set():
+
+            if 0 < self._settings.count <= self._frame_index:
+                break
+
+            transform = get_frame_transform(self._settings, self._frame_index)
+            image = render_frame(self._settings, self._stars, transform, self._frame_index)
+
+            image.origin = f"SYNTH : #{self._frame_index}"
+            image.ticket = image.origin
+            self.true_transforms[image.origin] = transform
+            _LOGGER.debug(f"*SD-SYNTH* Frame {self._frame_index} : rotation={np.degrees(transform.rotation)} "
+                          f"translation={transform.translation}")
+
+            self._frame_index += 1
+            self.broadcast_image(image)
+
+            if period:
+                next_frame_time += period
+                self._stop_event.wait(max(0., next_frame_time - time.time()))
+
+
+def generate_star_catalog(settings: SyntheticCameraSettings):
+    """
+    Generates star positions and fluxes of frame 0.
+
+    Stars are spread over an area larger than the frame, so drifting frames keep showing stars
+
+    :param settings: camera settings
+    :type settings: SyntheticCameraSettings
+
+    :return: a (N, 3) array : x, y, peak value in 16 bits ADU
+    :rtype: numpy.ndarray
+    """
+    rng = np.random.RandomState(settings.seed)
+    margin = max(settings.width, settings.height) / 2
+
+    x = rng.uniform(-margin, settings.width + margin, settings.stars * 4)
+    y = rng.uniform(-margin, settings.height + margin, settings.stars * 4)
+
+    # few bright stars and lots of faint ones
+    peak = 40000 * rng.power(.3, settings.stars * 4) + 5 * settings.noise
+
+    return np.column_stack((x, y, peak))
+
+
+def get_frame_transform(settings: SyntheticCameraSettings, frame_index: int):
+    """
+    Computes the true transform of a frame
+
+    :param settings: camera settings
+    :type settings: SyntheticCameraSettings
+
+    :param frame_index: frame number, starting at 0
+    :type frame_index: int
+
+    :return: transform mapping frame 0 coordinates to frame coordinates
+    :rtype: SimilarityTransform
+    """
+    center = np.array([settings.width / 2, settings.height / 2])
+
+    rotation = SimilarityTransform(rotation=np.radians(settings.rotation * frame_index))
+    to_origin = SimilarityTransform(translation=-center)
+    back_and_drift = SimilarityTransform(
+        translation=center + frame_index * np.array([settings.drift_x, settings.drift_y]))
+
+    return SimilarityTransform(matrix=back_and_drift.params @ rotation.params @ to_origin.params)
+
+
+def render_frame(settings: SyntheticCameraSettings, stars: np.ndarray, transform: SimilarityTransform,
+                 frame_index: int):
+    """
+    Renders a frame
+
+    :param settings: camera settings
+    :type settings: SyntheticCameraSettings
+
+    :param stars: star catalog, as returned by generate_star_catalog()
+    :type stars: numpy.ndarray
+
+    :param transform: the frame transform
+    :type transform: SimilarityTransform
+
+    :param frame_index: frame number, used to seed noise
+    :type frame_index: int
+
+    :return: the frame
+    :rtype: Image
+    """
+    height, width = settings.height, settings.width
+    positions = transform(stars[:, :2])
+    half_stamp = _STAR_STAMP_SIZE // 2
+
+    visible = ((positions[:, 0] >= -half_stamp) & (positions[:, 0] < width + half_stamp) &
+               (positions[:, 1] >= -half_stamp) & (positions[:, 1] < height + half_stamp))
+    positions = positions[visible][:settings.stars]
+    peaks = stars[visible, 2][:settings.stars]
+
+    # draw all star stamps at once. Canvas has margins so stamps never fall outside of it
+    canvas = np.zeros((height + 2 * _STAR_STAMP_SIZE, width + 2 * _STAR_STAMP_SIZE), dtype=np.float32)
+    offsets = np.arange(-half_stamp, half_stamp + 1)
+    centers = np.floor(positions).astype(int)
+    stamp_x = centers[:, 0, None, None] + offsets[None, None, :]
+    stamp_y = centers[:, 1, None, None] + offsets[None, :, None]
+    sigma = settings.fwhm / 2.3548
+    values = peaks[:, None, None] * np.exp(
+        -((stamp_x - positions[:, 0, None, None]) ** 2 + (stamp_y - positions[:, 1, None, None]) ** 2) /
+        (2 * sigma ** 2))
+    np.add.at(canvas, (stamp_y + _STAR_STAMP_SIZE, stamp_x + _STAR_STAMP_SIZE), values)
+    data = canvas[_STAR_STAMP_SIZE:-_STAR_STAMP_SIZE, _STAR_STAMP_SIZE:-_STAR_STAMP_SIZE]
+
+    if settings.bayer:
+        response = np.array([_BAYER_COLOR_RESPONSE[color] for color in settings.bayer], dtype=np.float32)
+        data *= np.tile(response.reshape(2, 2), (height // 2 + 1, width // 2 + 1))[:height, :width]
+
+    rng = np.random.RandomState([settings.seed, frame_index])
+    data += settings.background + rng.normal(0, settings.noise, data.shape).astype(np.float32)
+
+    if settings.bits == 8:
+        data = np.clip(data / 257, 0, 255).astype(np.uint8)
+    else:
+        data = np.clip(data, 0, 2 ** 16 - 1).astype(np.uint16)
+
+    image = Image(data)
+    image.bayer_pattern = settings.bayer
+    image.exposure_time = settings.exposure
+
+    return image
@@ -1,6 +1,7 @@
 """
 Provides all dialogs used in ALS GUI
 """
+import os
 from logging import getLogger
 from pathlib import Path
 
@@ -8,14 +9,18 @@ import qrcode
 from PIL.ImageQt import ImageQt
 from PyQt5.QtCore import pyqtSlot, QT_TRANSLATE_NOOP, pyqtSignal, Qt
 from PyQt5.QtGui import QPixmap
-from PyQt5.QtWidgets import QDialog, QFileDialog, QMessageBox, QApplication
+from PyQt5.QtWidgets import QDialog, QFileDialog, QMessageBox, QApplication, QInputDialog, QProgressDialog
 
 import als.model.data
 from als import config
 from als.code_utilities import log, AlsLogAdapter
 from als.logic import Controller
+from als.masters import MasterBuilder, MASTER_METHOD_MEDIAN, MASTER_METHOD_KAPPA_SIGMA, MASTER_TYPE_DARK, \
+    MASTER_TYPE_BIAS, MASTER_TYPE_FLAT, get_default_master_path
 from als.messaging import MESSAGE_HUB
+from als.model.base import DEBAYER_ALGORITHMS
 from als.model.data import VERSION, DYNAMIC_DATA
+from als.streams.input import collect_input_paths
 from generated.about_ui import Ui_AboutDialog
 from generated.prefs_ui import Ui_PrefsDialog
 from generated.qr_ui import Ui_QrDialog
@@ -60,12 +65,21 @@ class PreferencesDialog(QDialog):
         self._ui.ln_web_folder_path.setToolTip(config.get_web_folder_path())
         self._ui.ln_master_dark_path.setText(config.get_master_dark_file_path())
         self._ui.ln_master_dark_path.setToolTip(config.get_master_dark_file_path())
+        self._ui.ln_master_bias_path.setText(config.get_master_bias_file_path())
+        self._ui.ln_master_bias_path.setToolTip(config.get_master_bias_file_path())
+        self._ui.ln_master_flat_path.setText(config.get_master_flat_file_path())
+        self._ui.ln_master_flat_path.setToolTip(config.get_master_flat_file_path())
 
         self._ui.ln_web_server_port.setText(str(config.get_www_server_port_number()))
         self._ui.spn_webpage_refresh_period.setValue(config.get_www_server_refresh_period())
         self._ui.chk_debug_logs.setChecked(config.is_debug_log_on())
         self._ui.chk_use_dark.setChecked(config.get_use_master_dark())
+        self._ui.chk_use_bias.setChecked(config.get_use_master_bias())
+        self._ui.chk_use_flat.setChecked(config.get_use_master_flat())
         self._ui.chk_use_hpr.setChecked(config.get_hot_pixel_remover())
+        self._ui.chk_use_defect_map.setChecked(config.get_hot_pixel_defect_map())
+        self._ui.chk_use_defect_map.setEnabled(self._ui.chk_use_hpr.isChecked())
+        self._ui.chk_translation_only_alignment.setChecked(config.get_translation_only_alignment())
         self._ui.chk_save_on_stop.setChecked(config.get_save_on_stop())
 
         config_to_image_save_type_mapping = {
@@ -86,6 +100,17 @@ class PreferencesDialog(QDialog):
         for k, v in self._profile_config_mapping.items():
             v.setChecked(config.get_profile() == k)
 
+        self._debayer_algorithm_config_mapping = {
+
+            0: self._ui.cmb_visual_debayer,
+            1: self._ui.cmb_photo_debayer
+        }
+
+        for profile, combo in self._debayer_algorithm_config_mapping.items():
+            for algorithm_index, algorithm in enumerate(DEBAYER_ALGORITHMS):
+                combo.setItemData(algorithm_index, algorithm)
+            combo.setCurrentIndex(combo.findData(config.get_debayer_algorithm(profile)))
+
         self._ui.chk_www_own_folder.setChecked(config.get_www_use_dedicated_folder())
 
         self._web_folder_controls = [self._ui.lbl_web_folder,
@@ -99,6 +124,8 @@ class PreferencesDialog(QDialog):
 
         self._ui.sld_mem_preserve.setValue(config.get_preserved_mem())
 
+        self._master_build_progress_dialog = None
+
     @log
     def _validate_all_paths(self):
         """
@@ -117,12 +144,15 @@ class PreferencesDialog(QDialog):
             else:
                 folder_path.setStyleSheet(_NORMAL_STYLE_SHEET)
 
-        master_dark_path = self._ui.ln_master_dark_path.text()
-        if (Path(master_dark_path).is_file() or
-                (not master_dark_path and not self._ui.chk_use_dark.isChecked())):
-            self._ui.ln_master_dark_path.setStyleSheet(_NORMAL_STYLE_SHEET)
-        else:
-            self._ui.ln_master_dark_path.setStyleSheet(_WARNING_STYLE_SHEET)
+        for master_path, use_master in [(self._ui.ln_master_dark_path, self._ui.chk_use_dark),
+                                        (self._ui.ln_master_bias_path, self._ui.chk_use_bias),
+                                        (self._ui.ln_master_flat_path, self._ui.chk_use_flat)]:
+
+            if (Path(master_path.text()).is_file() or
+                    (not master_path.text() and not use_master.isChecked())):
+                master_path.setStyleSheet(_NORMAL_STYLE_SHEET)
+            else:
+                master_path.setStyleSheet(_WARNING_STYLE_SHEET)
 
     @log
     def on_chk_use_dark_toggled(self, _):
@@ -133,6 +163,35 @@ class PreferencesDialog(QDialog):
         """
         self._validate_all_paths()
 
+    @log
+    @pyqtSlot(bool)
+    def on_chk_use_hpr_toggled(self, checked):
+        """
+        Defect map is only used by hot pixel remover
+
+        :param checked: is 'use hot pixel remover' box checked ?
+        :type checked: bool
+        """
+        self._ui.chk_use_defect_map.setEnabled(checked)
+
+    @log
+    def on_chk_use_bias_toggled(self, _):
+        """
+        Triggers config values validation when chk_use_bias is toggled
+
+        :param _: unused
+        """
+        self._validate_all_paths()
+
+    @log
+    def on_chk_use_flat_toggled(self, _):
+        """
+        Triggers config values validation when chk_use_flat is toggled
+
+        :param _: unused
+        """
+        self._validate_all_paths()
+
     @log
     @pyqtSlot(bool)
     def on_chk_www_own_folder_clicked(self, checked):
@@ -154,6 +213,24 @@ class PreferencesDialog(QDialog):
         self._ui.ln_master_dark_path.clear()
         self._validate_all_paths()
 
+    @log
+    @pyqtSlot()
+    def on_btn_bias_clear_clicked(self):
+        """
+        Clears bias path input field and validate settings
+        """
+        self._ui.ln_master_bias_path.clear()
+        self._validate_all_paths()
+
+    @log
+    @pyqtSlot()
+    def on_btn_flat_clear_clicked(self):
+        """
+        Clears flat path input field and validate settings
+        """
+        self._ui.ln_master_flat_path.clear()
+        self._validate_all_paths()
+
     @log
     def on_ln_scan_folder_path_textChanged(self, text):
         """
@@ -190,17 +267,37 @@ class PreferencesDialog(QDialog):
         """
         self._ui.ln_master_dark_path.setToolTip(text)
 
+    @log
+    def on_ln_master_bias_path_textChanged(self, text):
+        """
+        Qt signal for master bias path widget text changed
+        :param text: new master bias path
+        :type text: str
+        """
+        self._ui.ln_master_bias_path.setToolTip(text)
+
+    @log
+    def on_ln_master_flat_path_textChanged(self, text):
+        """
+        Qt signal for master flat path widget text changed
+        :param text: new master flat path
+        :type text: str
+        """
+        self._ui.ln_master_flat_path.setToolTip(text)
+
     @log
     @pyqtSlot()
     def accept(self):
 
         # prepare flags for settings that require restart to take effect
         PROFILE = self.tr("Profile")
+        DEBAYER = self.tr("Debayering")
         LOG = self.tr("Debug logs")
         LANG = self.tr("Language")
 
         settings_needing_restart = {
             PROFILE: False,
+            DEBAYER: False,
             LOG: False,
             LANG: False
         }
@@ -222,7 +319,13 @@ class PreferencesDialog(QDialog):
         web_server_port_number_str = self._ui.ln_web_server_port.text()
         config.set_use_master_dark(self._ui.chk_use_dark.isChecked())
         config.set_master_dark_file_path(self._ui.ln_master_dark_path.text())
+        config.set_use_master_bias(self._ui.chk_use_bias.isChecked())
+        config.set_master_bias_file_path(self._ui.ln_master_bias_path.text())
+        config.set_use_master_flat(self._ui.chk_use_flat.isChecked())
+        config.set_master_flat_file_path(self._ui.ln_master_flat_path.text())
         config.set_hot_pixel_remover(self._ui.chk_use_hpr.isChecked())
+        config.set_hot_pixel_defect_map(self._ui.chk_use_defect_map.isChecked())
+        config.set_translation_only_alignment(self._ui.chk_translation_only_alignment.isChecked())
         config.set_save_on_stop(self._ui.chk_save_on_stop.isChecked())
 
         if web_server_port_number_str.isdigit() and 1024 <= int(web_server_port_number_str) <= 65535:
@@ -265,6 +368,13 @@ class PreferencesDialog(QDialog):
                     config.set_profile(k)
                 break
 
+        # debayering algorithms choice
+        for profile, combo in self._debayer_algorithm_config_mapping.items():
+            algorithm = combo.currentData()
+            if algorithm != config.get_debayer_algorithm(profile):
+                settings_needing_restart[DEBAYER] = True
+                config.set_debayer_algorithm(profile, algorithm)
+
         # lang choice
         lang_old_value = config.get_lang()
         lang_new_value = self._ui.cmb_lang.currentData()
@@ -339,6 +449,135 @@ class PreferencesDialog(QDialog):
 
         self._validate_all_paths()
 
+    @pyqtSlot(name="on_btn_bias_scan_clicked")
+    @log
+    def browse_bias(self):
+        """Opens a folder dialog to choose bias file"""
+        bias_file_path = QFileDialog.getOpenFileName(self,
+                                                     self.tr("Select bias file"),
+                                                     self._ui.ln_master_bias_path.text(),
+                                                     options=QFileDialog.DontUseNativeDialog)
+        if bias_file_path[0]:
+            self._ui.ln_master_bias_path.setText(bias_file_path[0])
+
+        self._validate_all_paths()
+
+    @pyqtSlot(name="on_btn_flat_scan_clicked")
+    @log
+    def browse_flat(self):
+        """Opens a folder dialog to choose flat file"""
+        flat_file_path = QFileDialog.getOpenFileName(self,
+                                                     self.tr("Select flat file"),
+                                                     self._ui.ln_master_flat_path.text(),
+                                                     options=QFileDialog.DontUseNativeDialog)
+        if flat_file_path[0]:
+            self._ui.ln_master_flat_path.setText(flat_file_path[0])
+
+        self._validate_all_paths()
+
+    @pyqtSlot(name="on_btn_dark_build_clicked")
+    @log
+    def build_dark(self):
+        """Builds a master dark from a folder of darks"""
+        self._build_master(MASTER_TYPE_DARK, self._ui.ln_master_dark_path, self._ui.chk_use_dark)
+
+    @pyqtSlot(name="on_btn_bias_build_clicked")
+    @log
+    def build_bias(self):
+        """Builds a master bias from a folder of biases"""
+        self._build_master(MASTER_TYPE_BIAS, self._ui.ln_master_bias_path, self._ui.chk_use_bias)
+
+    @pyqtSlot(name="on_btn_flat_build_clicked")
+    @log
+    def build_flat(self):
+        """Builds a master flat from a folder of flats"""
+        self._build_master(MASTER_TYPE_FLAT, self._ui.ln_master_flat_path, self._ui.chk_use_flat)
+
+    @log
+    def _build_master(self, master_type: str, master_path, use_master):
+        """
+        Asks user for frames folder and combination method, then builds master, showing progress.
+
+        Flats are bias corrected with master bias, if one is set.
+
+        :param master_type: master type
+        :type master_type: str
+
+        :param master_path: the text field receiving master path
+        :type master_path: QLineEdit
+
+        :param use_master: the checkbox enabling master use
+        :type use_master: QCheckBox
+        """
+        frames_folder = QFileDialog.getExistingDirectory(self,
+                                                         self.tr("Select folder holding frames to combine"),
+                                                         config.get_work_folder_path(),
+                                                         options=QFileDialog.DontUseNativeDialog)
+        if not frames_folder:
+            return
+
+        method, accepted = QInputDialog.getItem(self,
+                                                self.tr("Build master"),
+                                                self.tr("Combination method :"),
+                                                [MASTER_METHOD_MEDIAN, MASTER_METHOD_KAPPA_SIGMA],
+                                                0,
+                                                False)
+        if not accepted:
+            return
+
+        destination = QFileDialog.getSaveFileName(self,
+                                                  self.tr("Save master as"),
+                                                  get_default_master_path(master_type),
+                                                  "FITS (*.fits *.fit *.fts)",
+                                                  options=QFileDialog.DontUseNativeDialog)[0]
+        if not destination:
+            return
+
+        bias_path = None
+        if (master_type == MASTER_TYPE_FLAT and
+                self._ui.chk_use_bias.isChecked() and
+                Path(self._ui.ln_master_bias_path.text()).is_file()):
+            bias_path = self._ui.ln_master_bias_path.text()
+
+        builder = MasterBuilder(collect_input_paths([frames_folder])[0],
+                                method,
+                                destination,
+                                bias_path,
+                                os.cpu_count() or 1)
+        builder.progress_signal[int, int].connect(self.on_master_build_progress)
+
+        self._master_build_progress_dialog = QProgressDialog(self.tr("Building master..."), None, 0, 0, self)
+        self._master_build_progress_dialog.setWindowModality(Qt.WindowModal)
+        builder.finished.connect(self._master_build_progress_dialog.close)
+
+        builder.start()
+        self._master_build_progress_dialog.exec()
+        builder.wait()
+        self._master_build_progress_dialog = None
+
+        if builder.error:
+            error_box(self.tr("Master not built"), builder.error)
+            return
+
+        master_path.setText(destination)
+        use_master.setChecked(True)
+        self._validate_all_paths()
+
+    @pyqtSlot(int, int)
+    def on_master_build_progress(self, done: int, total: int):
+        """
+        Qt slot for master build progress
+
+        :param done: done step count
+        :type done: int
+
+        :param total: total step count
+        :type total: int
+        """
+        if self._master_build_progress_dialog is not None:
+            self._master_build_progress_dialog.setMaximum(total)
+            self._master_build_progress_dialog.setValue(done)
+
     @staticmethod
     @log
     def _save_config():
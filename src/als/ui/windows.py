@@ -57,7 +57,8 @@ class MainWindow(QMainWindow):
 
         # populate stacking mode combo box=
         self._ui.cb_stacking_mode.blockSignals(True)
-        stacking_modes = [I18n.STACKING_MODE_SUM, I18n.STACKING_MODE_MEAN]
+        stacking_modes = [I18n.STACKING_MODE_SUM, I18n.STACKING_MODE_MEAN, I18n.STACKING_MODE_KAPPA_SIGMA,
+                          I18n.STACKING_MODE_MEDIAN, I18n.STACKING_MODE_SLIDING_MEAN]
         for stacking_mode in stacking_modes:
             self._ui.cb_stacking_mode.addItem(stacking_mode)
         self._ui.cb_stacking_mode.setCurrentIndex(stacking_modes.index(self._controller.get_stacking_mode()))
@@ -183,6 +184,8 @@ class MainWindow(QMainWindow):
         self._lbl_statusbar_stack_size.setMinimumWidth(150)
         self._lbl_statusbar_stack_size.setAlignment(Qt.AlignHCenter)
         self._lbl_statusbar_stack_size.setFrameStyle(QFrame.Panel | QFrame.Sunken)
+        self._lbl_statusbar_dropped_frames = QLabel(self._ui.statusBar)
+        self._lbl_statusbar_dropped_frames.setFrameStyle(QFrame.Panel | QFrame.Sunken)
         self._lbl_statusbar_web_server_status = QLabel(self._ui.statusBar)
         self._lbl_statusbar_web_server_status.setOpenExternalLinks(True)
         self._lbl_statusbar_web_server_status.setFrameStyle(QFrame.Panel | QFrame.Sunken)
@@ -191,6 +194,7 @@ class MainWindow(QMainWindow):
         self._ui.statusBar.addPermanentWidget(self._lbl_statusbar_scanner_status)
         self._ui.statusBar.addPermanentWidget(self._lbl_statusbar_stack_size)
         self._ui.statusBar.addPermanentWidget(self._lbl_statusbar_stack_exposure)
+        self._ui.statusBar.addPermanentWidget(self._lbl_statusbar_dropped_frames)
         self._ui.statusBar.addPermanentWidget(self._lbl_statusbar_web_server_status)
         self._ui.statusBar.addPermanentWidget(self._lbl_statusbar_frame_total_proc)
 
@@ -456,6 +460,14 @@ class MainWindow(QMainWindow):
         """
         self._controller.set_stacking_mode(stacking_mode)
 
+    @pyqtSlot()
+    @log
+    def on_btn_remove_last_frame_clicked(self):
+        """
+        Qt slot executed when 'undo' button is clicked
+        """
+        self._controller.remove_last_frames(1)
+
     @log
     def on_chk_align_toggled(self, checked: bool):
         """
@@ -768,6 +780,7 @@ class MainWindow(QMainWindow):
             # handle align + stack mode buttons
             self._ui.chk_align.setEnabled(session_is_stopped)
             self._ui.cb_stacking_mode.setEnabled(session_is_stopped)
+            self._ui.btn_remove_last_frame.setEnabled(DYNAMIC_DATA.stack_size > 0)
 
             # handle web stop start buttons
             self._ui.btn_web_start.setEnabled(not web_server_is_running)
@@ -791,6 +804,8 @@ class MainWindow(QMainWindow):
             self._lbl_statusbar_stack_size.setText(f"{I18n.STACK_SIZE} : {stack_size_str}")
             self._lbl_statusbar_stack_exposure.setText(
                 self.tr("Total stack exp. time: {}").format(exposure_time_str))
+            self._lbl_statusbar_dropped_frames.setText(
+                self.tr("Dropped frames: {}").format(DYNAMIC_DATA.dropped_frame_count))
             self._lbl_statusbar_frame_total_proc.setText(
                 self.tr("Total frame proc. time: {} s").format(f"{DYNAMIC_DATA.last_timing:6.1f}"))
 
@@ -0,0 +1,144 @@
+"""
+Tests stack accumulators against numpy references
+"""
+import numpy as np
+
+from als.accumulation import FrameWindow, StackAccumulator, KappaSigmaAccumulator, MedianAccumulator
+
+_SHAPE = (3, 24, 32)
+
+
+def _generate_frames(count: int):
+    """
+    Generates noisy frames of a random field
+
+    :param count: number of frames
+    :type count: int
+
+    :return: the frames, as float32
+    :rtype: list
+    """
+    random = np.random.RandomState(0)
+    field = random.rand(*_SHAPE) * 1000
+
+    return [(field + random.normal(0, 30, _SHAPE)).astype(np.float32) for _ in range(count)]
+
+
+def test_mean_matches_reference(tmp_path):
+    """
+    Mean of accumulated frames is the numpy mean, even after latest frames are removed
+    """
+    frames = _generate_frames(8)
+    accumulator = StackAccumulator(FrameWindow(4, 64, str(tmp_path)))
+
+    for frame in frames:
+        accumulator.add(frame)
+
+    np.testing.assert_allclose(accumulator.get_mean(), np.mean(frames, axis=0), rtol=1e-6)
+
+    assert accumulator.remove_latest(3) == 3
+    assert accumulator.size == 5
+    np.testing.assert_allclose(accumulator.get_mean(), np.mean(frames[:5], axis=0), rtol=1e-6)
+
+    # only frames held by window can be removed
+    assert accumulator.remove_latest(3) == 1
+    assert accumulator.size == 4
+
+
+def test_mean_leaves_uncovered_pixels_out(tmp_path):
+    """
+    Pixels outside of a frame coverage don't count in mean
+    """
+    frames = _generate_frames(2)
+    coverage = np.ones(_SHAPE[1:], dtype=np.uint8)
+    coverage[:, :8] = 0
+    accumulator = StackAccumulator(FrameWindow(2, 64, str(tmp_path)))
+
+    accumulator.add(frames[0])
+    accumulator.add(frames[1], coverage)
+
+    expected = np.mean(frames, axis=0)
+    expected[..., :8] = frames[0][..., :8]
+    np.testing.assert_allclose(accumulator.get_mean(), expected, rtol=1e-6)
+
+    accumulator.remove_latest(1)
+    np.testing.assert_allclose(accumulator.get_mean(), frames[0], rtol=1e-6)
+
+
+def test_sliding_mean_only_holds_window(tmp_path):
+    """
+    Sliding mean is the mean of the latest frames
+    """
+    frames = _generate_frames(10)
+    accumulator = StackAccumulator(FrameWindow(4, 64, str(tmp_path)), sliding=True)
+
+    for frame in frames:
+        accumulator.add(frame)
+
+    np.testing.assert_allclose(accumulator.get_mean(), np.mean(frames[-4:], axis=0), rtol=1e-5)
+
+
+def test_kappa_sigma_rejects_outlier():
+    """
+    A value far away from the others is left out of kappa-sigma mean
+    """
+    frames = _generate_frames(12)
+    frames[9] = frames[9].copy()
+    frames[9][:, 5, 7] = 60000
+    accumulator = KappaSigmaAccumulator(3.)
+
+    for frame in frames:
+        accumulator.add(frame)
+
+    result = accumulator.get_mean()
+    kept_frames = frames[:9] + frames[10:]
+
+    np.testing.assert_allclose(result[:, 5, 7], np.mean(kept_frames, axis=0)[:, 5, 7], rtol=1e-5)
+    assert np.abs(result - np.mean(frames, axis=0))[:, 5, 7].max() > 1000
+    assert accumulator.remove_latest(1) == 0
+
+
+def test_median_of_window(tmp_path):
+    """
+    Median is the numpy median of the latest frames, whether window is kept in RAM or on disk
+    """
+    frames = _generate_frames(7)
+
+    for memory_budget_mb in [64, 0]:
+        window = FrameWindow(5, memory_budget_mb, str(tmp_path))
+        accumulator = MedianAccumulator(window)
+
+        for frame in frames:
+            accumulator.add(frame)
+
+        assert window.is_memory_mapped == (memory_budget_mb == 0)
+        np.testing.assert_array_equal(accumulator.get_result(), np.median(frames[-5:], axis=0))
+
+        # window also holds older frames : the latest of its frames is kept
+        assert accumulator.remove_latest(10) == 4
+        np.testing.assert_array_equal(accumulator.get_result(), frames[2])
+
+        window.clear()
+
+
+def test_frame_window_wraps_around(tmp_path):
+    """
+    Once full, window overwrites its oldest frames and pops them in reverse push order
+    """
+    frames = _generate_frames(6)
+    window = FrameWindow(4, 64, str(tmp_path))
+
+    for index, frame in enumerate(frames):
+        window.push(frame)
+        assert len(window) == min(index + 1, 4)
+
+    assert window.is_full
+    np.testing.assert_array_equal(window.get_oldest(), frames[2])
+
+    for frame in reversed(frames[2:]):
+        np.testing.assert_array_equal(window.pop_latest(), frame)
+
+    assert len(window) == 0
+
+    window.push(frames[0])
+    np.testing.assert_array_equal(window.get_oldest(), frames[0])
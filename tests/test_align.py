@@ -0,0 +1,150 @@
+"""
+Tests alignment on synthetic star fields
+"""
+import numpy as np
+import pytest
+from skimage.transform import SimilarityTransform
+
+from als.align import AlignmentError, ReferenceStars, TranslationReference, find_translation, refine_transform, \
+    apply_transform
+
+_SHAPE = (240, 320)
+
+
+def _generate_stars():
+    """
+    Generates random stars on a jittered grid, so centroid measurement windows never hold 2 stars
+
+    :return: (x, y) positions and fluxes
+    :rtype: tuple
+    """
+    random = np.random.RandomState(0)
+    grid_x, grid_y = np.meshgrid(np.arange(40, _SHAPE[1] - 30, 40), np.arange(40, _SHAPE[0] - 30, 40))
+    positions = np.column_stack((grid_x.ravel(), grid_y.ravel())) + random.uniform(-8, 8, (grid_x.size, 2))
+
+    return positions, random.uniform(2000, 20000, len(positions))
+
+
+def _render(positions: np.ndarray, fluxes: np.ndarray, seed: int = 1):
+    """
+    Renders gaussian stars over a noisy background
+
+    :param positions: (x, y) star positions
+    :type positions: numpy.ndarray
+
+    :param fluxes: star fluxes
+    :type fluxes: numpy.ndarray
+
+    :param seed: noise seed
+    :type seed: int
+
+    :return: the image data
+    :rtype: numpy.ndarray
+    """
+    rows, columns = np.mgrid[:_SHAPE[0], :_SHAPE[1]]
+    data = 500 + np.random.RandomState(seed).normal(0, 5, _SHAPE)
+
+    for (x, y), flux in zip(positions, fluxes):
+        data += flux / (2 * np.pi * 1.5 ** 2) * np.exp(-((columns - x) ** 2 + (rows - y) ** 2) / (2 * 1.5 ** 2))
+
+    return data.astype(np.float32)
+
+
+def _get_max_error(transformation: SimilarityTransform, expected: SimilarityTransform):
+    """
+    Measures how far a transformation puts image corners from where expected transformation puts them
+
+    :return: max distance, in pixels
+    :rtype: float
+    """
+    corners = np.array([[0, 0], [_SHAPE[1], 0], [0, _SHAPE[0]], [_SHAPE[1], _SHAPE[0]]], dtype=float)
+
+    return np.linalg.norm(transformation(corners) - expected(corners), axis=1).max()
+
+
+def test_refine_transform_fixes_coarse_error():
+    """
+    A transformation off by a few pixels is refined to subpixel accuracy using full resolution stars
+    """
+    positions, fluxes = _generate_stars()
+    reference = _render(positions, fluxes)
+    expected = SimilarityTransform(rotation=np.radians(.8), translation=(6.3, -4.1))
+    source = _render(expected.inverse(positions), fluxes, seed=2)
+    coarse = SimilarityTransform(rotation=np.radians(1.), translation=(4.5, -2.8))
+    assert _get_max_error(coarse, expected) > 2
+
+    transformation, (source_points, reference_points) = refine_transform(coarse, source, ReferenceStars(reference), 5)
+
+    assert _get_max_error(transformation, expected) < .1
+    assert len(source_points) == len(reference_points) >= 5
+
+
+def test_find_translation():
+    """
+    Subpixel translation between fields is found by phase correlation, then refined on star centroids
+    """
+    positions, fluxes = _generate_stars()
+    reference = _render(positions, fluxes)
+    expected = SimilarityTransform(translation=(-12.3, 7.6))
+    source = _render(expected.inverse(positions), fluxes, seed=2)
+
+    transformation, (source_points, reference_points) = find_translation(source, TranslationReference(reference),
+                                                                         ReferenceStars(reference), 5)
+
+    np.testing.assert_allclose(transformation.params, expected.params, atol=.05)
+    assert len(source_points) == len(reference_points) >= 5
+
+
+def test_find_translation_rejects_rotated_field():
+    """
+    Rotated fields are not taken for translated ones
+    """
+    positions, fluxes = _generate_stars()
+    reference = _render(positions, fluxes)
+    rotation = SimilarityTransform(rotation=np.radians(5))
+    source = _render(rotation.inverse(positions), fluxes, seed=2)
+
+    with pytest.raises(AlignmentError):
+        find_translation(source, TranslationReference(reference), ReferenceStars(reference), 10)
+
+
+def test_apply_whole_pixel_translation():
+    """
+    Whole pixel translations move planar color data exactly, uncovered pixels getting source background
+    """
+    data = np.random.RandomState(0).uniform(100, 200, (3,) + _SHAPE).astype(np.float32)
+    output = np.empty_like(data)
+    coverage = np.empty(_SHAPE, dtype=np.uint8)
+
+    result = apply_transform(SimilarityTransform(translation=(5, -3)), data, output, coverage)
+
+    assert result is output
+    np.testing.assert_array_equal(result[:, :-3, 5:], data[:, 3:, :-5])
+    for plane, source_plane in zip(result, data):
+        assert np.all(plane[-3:] == np.median(source_plane[::8, ::8]))
+        assert np.all(plane[:, :5] == np.median(source_plane[::8, ::8]))
+    assert coverage[:-3, 5:].all()
+    assert not coverage[-3:].any() and not coverage[:, :5].any()
+
+
+def test_apply_subpixel_transform():
+    """
+    Interpolated pixels follow a linear ramp, wherever they are only interpolated from source pixels
+    """
+    rows, columns = np.mgrid[:_SHAPE[0], :_SHAPE[1]]
+    data = (1000 + 2 * columns + 3 * rows).astype(np.float32)
+    coverage = np.empty(_SHAPE, dtype=np.uint8)
+    transformation = SimilarityTransform(rotation=np.radians(2), translation=(2.5, -1.25))
+
+    result = apply_transform(transformation, data, coverage=coverage)
+
+    source_columns, source_rows = transformation.inverse(np.column_stack((columns.ravel(), rows.ravel()))).T
+    expected = (1000 + 2 * source_columns + 3 * source_rows).reshape(_SHAPE)
+    covered = coverage.astype(bool)
+
+    assert result.dtype == np.float32
+    # OpenCV interpolates at 1/32 pixel positions, with fixed point weights : allow a tenth of a pixel error
+    np.testing.assert_allclose(result[covered], expected[covered], atol=.1 * (2 + 3))
+    assert covered[15:-15, 15:-15].all()
+    assert not covered[0, 0] and not covered[-1, 0]
+    assert result[0, 0] == pytest.approx(np.median(data[::8, ::8]))
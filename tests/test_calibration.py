@@ -0,0 +1,120 @@
+"""
+Tests light frames calibration stages
+"""
+import numpy as np
+from astropy.io import fits
+
+from als import config
+from als.calibration import subtract_saturating, ApplyFlat, HotPixelRemover
+from als.model.base import Image
+
+# levels of R, G, G and B bayer planes, in RGGB order
+_BAYER_LEVELS = np.array([[2000, 4000], [4000, 1000]])
+
+
+def _create_vignetted_bayer_data(levels: np.ndarray, shape: tuple = (8, 12)):
+    """
+    Creates RGGB bayer data, each color plane having its own level, dimmed towards image right side
+
+    :param levels: 2x2 levels of bayer cell colors
+    :type levels: numpy.ndarray
+
+    :param shape: data shape
+    :type shape: tuple
+
+    :return: the data, as float32
+    :rtype: numpy.ndarray
+    """
+    vignetting = np.linspace(1, .6, shape[1])[None, :]
+
+    return (np.tile(levels, (shape[0] // 2, shape[1] // 2)) * vignetting).astype(np.float32)
+
+
+def test_subtract_saturating_clips_to_zero():
+    """
+    Subtraction is done in place and never wraps around unsigned integers
+    """
+    data = np.array([[10, 200], [65535, 0]], dtype=np.uint16)
+    image = Image(data)
+
+    subtract_saturating(image, np.array([[20, 100], [1, 5]], dtype=np.uint16))
+
+    assert image.data is data
+    np.testing.assert_array_equal(image.data, [[0, 100], [65534, 0]])
+
+
+def test_subtract_saturating_read_only_data():
+    """
+    Read-only data, like memory mapped files, is replaced instead of being modified
+    """
+    data = np.array([100, 5, 42], dtype=np.uint16)
+    data.flags.writeable = False
+    image = Image(data)
+
+    subtract_saturating(image, np.array([40, 40, 40], dtype=np.uint16))
+
+    np.testing.assert_array_equal(image.data, [60, 0, 2])
+    np.testing.assert_array_equal(data, [100, 5, 42])
+
+
+def test_flat_keeps_bayer_color_balance(tmp_path, monkeypatch):
+    """
+    Flat is normalized per bayer color plane, even when bayer pattern is forced instead of being read from files,
+    and integer results are rounded
+    """
+    flat_path = tmp_path / "flat.fits"
+    fits.PrimaryHDU(_create_vignetted_bayer_data(_BAYER_LEVELS)).writeto(str(flat_path))
+    monkeypatch.setattr(config, "get_use_master_flat", lambda: True)
+    monkeypatch.setattr(config, "get_master_flat_file_path", lambda: str(flat_path))
+    monkeypatch.setattr(config, "get_bayer_pattern", lambda: "RGGB")
+
+    light_levels = np.array([[300, 500], [500, 150]])
+    light = Image(np.rint(_create_vignetted_bayer_data(light_levels)).astype(np.uint16))
+
+    corrected = ApplyFlat().process_image(light)
+
+    # flat correction removes vignetting, and each color keeps its level, scaled by its mean flat vignetting
+    vignetting = _create_vignetted_bayer_data(np.ones((2, 2)))[0]
+    assert corrected.data.dtype == np.uint16
+    for row in range(2):
+        for column in range(2):
+            expected = light_levels[row, column] * vignetting[column::2].mean()
+            np.testing.assert_allclose(corrected.data[row::2, column::2], expected, atol=1)
+
+
+def test_defect_map_fixes_dark_hot_pixels(tmp_path, monkeypatch):
+    """
+    With defect map, lights only get hot pixels of master dark fixed, using neighbors of the same bayer color
+    """
+    dark_data = np.full((10, 12), 100, dtype=np.uint16)
+    dark_data[4, 6] = 3000
+    dark_data[0, 1] = 3000
+    dark_path = tmp_path / "dark.fits"
+    fits.PrimaryHDU(dark_data).writeto(str(dark_path))
+    monkeypatch.setattr(config, "get_hot_pixel_remover", lambda: True)
+    monkeypatch.setattr(config, "get_hot_pixel_defect_map", lambda: True)
+    monkeypatch.setattr(config, "get_use_master_dark", lambda: True)
+    monkeypatch.setattr(config, "get_master_dark_file_path", lambda: str(dark_path))
+
+    light_data = np.rint(_create_vignetted_bayer_data(_BAYER_LEVELS, (10, 12))).astype(np.uint16)
+    expected = light_data.copy()
+    light_data[4, 6] = light_data[0, 1] = 60000
+    # not hot in dark : left as is
+    light_data[7, 7] = expected[7, 7] = 60000
+    light = Image(light_data)
+    light.bayer_pattern = "RGGB"
+
+    remover = HotPixelRemover()
+    fixed = remover.process_image(light)
+
+    np.testing.assert_array_equal(remover._defect_map_cache._data, [1, 4 * 12 + 6])
+    # fixed values are truncated to light data type. Image border is mirrored : same color neighbors of (0, 1) are on
+    # rows 2, 0, 2 and columns 3, 1, 3
+    for (row, column), neighbor_rows, neighbor_columns in [((4, 6), (2, 4, 6), (4, 6, 8)),
+                                                           ((0, 1), (2, 0, 2), (3, 1, 3))]:
+        neighbor_mean = np.mean([expected[neighbor_row, neighbor_column]
+                                 for neighbor_row in neighbor_rows for neighbor_column in neighbor_columns
+                                 if (neighbor_row, neighbor_column) != (row, column)])
+        assert fixed.data[row, column] == int(neighbor_mean)
+    np.testing.assert_array_equal(np.delete(fixed.data.ravel(), [1, 4 * 12 + 6]),
+                                  np.delete(expected.ravel(), [1, 4 * 12 + 6]))
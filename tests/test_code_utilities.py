@@ -0,0 +1,60 @@
+"""
+Tests bounded queue policies
+"""
+from als.code_utilities import SignalingQueue, QUEUE_POLICY_DROP_OLDEST, QUEUE_POLICY_KEEP_LATEST
+
+
+def _drain(queue: SignalingQueue):
+    """
+    Gets all queued items
+
+    :param queue: the queue
+    :type queue: SignalingQueue
+
+    :return: the items, in queue order
+    :rtype: list
+    """
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+        queue.task_done()
+
+    return items
+
+
+def test_drop_oldest_keeps_capacity_latest_items():
+    """
+    A full drop oldest queue drops its oldest item to accept a new one
+    """
+    queue = SignalingQueue()
+    queue.set_policy(QUEUE_POLICY_DROP_OLDEST, 3)
+    dropped_counts = []
+    queue.items_dropped_signal.connect(dropped_counts.append)
+
+    for item in range(5):
+        queue.put(item)
+
+    assert queue.is_full
+    assert queue.dropped_count == 2
+    assert dropped_counts == [1, 1]
+    assert _drain(queue) == [2, 3, 4]
+
+
+def test_keep_latest_only_keeps_last_item():
+    """
+    A keep latest queue drops all queued items when a new one comes in, whatever its capacity
+    """
+    queue = SignalingQueue()
+    queue.set_policy(QUEUE_POLICY_KEEP_LATEST, 5)
+    sizes = []
+    queue.size_changed_signal.connect(sizes.append)
+
+    for item in range(4):
+        queue.put(item)
+
+    assert queue.dropped_count == 3
+    assert sizes == [1, 1, 1, 1]
+    assert _drain(queue) == [3]
+
+    # dropped items are not waited for by join()
+    assert queue.unfinished_tasks == 0
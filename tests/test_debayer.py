@@ -0,0 +1,144 @@
+"""
+Tests debayering algorithms on uniform color bayer data
+"""
+import numpy as np
+import pytest
+
+from als import config
+from als.crunching import superpixel_debayer, bilinear_debayer
+from als.model.base import Image, PhotoProfile, DEBAYER_SUPERPIXEL, DEBAYER_BILINEAR, DEBAYER_EDGE_AWARE, \
+    DEBAYER_VNG, DEBAYER_AT_OUTPUT
+from als.processing import Debayer, ProcessingError
+
+_COLOR = {'R': 100, 'G': 200, 'B': 50}
+
+_BAYER_PATTERNS = ["RGGB", "BGGR", "GRBG", "GBRG"]
+
+
+@pytest.fixture(autouse=True)
+def auto_bayer_pattern(monkeypatch):
+    """
+    Bayer pattern is read from images, whatever user preferences are
+    """
+    monkeypatch.setattr(config, "get_bayer_pattern", lambda: "AUTO")
+
+
+def _mosaic(bayer_pattern: str, dtype=np.uint16, shape: tuple = (12, 16)):
+    """
+    Builds bayer data of a uniform _COLOR image
+
+    :param bayer_pattern: the bayer pattern
+    :type bayer_pattern: str
+
+    :param dtype: data type
+    :type dtype: type
+
+    :param shape: data shape
+    :type shape: tuple
+
+    :return: the bayer data
+    :rtype: numpy.ndarray
+    """
+    cell = np.array([_COLOR[color] for color in bayer_pattern]).reshape(2, 2)
+
+    return np.tile(cell, (shape[0] // 2, shape[1] // 2)).astype(dtype)
+
+
+def _create_bayer_image(bayer_pattern: str, dtype=np.uint16):
+    """
+    Creates a bayer image of a uniform _COLOR image
+
+    :return: the image
+    :rtype: Image
+    """
+    image = Image(_mosaic(bayer_pattern, dtype))
+    image.bayer_pattern = bayer_pattern
+
+    return image
+
+
+def _create_profile(algorithm: str):
+    """
+    Creates a photo profile using a debayering algorithm
+
+    :return: the profile
+    :rtype: PhotoProfile
+    """
+    profile = PhotoProfile()
+    profile.set_debayer_algorithm(algorithm)
+
+    return profile
+
+
+@pytest.mark.parametrize("bayer_pattern", _BAYER_PATTERNS)
+def test_superpixel_debayer(bayer_pattern):
+    """
+    Each bayer cell becomes a pixel of the cell color, an odd last row and column being dropped
+    """
+    data = np.zeros((13, 17), dtype=np.uint16)
+    data[:12, :16] = _mosaic(bayer_pattern)
+
+    result = superpixel_debayer(data, bayer_pattern)
+
+    assert result.shape == (6, 8, 3)
+    assert result.dtype == np.uint16
+    np.testing.assert_array_equal(result, np.broadcast_to([100, 200, 50], result.shape))
+
+
+@pytest.mark.parametrize("bayer_pattern", _BAYER_PATTERNS)
+def test_bilinear_debayer_of_float_data(bayer_pattern):
+    """
+    Bilinear interpolation of float data gives back uniform colors, up to image borders
+    """
+    result = bilinear_debayer(_mosaic(bayer_pattern, np.float32), bayer_pattern)
+
+    assert result.shape == (12, 16, 3)
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, np.broadcast_to([100, 200, 50], result.shape), rtol=1e-6)
+
+
+@pytest.mark.parametrize("algorithm", [DEBAYER_SUPERPIXEL, DEBAYER_BILINEAR, DEBAYER_EDGE_AWARE, DEBAYER_VNG])
+@pytest.mark.parametrize("bayer_pattern", _BAYER_PATTERNS)
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+def test_debayer_algorithms(algorithm, bayer_pattern, dtype):
+    """
+    Each algorithm gives back uniform colors with color axis last, at least away from image borders
+    """
+    image = Debayer(_create_profile(algorithm)).process_image(_create_bayer_image(bayer_pattern, dtype))
+
+    expected_shape = (6, 8, 3) if algorithm == DEBAYER_SUPERPIXEL else (12, 16, 3)
+    assert image.data.shape == expected_shape
+    assert image.data.dtype == dtype
+    assert image.is_color()
+    inner_data = image.data[2:-2, 2:-2]
+    np.testing.assert_array_equal(inner_data, np.broadcast_to([100, 200, 50], inner_data.shape))
+
+
+def test_debayer_at_output():
+    """
+    Incoming images are left as bayer data, and stacking results are debayered without being modified
+    """
+    profile = _create_profile(DEBAYER_AT_OUTPUT)
+    image = _create_bayer_image("GRBG")
+
+    assert Debayer(profile).process_image(image).data.shape == (12, 16)
+
+    result = image.clone()
+    result.data = result.data.astype(np.float32)
+    debayered = Debayer(profile, at_output=True).process_image(result)
+
+    assert debayered is not result
+    assert result.data.shape == (12, 16)
+    assert debayered.data.shape == (3, 12, 16)
+    np.testing.assert_allclose(debayered.data[:, 0, 0], [100, 200, 50])
+
+
+def test_unsupported_bayer_pattern():
+    """
+    Bayer patterns that are not made of 1 red, 2 green and 1 blue cells are rejected
+    """
+    image = _create_bayer_image("RGGB")
+    image.bayer_pattern = "RGBB"
+
+    with pytest.raises(ProcessingError):
+        Debayer(_create_profile(DEBAYER_BILINEAR)).process_image(image)
@@ -0,0 +1,88 @@
+"""
+Tests folder scanner file completion and network filesystem detection
+"""
+import threading
+from collections import namedtuple
+
+import psutil
+from PyQt5.QtCore import Qt
+from watchdog.events import FileClosedEvent, FileCreatedEvent, FileMovedEvent
+
+from als.model.base import PhotoProfile
+from als.streams.folder import FolderScanner, _is_on_network_filesystem
+
+
+def _create_scanner():
+    """
+    Creates a folder scanner, not started, recording the paths it broadcasts
+
+    :return: the scanner and the list of broadcast paths
+    :rtype: tuple
+    """
+    scanner = FolderScanner(PhotoProfile())
+    broadcast_paths = []
+    # paths may be broadcast from other threads, without any Qt event loop running
+    scanner.new_image_path_signal[str].connect(broadcast_paths.append, Qt.DirectConnection)
+
+    return scanner, broadcast_paths
+
+
+def test_closed_file_is_broadcast_once(tmp_path):
+    """
+    A file found complete by both close event and stability checker is only broadcast once
+    """
+    scanner, broadcast_paths = _create_scanner()
+    path = str(tmp_path / "light.fits")
+
+    scanner.on_created(FileCreatedEvent(path))
+
+    threads = [threading.Thread(target=scanner.on_closed, args=(FileClosedEvent(path), )) for _ in range(4)]
+    threads.append(threading.Thread(target=scanner._declare_file_complete, args=(path, )))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert broadcast_paths == [path]
+
+
+def test_file_closed_without_creation_is_ignored(tmp_path):
+    """
+    Files we did not see created, like files only read by other programs, are not broadcast when closed
+    """
+    scanner, broadcast_paths = _create_scanner()
+
+    scanner.on_closed(FileClosedEvent(str(tmp_path / "light.fits")))
+
+    assert not broadcast_paths
+
+
+def test_moved_file_is_broadcast(tmp_path):
+    """
+    A file moved into scanned folder is complete at once, under its new name
+    """
+    scanner, broadcast_paths = _create_scanner()
+    temporary_path = str(tmp_path / "light.tmp")
+    path = str(tmp_path / "light.fits")
+
+    scanner.on_created(FileCreatedEvent(temporary_path))
+    scanner.on_moved(FileMovedEvent(temporary_path, path))
+    scanner.on_closed(FileClosedEvent(path))
+
+    assert broadcast_paths == [path]
+
+
+def test_network_mount_is_found_by_path_components(monkeypatch):
+    """
+    A path belongs to the longest mount point it is below, comparing whole path components
+    """
+    partition = namedtuple("partition", ["mountpoint", "fstype", "opts"])
+    partitions = [partition("/", "ext4", "rw"),
+                  partition("/mnt/nas", "nfs4", "rw"),
+                  partition("/mnt/nas/local", "ext4", "rw")]
+    monkeypatch.setattr(psutil, "disk_partitions", lambda *args, **kwargs: partitions)
+
+    assert _is_on_network_filesystem("/mnt/nas")
+    assert _is_on_network_filesystem("/mnt/nas/scan")
+    assert not _is_on_network_filesystem("/mnt/nas2/scan")
+    assert not _is_on_network_filesystem("/mnt/nas/local/scan")
@@ -0,0 +1,164 @@
+"""
+Tests metadata index invalidation
+"""
+import os
+
+import numpy as np
+import pytest
+
+from als import config
+from als.model.base import Image
+from als.streams.index import MetadataIndex
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    """
+    Metadata index stored in a temporary work folder
+    """
+    work_folder = tmp_path / "work"
+    work_folder.mkdir()
+    monkeypatch.setattr(config, "get_work_folder_path", lambda: str(work_folder))
+
+    return MetadataIndex()
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    """
+    File standing for an image file : index only looks at its size, modification time and partial hash
+    """
+    path = tmp_path / "light.fits"
+    path.write_bytes(b"\0" * 64)
+
+    return path
+
+
+def _create_image():
+    """
+    Creates a small bayer image
+
+    :return: the image
+    :rtype: Image
+    """
+    image = Image(np.zeros((4, 6), dtype=np.uint16))
+    image.bayer_pattern = "RGGB"
+    image.exposure_time = 2.5
+
+    return image
+
+
+def test_unchanged_file_is_found(index, image_file):
+    """
+    Entry of an unchanged file holds recorded metadata
+    """
+    image = _create_image()
+    index.record_image(image_file, image)
+
+    entry = index.lookup(image_file)
+
+    assert entry is not None
+    assert entry.shape == (4, 6)
+    assert entry.dtype == "uint16"
+    assert entry.bayer_pattern == "RGGB"
+    assert entry.exposure_time == 2.5
+    assert entry.matches(image)
+
+
+def test_resized_file_is_outdated(index, image_file):
+    """
+    Entry of a file whose size changed is not used
+    """
+    index.record_image(image_file, _create_image())
+
+    with image_file.open("ab") as file:
+        file.write(b"\0")
+
+    assert index.lookup(image_file) is None
+
+
+def test_touched_file_is_outdated(index, image_file):
+    """
+    Entry of a file whose modification time changed is not used, even if its size did not
+    """
+    index.record_image(image_file, _create_image())
+
+    stat = image_file.stat()
+    os.utime(image_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert index.lookup(image_file) is None
+
+    index.record_image(image_file, _create_image())
+    assert index.lookup(image_file) is not None
+
+
+def _rewrite_in_place(path, offset: int, content: bytes):
+    """
+    Overwrites part of a file, keeping its size and modification time
+
+    :param path: path of the file
+    :type path: Path
+
+    :param offset: where to write, from file start
+    :type offset: int
+
+    :param content: bytes written
+    :type content: bytes
+    """
+    stat = path.stat()
+
+    with path.open("r+b") as file:
+        file.seek(offset)
+        file.write(content)
+
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert path.stat().st_size == stat.st_size
+
+
+def test_rewritten_file_is_outdated(index, image_file):
+    """
+    Entry of a file rewritten in place with the same size and modification time is not used
+    """
+    index.record_image(image_file, _create_image())
+
+    _rewrite_in_place(image_file, 0, b"SIMPLE")
+
+    assert index.lookup(image_file) is None
+
+
+def test_rewritten_large_file_tail_is_outdated(index, tmp_path):
+    """
+    Partial hash of a large file covers its trailing data, not only its headers
+    """
+    path = tmp_path / "light.cr2"
+    path.write_bytes(b"\0" * 1024 ** 2)
+    index.record_image(path, _create_image())
+    assert index.lookup(path) is not None
+
+    _rewrite_in_place(path, 1024 ** 2 - 16, b"\1" * 16)
+
+    assert index.lookup(path) is None
+
+
+def test_rejected_file_never_matches(index, image_file):
+    """
+    Entry of a file that could not be decoded does not match any image
+    """
+    index.record_rejected(image_file)
+
+    entry = index.lookup(image_file)
+
+    assert entry.rejected
+    assert not entry.matches(_create_image())
+
+
+def test_other_content_does_not_match(index, image_file):
+    """
+    Entry does not match an image read from a file rewritten with the same size and modification time
+    """
+    index.record_image(image_file, _create_image())
+
+    other_image = Image(np.zeros((4, 6), dtype=np.float32))
+    other_image.bayer_pattern = "RGGB"
+
+    assert not index.lookup(image_file).matches(other_image)
@@ -0,0 +1,128 @@
+"""
+Tests INDI scanner against the replay server found in utils
+"""
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from PyQt5.QtCore import Qt
+
+from als import config
+from als.streams.input import IndiScanner
+
+_REPLAY_SERVER_PATH = Path(__file__).parent.parent / "utils" / "indi_replay_server.py"
+
+_TIMEOUT = 30
+
+
+def _get_free_port():
+    """
+    Finds a local TCP port nobody listens to
+
+    :return: the port
+    :rtype: int
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _wait_for_server(port: int):
+    """
+    Waits until a server listens to a local port
+
+    :param port: the port
+    :type port: int
+    """
+    deadline = time.time() + _TIMEOUT
+
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(.1)
+
+
+@pytest.fixture
+def samples(tmp_path):
+    """
+    FITS files replayed by server, in replay order : a bayer frame and a color frame
+
+    :return: data and header of each file
+    :rtype: list
+    """
+    random = np.random.RandomState(0)
+    bayer_header = fits.Header({"BAYERPAT": "RGGB", "EXPTIME": 2.5})
+    samples = [(random.randint(0, 65535, (24, 32)).astype(np.uint16), bayer_header),
+               (random.rand(3, 16, 20).astype(np.float32), fits.Header())]
+
+    for index, (data, header) in enumerate(samples):
+        fits.PrimaryHDU(data, header).writeto(str(tmp_path / f"light_{index}.fits"))
+
+    return samples
+
+
+@pytest.fixture
+def replay_server_port(tmp_path, samples):
+    """
+    Runs replay server on a free local port, without delay between frames
+
+    :return: the port
+    :rtype: int
+    """
+    port = _get_free_port()
+    server = subprocess.Popen([sys.executable, str(_REPLAY_SERVER_PATH), "-p", str(port), "-d", "0",
+                               "-s", str(tmp_path)],
+                              stdout=subprocess.DEVNULL)
+
+    try:
+        _wait_for_server(port)
+        yield port
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def test_replayed_blobs_are_received(replay_server_port, samples, monkeypatch):
+    """
+    Each replayed FITS file is received as an image, with its data and headers
+    """
+    monkeypatch.setattr(config, "get_indi_server_host", lambda: "127.0.0.1")
+    monkeypatch.setattr(config, "get_indi_server_port", lambda: replay_server_port)
+    monkeypatch.setattr(config, "get_indi_device_name", lambda: "")
+
+    scanner = IndiScanner()
+    images = []
+    all_received = threading.Event()
+
+    def on_new_image(image):
+        images.append(image)
+        if len(images) == len(samples):
+            all_received.set()
+
+    # images are broadcast from scanner receiver thread, without any Qt event loop running
+    scanner.new_image_signal.connect(on_new_image, Qt.DirectConnection)
+
+    scanner.start()
+    try:
+        assert all_received.wait(_TIMEOUT)
+    finally:
+        scanner.stop()
+
+    for image, (data, _) in zip(images, samples):
+        assert image.data.shape == data.shape
+        np.testing.assert_array_equal(image.data, data)
+        assert image.origin.startswith("INDI : ALS Replay CCD #")
+
+    assert images[0].bayer_pattern == "RGGB"
+    assert images[0].exposure_time == 2.5
+    assert images[1].is_color()
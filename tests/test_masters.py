@@ -0,0 +1,98 @@
+"""
+Tests master combination, strip sizing and build error reporting
+"""
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from astropy.io import fits
+
+from als import masters
+from als.masters import kappa_sigma_combine, _compute_strip_size, MasterBuilder, MASTER_METHOD_KAPPA_SIGMA
+
+
+def test_kappa_sigma_rejects_outlier():
+    """
+    A value far away from the others is left out of the mean, other pixels get the plain mean
+    """
+    random = np.random.RandomState(0)
+    strip = (100 + random.normal(0, 2, (15, 64))).astype(np.float32)
+    strip[6, 10] = 5000
+    expected = np.mean(np.delete(strip[:, 10], 6))
+    plain_mean = np.mean(strip, axis=0)
+
+    combined = kappa_sigma_combine(strip.copy(), 3., 3)
+
+    np.testing.assert_allclose(combined[10], expected, rtol=1e-5)
+    np.testing.assert_allclose(np.delete(combined, 10), np.delete(plain_mean, 10), rtol=1e-3)
+
+
+def test_kappa_sigma_without_rejection_is_mean():
+    """
+    Identical values are never rejected, and never give NaN
+    """
+    strip = np.full((5, 8), 42, dtype=np.float32)
+
+    combined = kappa_sigma_combine(strip, 3., 3)
+
+    np.testing.assert_array_equal(combined, np.full(8, 42, dtype=np.float32))
+    assert not np.isnan(strip).any()
+
+
+def test_strip_size_fits_budget():
+    """
+    Strips being combined by all workers at the same time fit in memory budget
+    """
+    frame_count = 50
+    worker_count = 4
+    memory_budget_mb = 256
+
+    strip_size = _compute_strip_size(frame_count, 10 ** 8, worker_count, memory_budget_mb)
+
+    assert strip_size * frame_count * masters._STRIP_MEMORY_FACTOR * worker_count <= memory_budget_mb * 2 ** 20
+    assert strip_size > 1024
+
+
+def test_strip_size_bounds():
+    """
+    Strips are never larger than a frame, nor smaller than 1024 pixels whatever the budget
+    """
+    assert _compute_strip_size(10, 5000, 1, 1024) == 5000
+    assert _compute_strip_size(10 ** 6, 10 ** 8, 8, 1) == 1024
+    assert _compute_strip_size(10, 10 ** 8, 0, 1) > 0
+
+
+def test_builder_reports_worker_failure(monkeypatch):
+    """
+    Worker pool failures are stored as builder error instead of being raised
+    """
+    def broken_build(*args, **kwargs):
+        raise BrokenProcessPool("worker killed")
+
+    monkeypatch.setattr(masters, "build_master", broken_build)
+    builder = MasterBuilder(["dark.fits"], MASTER_METHOD_KAPPA_SIGMA, "master.fits")
+
+    builder.run()
+
+    assert "worker killed" in builder.error
+
+
+def test_build_master(tmp_path):
+    """
+    Master built from FITS frames is their combination, with frames data type, and no cube file is left behind
+    """
+    random = np.random.RandomState(1)
+    frames = [(1000 + random.normal(0, 10, (16, 24))).astype(np.uint16) for _ in range(5)]
+    frames_folder = tmp_path / "darks"
+    frames_folder.mkdir()
+    for index, frame in enumerate(frames):
+        fits.PrimaryHDU(frame).writeto(str(frames_folder / f"dark_{index}.fits"))
+    destination = tmp_path / "master.fits"
+
+    frame_count = masters.build_master(sorted(frames_folder.iterdir()), masters.MASTER_METHOD_MEDIAN,
+                                       str(destination))
+
+    assert frame_count == 5
+    master = fits.getdata(str(destination))
+    assert master.dtype == np.uint16
+    np.testing.assert_array_equal(master, np.rint(np.median(frames, axis=0)))
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["darks", "master.fits"]
@@ -0,0 +1,134 @@
+"""
+Tests running pre-processors in worker processes, and passing their results back through shared memory
+"""
+import gc
+import os
+import time
+
+import numpy as np
+import pytest
+from PyQt5.QtCore import Qt
+
+from als.code_utilities import SignalingQueue
+from als.model.base import Image
+from als.processing import ImageProcessor, ProcessingError, ParallelPipeline, create_process_pool, \
+    submit_to_process_pool, get_process_pool_result, shared_memory, _write_shared_data, _read_shared_data
+
+_needs_proc = pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc to count file descriptors")
+
+
+class _FillProcessor(ImageProcessor):
+    """
+    Turns a number into an image filled with it. Negative numbers give processing errors
+    """
+
+    def process_image(self, image):
+        if image < 0:
+            raise ProcessingError(f"negative value : {image}")
+
+        return Image(np.full((20, 30), image, dtype=np.float32))
+
+
+class _SlowProcessor(ImageProcessor):
+    """
+    Takes longer on smaller images, so items retrieved first are processed last
+    """
+
+    def process_image(self, image: Image):
+        time.sleep(.2 / (1 + float(image.data[0, 0])))
+        return image
+
+
+class _DoubleProcessor(ImageProcessor):
+    """
+    Doubles image data
+    """
+
+    def process_image(self, image: Image):
+        image.data *= 2
+        return image
+
+
+def _count_open_file_descriptors():
+    """
+    Counts file descriptors opened by current process
+
+    :return: the count
+    :rtype: int
+    """
+    return len(os.listdir("/proc/self/fd"))
+
+
+def test_shared_data_round_trip():
+    """
+    Data read back from shared memory is the data written, and outlives the block it was read from
+    """
+    data = np.arange(12 * 16, dtype=np.uint16).reshape(12, 16)
+
+    result = _read_shared_data(*_write_shared_data(data))
+    gc.collect()
+
+    np.testing.assert_array_equal(result, data)
+    assert result.dtype == data.dtype
+
+
+@_needs_proc
+def test_shared_data_does_not_leak_file_descriptors():
+    """
+    File descriptors of shared memory blocks are released along with data read from them
+    """
+    _read_shared_data(*_write_shared_data(np.zeros((4, 4), dtype=np.float32)))
+    gc.collect()
+    initial_count = _count_open_file_descriptors()
+
+    for index in range(200):
+        result = _read_shared_data(*_write_shared_data(np.full((32, 48), index, dtype=np.float32)))
+        assert result[0, 0] == index
+
+    del result
+    gc.collect()
+
+    assert _count_open_file_descriptors() <= initial_count
+
+
+def test_process_pool_results():
+    """
+    Images processed by pool workers are handed back with their data, in shared memory if available, and processing
+    errors give no image
+    """
+    with create_process_pool([_FillProcessor(), _DoubleProcessor()], 2) as executor:
+        futures = [submit_to_process_pool(executor, value) for value in [1, -1, 3]]
+        results = [get_process_pool_result(future) for future in futures]
+
+    assert results[1] is None
+    for value, image in zip([1, 3], [results[0], results[2]]):
+        assert image.data.shape == (20, 30)
+        assert image.data.dtype == np.float32
+        assert np.all(image.data == 2 * value)
+        # data wraps a shared memory block instead of being unpickled
+        assert image.data.flags.owndata == (shared_memory is None)
+
+
+def test_parallel_pipeline_emits_results_in_queue_order():
+    """
+    Results are emitted in the order items were queued, whatever order workers finish them in
+    """
+    queue = SignalingQueue()
+    pipeline = ParallelPipeline("test", queue, [_DoubleProcessor()], 3)
+    pipeline.add_process(_FillProcessor())
+    pipeline.add_process(_SlowProcessor())
+    results = []
+    # results are emitted from pipeline thread, without any Qt event loop running
+    pipeline.new_result_signal.connect(lambda image: results.append(image.data[0, 0]), Qt.DirectConnection)
+
+    for value in [0, 1, -1, 2, 3, 4]:
+        queue.put(value)
+    pipeline.start()
+
+    deadline = time.time() + 30
+    while len(results) < 5 and time.time() < deadline:
+        time.sleep(.05)
+    pipeline.stop()
+    pipeline.wait()
+
+    assert results == [0, 2, 4, 6, 8]
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+Minimal stand-in INDI server, replaying FITS files as camera BLOBs.
+
+The purpose of this script is to simulate an astrophoto session driven by INDI, without any INDI installation.
+
+It defines a single CCD device with a single BLOB property. Once a client enables BLOBs for that device, every FITS
+file found in the samples folder is sent to it, base64 encoded in a setBLOBVector message, with a fixed delay
+between frames.
+
+Usage :
+
+    python utils/indi_replay_server.py [-p 7624] [-d 5] [-s image_samples] [--loop]
+
+Then set ALS config keys 'scanner_type' to INDI, 'indi_server_host' and 'indi_server_port' accordingly.
+"""
+import base64
+import socketserver
+import threading
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+DEVICE_NAME = "ALS Replay CCD"
+PROPERTY_NAME = "CCD1"
+BLOB_NAME = "CCD1"
+
+DEF_BLOB_VECTOR = (f'<defBLOBVector device="{DEVICE_NAME}" name="{PROPERTY_NAME}" label="Image Data" '
+                   f'group="Image Info" state="Idle" perm="ro" timeout="60">\n'
+                   f'  <defBLOB name="{BLOB_NAME}" label="Image"/>\n'
+                   f'</defBLOBVector>\n')
+
+
+class ReplayHandler(socketserver.BaseRequestHandler):
+    """
+    Serves a single INDI client
+    """
+
+    def handle(self):
+        blob_enabled = threading.Event()
+        reader = threading.Thread(target=self._read_client_messages, args=(blob_enabled, ), daemon=True)
+        reader.start()
+
+        try:
+            self.request.sendall(DEF_BLOB_VECTOR.encode())
+
+            while not blob_enabled.wait(1):
+                if not reader.is_alive():
+                    return
+
+            while True:
+                for path in self.server.sample_paths:
+                    time.sleep(self.server.delay)
+                    print(f"Sending {path.name}")
+                    self.request.sendall(build_set_blob_vector(path))
+
+                if not self.server.loop:
+                    return
+
+        except OSError as error:
+            print(f"Client connection lost : {error}")
+
+    def _read_client_messages(self, blob_enabled: threading.Event):
+        """
+        Reads client messages, only looking for BLOB enabling
+
+        :param blob_enabled: event set when client enables BLOBs
+        :type blob_enabled: threading.Event
+        """
+        received = b""
+
+        while True:
+            try:
+                chunk = self.request.recv(4096)
+            except OSError:
+                return
+
+            if not chunk:
+                return
+
+            received += chunk
+            if b"<enableBLOB" in received and b"Never" not in received:
+                blob_enabled.set()
+
+
+def build_set_blob_vector(path: Path):
+    """
+    Builds a setBLOBVector message holding a FITS file
+
+    :param path: path of the FITS file
+    :type path: Path
+
+    :return: the message
+    :rtype: bytes
+    """
+    content = path.read_bytes()
+
+    return (f'<setBLOBVector device="{DEVICE_NAME}" name="{PROPERTY_NAME}" state="Ok">\n'
+            f'  <oneBLOB name="{BLOB_NAME}" size="{len(content)}" format=".fits">\n'.encode()
+            + base64.b64encode(content)
+            + b'\n  </oneBLOB>\n</setBLOBVector>\n')
+
+
+def main():
+    """
+    Runs the server
+    """
+    parser = ArgumentParser()
+    parser.add_argument("-p", "--port", type=int, default=7624, help="listening port")
+    parser.add_argument("-d", "--delay", type=float, default=5, help="delay between frames, in seconds")
+    parser.add_argument("-s", "--samples", default=str(Path(__file__).parent.parent / "image_samples"),
+                        help="folder holding FITS files to replay")
+    parser.add_argument("--loop", action="store_true", help="replay samples forever")
+    args = parser.parse_args()
+
+    sample_paths = sorted(path for path in Path(args.samples).iterdir()
+                          if path.suffix.lower() in ['.fit', '.fits', '.fts'])
+
+    if not sample_paths:
+        print(f"No FITS file found in {args.samples}")
+        return
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    with socketserver.ThreadingTCPServer(("", args.port), ReplayHandler) as server:
+        server.daemon_threads = True
+        server.sample_paths = sample_paths
+        server.delay = args.delay
+        server.loop = args.loop
+        print(f"Replaying {len(sample_paths)} FITS files on port {args.port} as device '{DEVICE_NAME}'")
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()